@@ -1,12 +1,15 @@
 import os
 import argparse
-from typing import Any, Callable, Dict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
 import questionary
 
 from depalma_napari_omero.omero_client._project import (
     OmeroController,
     OmeroProjectManager,
 )
+from depalma_napari_omero.omero_client._queue import WorkQueue
+import depalma_napari_omero.omero_client._utils as utils
 from mousetumorpy import NNUNET_MODELS, YOLO_MODELS
 
 
@@ -188,7 +191,19 @@ def interactive(controller: OmeroController) -> str:
 
 
 def run_all_workflows(
-    controller: OmeroController, project_id: int, lungs_model: str, tumor_model: str
+    controller: OmeroController,
+    project_id: int,
+    lungs_model: str,
+    tumor_model: str,
+    n_workers: int = 0,
+    batch_size: int = 1,
+    fused: bool = False,
+    incremental: bool = False,
+    share_registrations: bool = False,
+    resume: bool = False,
+    dag: bool = False,
+    n_io: int = 2,
+    refresh: bool = False,
 ) -> None:
     """Run all workflows on a given OMERO project"""
     for project_name, omero_project_id in controller.projects.items():
@@ -199,15 +214,155 @@ def run_all_workflows(
             f"Could not find project with ID {project_id} among available projects: {list(controller.projects.values())}"
         )
 
-    project = controller.set_project(project_id, project_name, launch_scan=True)
+    project = controller.set_project(project_id, project_name, launch_scan=not resume)
+    project.registrations.share = share_registrations
+
+    if resume:
+        # Finish the interrupted jobs first; they are known without scanning the project
+        n_jobs = project.resume_jobs(n_workers=n_workers, batch_size=batch_size)
+        print(f"Resumed {n_jobs} interrupted jobs.")
+        project.scanner.update()
 
     project.scanner.view.print_summary()
 
+    if refresh:
+        # Outdated outputs are deleted, so that they are computed again with the missing ones
+        project.refresh_outdated(
+            ask_confirm=False, lungs_model=lungs_model, tumor_model=tumor_model
+        )
+
+    if dag:
+        project.batch_workflow(
+            lungs_model,
+            tumor_model,
+            n_workers=n_workers,
+            n_io=n_io,
+            incremental=incremental,
+        )
+        return
+
     if len(project.scanner.view.roi_missing) or len(project.scanner.view.pred_missing): # type: ignore
-        if len(project.scanner.view.roi_missing): # type: ignore
-            project.batch_roi(lungs_model, ask_confirm=False)
-        project.batch_nnunet(tumor_model, ask_confirm=False)
-    project.batch_track()
+        if fused:
+            project.batch_fused(
+                lungs_model,
+                tumor_model,
+                ask_confirm=False,
+                n_workers=n_workers,
+                batch_size=batch_size,
+            )
+        else:
+            if len(project.scanner.view.roi_missing): # type: ignore
+                project.batch_roi(lungs_model, ask_confirm=False, n_workers=n_workers)
+            project.batch_nnunet(
+                tumor_model, ask_confirm=False, n_workers=n_workers, batch_size=batch_size
+            )
+    project.batch_track(n_workers=n_workers, incremental=incremental)
+
+
+def _find_project_name(controller: OmeroController, project_id: int) -> str:
+    for project_name, omero_project_id in controller.projects.items():
+        if project_id == omero_project_id:
+            return project_name
+
+    raise ValueError(
+        f"Could not find project with ID {project_id} among available projects: {list(controller.projects.values())}"
+    )
+
+
+def enqueue_jobs(
+    controller: OmeroController,
+    project_id: int,
+    lungs_model: str,
+    tumor_model: str,
+    queue_path: Optional[str] = None,
+    incremental: bool = False,
+) -> None:
+    """Add the missing work of an OMERO project to a work queue"""
+    project_name = _find_project_name(controller, project_id)
+    project = controller.set_project(project_id, project_name, launch_scan=True)
+    project.scanner.view.print_summary()
+
+    queue = WorkQueue(queue_path if queue_path is not None else project.queue_path)
+    n_items = project.enqueue_jobs(queue, lungs_model, tumor_model, incremental)
+    print(f"✅ Added {n_items} items to the work queue: {queue.path} ({queue.counts()}).")
+
+
+def run_worker(
+    controller: OmeroController,
+    project_id: int,
+    queue_path: Optional[str] = None,
+    n_workers: int = 0,
+    lease_seconds: float = 120,
+    wait: bool = False,
+) -> None:
+    """Process the items of a work queue"""
+    project_name = _find_project_name(controller, project_id)
+    project = controller.set_project(project_id, project_name, launch_scan=False)
+
+    queue = WorkQueue(queue_path if queue_path is not None else project.queue_path)
+    n_done = project.run_worker(
+        queue, n_workers=n_workers, lease_seconds=lease_seconds, wait=wait
+    )
+    print(f"✅ Processed {n_done} items ({queue.counts()}).")
+
+
+def watch_project(
+    controller: OmeroController,
+    project_id: int,
+    lungs_model: str,
+    tumor_model: str,
+    interval: float = 60,
+    n_workers: int = 0,
+    batch_size: int = 1,
+) -> None:
+    """Process the new scans of an OMERO project as they are uploaded"""
+    project_name = _find_project_name(controller, project_id)
+    project = controller.set_project(project_id, project_name, launch_scan=True)
+
+    print(f"Watching project {project_name} (ID={project_id}) every {interval} seconds. Press [Ctrl+C] to stop.")
+    try:
+        project.watch(
+            lungs_model,
+            tumor_model,
+            interval=interval,
+            n_workers=n_workers,
+            batch_size=batch_size,
+        )
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+
+
+def export_project(
+    controller: OmeroController,
+    project_id: int,
+    out_dir: str,
+    n_workers: int = 4,
+    results_only: bool = False,
+    results_format: str = "csv",
+    columns: Optional[List[str]] = None,
+    zarr: bool = False,
+) -> None:
+    """Download the data of every case of an OMERO project"""
+    project_name = _find_project_name(controller, project_id)
+    project = controller.set_project(project_id, project_name, launch_scan=True)
+
+    save_path = Path(out_dir).resolve()
+
+    if results_only:
+        # Only the tracking tables, without downloading any image
+        out_file = save_path / f"Project_{project.id}_tracking_results.{results_format}"
+        project.export_results(out_file, n_workers=n_workers, column_prefixes=columns)
+        print(f"✅ Saved {out_file}")
+        return
+
+    for _ in project.download_all_cases(save_path, n_workers=n_workers, zarr=zarr):
+        continue
+
+    # Also save all tracking results in a single CSV
+    project_dir = save_path / project.name
+    out_csv_path = project_dir / f"Project_{project.id}_tracking_results.csv"
+    utils.save_merged_csv(project_dir, out_csv_path)
+    print(f"✅ Saved {out_csv_path}")
 
 
 def main():
@@ -240,6 +395,228 @@ def main():
         help="Tumor model to use",
     )
 
+    run_parser.add_argument(
+        "--workers",
+        default=0,
+        type=int,
+        help="Number of CPU worker processes for inference and tracking (0: run in the main process)",
+    )
+
+    run_parser.add_argument(
+        "--batch-size",
+        default=1,
+        type=int,
+        help="Number of ROIs of similar shapes predicted together in a single nnUNet run",
+    )
+
+    run_parser.add_argument(
+        "--fused",
+        action="store_true",
+        help="Compute the ROI and tumor mask of each image in a single pass",
+    )
+
+    run_parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Update existing tracking tables with the newly added scans",
+    )
+
+    run_parser.add_argument(
+        "--share-registrations",
+        action="store_true",
+        help="Also keep the lungs registration transforms on OMERO, so that other machines can reuse them",
+    )
+
+    run_parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Finish the jobs of an interrupted run (from the local job ledger) before scanning the project",
+    )
+
+    run_parser.add_argument(
+        "--dag",
+        action="store_true",
+        help="Start each step of each image and case as soon as its inputs are ready, instead of running the steps one after the other",
+    )
+
+    run_parser.add_argument(
+        "--io-workers",
+        default=2,
+        type=int,
+        help="Number of concurrent downloads and uploads (with --dag)",
+    )
+
+    run_parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Compute again the ROIs, tumor masks and tracking tables whose source images were replaced, or that were computed with other models",
+    )
+
+    export_parser = subparsers.add_parser(
+        "export", help="Download the data of every case of an OMERO project (run again to resume)"
+    )
+
+    export_parser.add_argument(
+        "project_id",
+        help="OMERO Project ID",
+        type=int,
+    )
+
+    export_parser.add_argument(
+        "out_dir",
+        help="Output folder",
+    )
+
+    export_parser.add_argument(
+        "--workers",
+        default=4,
+        type=int,
+        help="Number of cases downloaded at once, each over its own OMERO session",
+    )
+
+    export_parser.add_argument(
+        "--zarr",
+        action="store_true",
+        help="Save the timeseries as chunked, compressed OME-Zarr images instead of TIFF files (requires zarr)",
+    )
+
+    export_parser.add_argument(
+        "--results-only",
+        action="store_true",
+        help="Only save the merged tracking results of all cases (no images)",
+    )
+
+    export_parser.add_argument(
+        "--format",
+        default="csv",
+        choices=["csv", "parquet"],
+        help="File format of the tracking results (Parquet requires pyarrow)",
+    )
+
+    export_parser.add_argument(
+        "--columns",
+        nargs="+",
+        default=None,
+        help="With --results-only, only read the columns starting with these names (e.g. 'Tumor ID' volume)",
+    )
+
+    watch_parser = subparsers.add_parser(
+        "watch", help="Process the new scans of an OMERO project as they are uploaded"
+    )
+
+    watch_parser.add_argument(
+        "project_id",
+        help="OMERO Project ID",
+        type=int,
+    )
+
+    watch_parser.add_argument(
+        "--lungs-model",
+        default="v1",
+        choices=list(YOLO_MODELS.keys()),
+        help="Lungs model to use",
+    )
+
+    watch_parser.add_argument(
+        "--tumor-model",
+        default="oct24",
+        choices=list(NNUNET_MODELS.keys()),
+        help="Tumor model to use",
+    )
+
+    watch_parser.add_argument(
+        "--interval",
+        default=60,
+        type=float,
+        help="Seconds between two checks for new scans",
+    )
+
+    watch_parser.add_argument(
+        "--workers",
+        default=0,
+        type=int,
+        help="Number of CPU worker processes for inference and tracking (0: run in the main process)",
+    )
+
+    watch_parser.add_argument(
+        "--batch-size",
+        default=1,
+        type=int,
+        help="Number of ROIs of similar shapes predicted together in a single nnUNet run",
+    )
+
+    enqueue_parser = subparsers.add_parser(
+        "enqueue", help="Add the missing work of an OMERO project to a work queue, for `dno worker` processes"
+    )
+
+    enqueue_parser.add_argument(
+        "project_id",
+        help="OMERO Project ID",
+        type=int,
+    )
+
+    enqueue_parser.add_argument(
+        "--lungs-model",
+        default="v1",
+        choices=list(YOLO_MODELS.keys()),
+        help="Lungs model to use",
+    )
+
+    enqueue_parser.add_argument(
+        "--tumor-model",
+        default="oct24",
+        choices=list(NNUNET_MODELS.keys()),
+        help="Tumor model to use",
+    )
+
+    enqueue_parser.add_argument(
+        "--queue",
+        default=None,
+        help="Path of the work queue file (put it on a shared filesystem to run workers on several hosts)",
+    )
+
+    enqueue_parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Update existing tracking tables with the newly added scans",
+    )
+
+    worker_parser = subparsers.add_parser(
+        "worker", help="Process the items of a work queue (several workers can run at once)"
+    )
+
+    worker_parser.add_argument(
+        "project_id",
+        help="OMERO Project ID",
+        type=int,
+    )
+
+    worker_parser.add_argument(
+        "--queue",
+        default=None,
+        help="Path of the work queue file",
+    )
+
+    worker_parser.add_argument(
+        "--workers",
+        default=0,
+        type=int,
+        help="Number of CPU worker processes for inference and tracking (0: run in the main process)",
+    )
+
+    worker_parser.add_argument(
+        "--lease",
+        default=120,
+        type=float,
+        help="Seconds after which the items of a worker that stopped sending heartbeats are handed to other workers",
+    )
+
+    worker_parser.add_argument(
+        "--wait",
+        action="store_true",
+        help="Keep waiting for new items when the queue is empty",
+    )
+
     args = parser.parse_args()
 
     if args.command == "interactive":
@@ -248,7 +625,62 @@ def main():
     elif args.command == "run":
         controller = handle_login()
         run_all_workflows(
-            controller, args.project_id, args.lungs_model, args.tumor_model
+            controller,
+            args.project_id,
+            args.lungs_model,
+            args.tumor_model,
+            n_workers=args.workers,
+            batch_size=args.batch_size,
+            fused=args.fused,
+            incremental=args.incremental,
+            share_registrations=args.share_registrations,
+            resume=args.resume,
+            dag=args.dag,
+            n_io=args.io_workers,
+            refresh=args.refresh,
+        )
+    elif args.command == "export":
+        controller = handle_login()
+        export_project(
+            controller,
+            args.project_id,
+            args.out_dir,
+            n_workers=args.workers,
+            results_only=args.results_only,
+            results_format=args.format,
+            columns=args.columns,
+            zarr=args.zarr,
+        )
+    elif args.command == "watch":
+        controller = handle_login()
+        watch_project(
+            controller,
+            args.project_id,
+            args.lungs_model,
+            args.tumor_model,
+            interval=args.interval,
+            n_workers=args.workers,
+            batch_size=args.batch_size,
+        )
+    elif args.command == "enqueue":
+        controller = handle_login()
+        enqueue_jobs(
+            controller,
+            args.project_id,
+            args.lungs_model,
+            args.tumor_model,
+            queue_path=args.queue,
+            incremental=args.incremental,
+        )
+    elif args.command == "worker":
+        controller = handle_login()
+        run_worker(
+            controller,
+            args.project_id,
+            queue_path=args.queue,
+            n_workers=args.workers,
+            lease_seconds=args.lease,
+            wait=args.wait,
         )
     else:
         parser.print_help()
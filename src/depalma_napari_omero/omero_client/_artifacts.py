@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+import pooch
+
+
+class ArtifactStore:
+    """Local store of arrays derived from OMERO images (e.g. lungs masks), keyed by OMERO image ID.
+
+    Arrays are saved as `.npy` files under `<root>/<namespace>/<image_id>/<name>.npy`.
+    """
+
+    def __init__(
+        self,
+        namespace: str = "default",
+        root: Optional[Union[str, Path]] = None,
+    ):
+        if root is None:
+            root = Path(pooch.os_cache("depalma-napari-omero")) / "artifacts"
+        self.root = Path(root) / namespace
+
+    def _path(self, image_id: int, name: str) -> Path:
+        return self.root / str(int(image_id)) / f"{name}.npy"
+
+    def has(self, image_id: int, name: str) -> bool:
+        return self._path(image_id, name).exists()
+
+    def get(self, image_id: int, name: str) -> Optional[np.ndarray]:
+        """Returns the stored array, or `None` if it is not in the store."""
+        path = self._path(image_id, name)
+        if not path.exists():
+            return None
+        try:
+            return np.load(path)
+        except (OSError, ValueError):
+            print(f"⚠️ Could not read {path}. Ignoring it.")
+            return None
+
+    def put(self, image_id: int, name: str, array: np.ndarray) -> None:
+        path = self._path(image_id, name)
+        if not path.parent.exists():
+            os.makedirs(path.parent, exist_ok=True)
+
+        # Write to a temporary file first, so that readers never see a partial array
+        with tempfile.NamedTemporaryFile(dir=path.parent, suffix=".npy", delete=False) as temp_file:
+            np.save(temp_file, array)
+        os.replace(temp_file.name, path)
+
+    def delete(self, image_id: int, name: str) -> None:
+        path = self._path(image_id, name)
+        if path.exists():
+            path.unlink()
+
+    def remove(self, image_id: int) -> None:
+        shutil.rmtree(self.root / str(int(image_id)), ignore_errors=True)
@@ -1,14 +1,16 @@
 import os
+import shutil
 import tempfile
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Callable, Dict, List, Optional
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
 
 import ezomero
-import geojson
 import numpy as np
 import pandas as pd
 import pooch
 from aicsimageio.writers.ome_tiff_writer import OmeTiffWriter
+from ezomero._importer import Importer
 from ezomero.rois import Polygon
 from omero.gateway import (
     BlitzGateway,
@@ -19,9 +21,13 @@ from omero.gateway import (
     _ImageWrapper,
     _RoiWrapper,
 )
+from omero.model import PolygonI
+from omero.rtypes import unwrap
+from omero.sys import ParametersI
+from skimage.draw import polygon as draw_polygon
 from skimage.exposure import rescale_intensity
 
-from imaging_server_kit.types._mask import mask2features, features2instance_mask_3d
+from imaging_server_kit.types._mask import mask2features
 
 from depalma_napari_omero.omero_client.omero_config import OmeroConfig
 
@@ -41,6 +47,24 @@ def require_active_conn(func: Callable):
     return wrapper
 
 
+def rasterize_polygons(
+    polygons: List[Tuple[int, int, np.ndarray]], shape: Tuple[int, int, int]
+) -> np.ndarray:
+    """Fills polygons (ROI number, Z, (x, y) points) into a (Z, Y, X) labels volume, with the ROI number as label."""
+    mask = np.zeros(shape, dtype=np.uint16)
+    for detection_id, z_idx, points in polygons:
+        rr, cc = draw_polygon(points[:, 1], points[:, 0], shape[1:])
+        mask[z_idx, rr, cc] = detection_id
+    return mask
+
+
+def _table_data_to_df(data, row_ids: Sequence[int]) -> pd.DataFrame:
+    """Converts the `Data` read from the OMERO tables service into a DataFrame indexed by row number."""
+    return pd.DataFrame(
+        {col.name: list(col.values) for col in data.columns}, index=list(row_ids)
+    )
+
+
 class OmeroClient:
     def __init__(
         self, user: str, password: str, omero_cfg: Optional[OmeroConfig] = None
@@ -108,6 +132,26 @@ class OmeroClient:
             raise LookupError(f"Dataset with ID {dataset_id} was not found on OMERO.")
         return obj
 
+    @require_active_conn
+    def get_dataset_markers(self, project_id: int) -> Dict[int, Tuple[int, int]]:
+        """Returns the number of images and the highest image ID of each dataset of a project, in a single query."""
+        params = ParametersI()
+        params.addId(project_id)
+        rows = self.conn.getQueryService().projection(  # type: ignore
+            "select d.id, count(i.id), max(i.id) from ProjectDatasetLink pdl join pdl.child d "
+            "left outer join d.imageLinks dil left outer join dil.child i "
+            "where pdl.parent.id = :id group by d.id",
+            params,
+            self.conn.SERVICE_OPTS,  # type: ignore
+        )
+
+        markers = {}
+        for row in rows:
+            dataset_id, n_images, max_image_id = [unwrap(value) for value in row]
+            markers[int(dataset_id)] = (int(n_images), int(max_image_id or 0))
+
+        return markers
+
     @require_active_conn
     def get_image(self, image_id: int) -> _ImageWrapper:
         obj = self.conn.getObject("Image", image_id)  # type: ignore
@@ -124,11 +168,83 @@ class OmeroClient:
         return ezomero.get_shape(self.conn, shape_id)  # type: ignore
 
     @require_active_conn
-    def get_table(self, table_id: int) -> pd.DataFrame:
-        obj = ezomero.get_table(self.conn, table_id)  # type: ignore
-        if obj is None:
+    def get_table(
+        self,
+        table_id: int,
+        columns: Optional[List[str]] = None,
+        start: int = 0,
+        stop: Optional[int] = None,
+        query: Optional[str] = None,
+    ) -> pd.DataFrame:
+        """Reads a table, or only some of its `columns` and rows (from `start` to `stop`, and matching `query`).
+
+        `query` is a condition of the OMERO tables service, e.g. `"(volume > 100) & (label != 0)"`.
+        """
+        chunks = list(self.iter_table(table_id, columns, start, stop, query))
+        return pd.concat(chunks) if len(chunks) > 1 else chunks[0]
+
+    @contextmanager
+    def _open_table(self, table_id: int):
+        """Opens a table in the OMERO tables service (closed on exit)."""
+        ann = self.conn.getObject("FileAnnotation", table_id)  # type: ignore
+        if ann is None:
             raise LookupError(f"Table with ID {table_id} was not found on OMERO.")
-        return obj
+
+        table = self.conn.c.sf.sharedResources().openTable(ann.getFile()._obj)  # type: ignore
+        if table is None:
+            raise LookupError(f"File annotation with ID {table_id} is not a table.")
+
+        try:
+            yield table
+        finally:
+            table.close()
+
+    @require_active_conn
+    def get_table_columns(self, table_id: int) -> List[str]:
+        """Returns the column names of a table, without reading its rows."""
+        with self._open_table(table_id) as table:
+            return [col.name for col in table.getHeaders()]
+
+    @require_active_conn
+    def iter_table(
+        self,
+        table_id: int,
+        columns: Optional[List[str]] = None,
+        start: int = 0,
+        stop: Optional[int] = None,
+        query: Optional[str] = None,
+        chunk_size: int = 10_000,
+    ) -> Iterator[pd.DataFrame]:
+        """Same as `get_table`, yielding the rows `chunk_size` at a time. The index holds the row numbers in the table."""
+        with self._open_table(table_id) as table:
+            headers = [col.name for col in table.getHeaders()]
+            if columns is None:
+                columns = headers
+            unknown_columns = [col for col in columns if col not in headers]
+            if len(unknown_columns) > 0:
+                raise ValueError(f"Columns {unknown_columns} not found in table {table_id} (columns: {headers}).")
+            col_idx = [headers.index(col) for col in columns]
+
+            n_rows = table.getNumberOfRows()
+            stop = n_rows if stop is None else min(stop, n_rows)
+
+            if query is None:
+                # Contiguous reads
+                for chunk_start in range(start, stop, chunk_size):
+                    chunk_stop = min(chunk_start + chunk_size, stop)
+                    data = table.read(col_idx, chunk_start, chunk_stop)
+                    yield _table_data_to_df(data, range(chunk_start, chunk_stop))
+                if start >= stop:
+                    yield pd.DataFrame(columns=columns)
+            else:
+                # The rows are filtered on the server, only the matching ones are transferred
+                row_ids = list(table.getWhereList(query, {}, start, stop, 1))
+                for k in range(0, len(row_ids), chunk_size):
+                    chunk_row_ids = row_ids[k : k + chunk_size]
+                    data = table.slice(col_idx, chunk_row_ids)
+                    yield _table_data_to_df(data, chunk_row_ids)
+                if len(row_ids) == 0:
+                    yield pd.DataFrame(columns=columns)
 
     @require_active_conn
     def get_tag(self, tag_id: int):
@@ -162,6 +278,87 @@ class OmeroClient:
                 table_ids.append(ann_id)
         return table_ids
 
+    @require_active_conn
+    def get_image_tables(self, image_id: int) -> Dict[int, str]:
+        """Returns the IDs and titles of the tables attached to an image."""
+        tables = {}
+        for ann in self.get_image(image_id).listAnnotations():
+            if isinstance(ann, FileAnnotationWrapper):
+                tables[ann.getId()] = ann.getFile().getName()
+        return tables
+
+    @require_active_conn
+    def get_image_map_annotation(self, image_id: int, namespace: str) -> Optional[Dict[str, str]]:
+        """Returns the key-value pairs of the (latest) map annotation of an image in a namespace."""
+        ann_ids = ezomero.get_map_annotation_ids(self.conn, "Image", image_id, ns=namespace)  # type: ignore
+        if len(ann_ids) == 0:
+            return
+        return ezomero.get_map_annotation(self.conn, ann_ids[-1])  # type: ignore
+
+    @require_active_conn
+    def set_image_map_annotation(self, image_id: int, namespace: str, kv_dict: Dict[str, str]) -> int:
+        """Attaches a map annotation to an image, replacing the ones it had in that namespace."""
+        old_ann_ids = ezomero.get_map_annotation_ids(self.conn, "Image", image_id, ns=namespace)  # type: ignore
+        ann_id = ezomero.post_map_annotation(self.conn, "Image", image_id, kv_dict, namespace)  # type: ignore
+        if len(old_ann_ids) > 0:
+            self.conn.deleteObjects("Annotation", old_ann_ids, wait=True)  # type: ignore
+        return ann_id
+
+    @require_active_conn
+    def get_map_annotations(
+        self, project_id: int, namespace: str, dataset_id: Optional[int] = None
+    ) -> Dict[int, Dict[str, str]]:
+        """Maps the IDs of the images of a project (or of one of its datasets) to the key-value pairs of their
+        (latest) map annotation in `namespace`, in a single query."""
+        params = ParametersI()
+        params.addId(project_id)
+        params.addString("ns", namespace)
+        query = (
+            "select i.id, a.id, mv.name, mv.value from ProjectDatasetLink pdl join pdl.child d "
+            "join d.imageLinks dil join dil.child i join i.annotationLinks ial join ial.child a "
+            "join a.mapValue mv where pdl.parent.id = :id and a.ns = :ns"
+        )
+        if dataset_id is not None:
+            params.addLong("did", dataset_id)
+            query += " and d.id = :did"
+
+        rows = self.conn.getQueryService().projection(  # type: ignore
+            query + " order by a.id", params, self.conn.SERVICE_OPTS  # type: ignore
+        )
+
+        annotations: Dict[int, Tuple[int, Dict[str, str]]] = {}
+        for row in rows:
+            image_id, ann_id, key, value = [unwrap(v) for v in row]
+            if (int(image_id) not in annotations) or (annotations[int(image_id)][0] != ann_id):
+                annotations[int(image_id)] = (ann_id, {})
+            annotations[int(image_id)][1][key] = value
+
+        return {image_id: kv_dict for image_id, (_, kv_dict) in annotations.items()}
+
+    @require_active_conn
+    def get_content_hashes(self, project_id: int, namespace: str) -> Dict[Tuple[int, str], int]:
+        """Maps the (dataset ID, content hash) of the images of a project to their image ID, in a single query.
+
+        The hashes are read from the `hash` key of the map annotations of the images in `namespace`.
+        """
+        params = ParametersI()
+        params.addId(project_id)
+        params.addString("ns", namespace)
+        rows = self.conn.getQueryService().projection(  # type: ignore
+            "select d.id, i.id, mv.value from ProjectDatasetLink pdl join pdl.child d "
+            "join d.imageLinks dil join dil.child i join i.annotationLinks ial join ial.child a "
+            "join a.mapValue mv where pdl.parent.id = :id and a.ns = :ns and mv.name = 'hash'",
+            params,
+            self.conn.SERVICE_OPTS,  # type: ignore
+        )
+
+        hashes = {}
+        for row in rows:
+            dataset_id, image_id, image_hash = [unwrap(value) for value in row]
+            hashes[(int(dataset_id), image_hash)] = int(image_id)
+
+        return hashes
+
     @require_active_conn
     def import_image_to_ds(
         self, image: np.ndarray, project_id: int, dataset_id: int, image_name: str
@@ -200,6 +397,76 @@ class OmeroClient:
                 f"An error occurred while importing an image to omero (name: {image_name} ; {project_id=} ; {dataset_id=})"
             )
 
+    @require_active_conn
+    def import_images_to_ds(
+        self,
+        images: List[np.ndarray],
+        project_id: int,
+        dataset_id: int,
+        image_names: List[str],
+    ) -> List[int]:
+        """Imports several images into a dataset with a single run of the importer, and returns their IDs (in the same order).
+
+        The images are matched to their IDs by name, so images with the same name are imported in separate runs.
+        """
+        cache_dir = pooch.os_cache("depalma-napari-omero")
+        if not cache_dir.exists():
+            os.makedirs(cache_dir)
+
+        stems = [Path(image_name).stem for image_name in image_names]
+        posted_ids: Dict[int, int] = {}
+        remaining = list(range(len(images)))
+        while len(remaining) > 0:
+            # One run per set of unique names
+            run, seen = [], set()
+            for idx in remaining:
+                if stems[idx] not in seen:
+                    run.append(idx)
+                    seen.add(stems[idx])
+            remaining = [idx for idx in remaining if idx not in run]
+
+            staging_dir = Path(tempfile.mkdtemp(prefix="import_", dir=cache_dir))
+            try:
+                for idx in run:
+                    OmeTiffWriter.save(images[idx], staging_dir / f"{stems[idx]}.ome.tif", dim_order="ZYX")
+
+                # Import the whole folder directly into the dataset (`ezomero.ezimport` only reports the first fileset)
+                importer = Importer(
+                    self.conn, str(staging_dir), None, None, None, None, None,
+                    target=f"Dataset:id:{int(dataset_id)}",
+                )
+                if not importer.ezimport():
+                    raise RuntimeError(
+                        f"An error occurred while importing images to omero (names: {[image_names[idx] for idx in run]} ; {project_id=} ; {dataset_id=})"
+                    )
+                image_ids = [image_id for fileset in importer.import_result for image_id in fileset["Image"]]
+            finally:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+
+            run_ids = {stems[idx]: idx for idx in run}
+            for image_id in image_ids:
+                name = self.get_image(image_id).getName().removesuffix(".ome.tif")
+                if name in run_ids:
+                    posted_ids[run_ids[name]] = image_id
+
+            missing = [image_names[idx] for idx in run if idx not in posted_ids]
+            if len(missing) > 0:
+                raise RuntimeError(f"Could not find the imported images on OMERO: {missing}")
+
+        return [posted_ids[idx] for idx in range(len(images))]
+
+    @require_active_conn
+    def get_image_shape(self, image_id: int) -> Tuple[int, int, int]:
+        """Returns the (Z, Y, X) shape of an image from its metadata, without downloading it."""
+        image = self.get_image(image_id)
+
+        # Workaround - For images that were not imported as OME-TIFF, the Z dimension is interpreted as T
+        size_z = image.getSizeZ()
+        if size_z == 1:
+            size_z = image.getSizeT()
+
+        return (size_z, image.getSizeY(), image.getSizeX())
+
     @require_active_conn
     def download_image(self, image_id: int) -> np.ndarray:
         ez_image = ezomero.get_image(self.conn, image_id)[1]  # type: ignore
@@ -245,6 +512,10 @@ class OmeroClient:
     ) -> int:
         return ezomero.post_table(self.conn, table, "Image", image_id, table_title)  # type: ignore
 
+    @require_active_conn
+    def delete_table(self, table_id: int) -> None:
+        self.conn.deleteObjects("FileAnnotation", [table_id], wait=True)  # type: ignore
+
     @require_active_conn
     def post_dataset(self, project_id: int, dataset_name: str) -> int:
         dataset_id = ezomero.post_dataset(self.conn, dataset_name, project_id)  # type: ignore
@@ -297,44 +568,28 @@ class OmeroClient:
         return roi_id
 
     @require_active_conn
-    def download_binary_mask_from_image_rois(self, image_id) -> np.ndarray:
-        all_roi_ids = self.get_image_rois(image_id)
-        image = self.get_image(image_id)
-
-        # Workaround - For images that were not imported as OME-TIFF, the Z dimension is interpreted as T
-        size_z = image.getSizeZ()
-        if size_z == 1:
-            size_z = image.getSizeT()
-
-        img_shape = (
-            size_z,
-            image.getSizeY(),
-            image.getSizeX(),
-        )
-
-        features = []
-        for detection_id, roi_id in enumerate(all_roi_ids, start=1):
-            roi_shape_ids = self.get_roi_shapes(roi_id=roi_id)
-            for shape_id in roi_shape_ids:  # Different Z
-                geometry = self.get_shape(shape_id=shape_id)
-                z_idx = geometry.z
-                coords = geometry.points  # List of tuples (x, y)
-                coords = np.array(coords)
-                coords = np.vstack([coords, coords[0]])  # Close the polygon for QuPath
-                geom = geojson.Polygon(coordinates=[coords.tolist()])
-                feature = geojson.Feature(
-                    geometry=geom,
-                    properties={
-                        "Detection ID": detection_id,
-                        "Class": 1,
-                        "z_idx": z_idx,
-                    },
+    def get_image_polygons(self, image_id: int) -> List[Tuple[int, int, np.ndarray]]:
+        """Returns the polygons of all the ROIs of an image as (ROI number, Z, (x, y) points), in a single call to the ROI service."""
+        result = self.conn.getRoiService().findByImage(image_id, None, self.conn.SERVICE_OPTS)  # type: ignore
+
+        polygons = []
+        for detection_id, roi in enumerate(result.rois, start=1):
+            for shape in roi.copyShapes():  # Different Z
+                if not isinstance(shape, PolygonI):
+                    continue
+                z_idx = unwrap(shape.getTheZ())
+                points = [point.split(",") for point in unwrap(shape.getPoints()).split()]
+                polygons.append(
+                    (detection_id, z_idx if z_idx is not None else 0, np.array(points, dtype=float))
                 )
-                features.append(feature)
 
-        mask = features2instance_mask_3d(features, img_shape)
+        return polygons
 
-        return mask
+    @require_active_conn
+    def download_binary_mask_from_image_rois(self, image_id) -> np.ndarray:
+        polygons = self.get_image_polygons(image_id)
+        img_shape = self.get_image_shape(image_id)
+        return rasterize_polygons(polygons, img_shape)
 
     @require_active_conn
     def create_tag(self, project_id: int, tag: str) -> int:
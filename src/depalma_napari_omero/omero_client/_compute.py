@@ -1,15 +1,29 @@
 import re
-from typing import List
-
-from mousetumorpy import (
-    LungsPredictor,
-    TumorPredictor,
-    combine_images,
-    run_tracking,
-    to_formatted_df,
-)
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from functools import partial
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+from mousetumorpy import to_formatted_df
 
+from depalma_napari_omero.omero_client._artifacts import ArtifactStore
 from depalma_napari_omero.omero_client._client import OmeroClient
+from depalma_napari_omero.omero_client._context import ImageContext
+from depalma_napari_omero.omero_client._inference import (
+    track_scan_pairs,
+    track_timeseries,
+)
+from depalma_napari_omero.omero_client._ledger import JobLedger
+from depalma_napari_omero.omero_client._pool import ComputePool, SharedArray, from_shared
+from depalma_napari_omero.omero_client._provenance import (
+    record_provenance,
+    record_tracking_provenance,
+)
+from depalma_napari_omero.omero_client._registration import RegistrationCache
+from depalma_napari_omero.omero_client._stats import attach_tumor_statistics
+from depalma_napari_omero.omero_client._timeseries import stack_timeseries
 
 
 def find_image_tag(img_tags) -> list:
@@ -20,122 +34,682 @@ def find_image_tag(img_tags) -> list:
     return image_tag
 
 
-def _compute_roi(
-    model,
+def _find_upload(
+    ledger: Optional[JobLedger],
+    stage: str,
+    image_id: int,
+    model: Optional[str],
+    omero_client: OmeroClient,
+) -> Optional[int]:
+    """Returns the ID of the image that an interrupted job already uploaded with the same model, if it is still on OMERO."""
+    if ledger is None:
+        return
+
+    if (model is not None) and (ledger.model(stage, image_id) != model):
+        return
+
+    posted_image_id = ledger.output_id(stage, image_id)
+    if posted_image_id is None:
+        return
+
+    try:
+        omero_client.get_image(posted_image_id)
+    except LookupError:
+        return
+
+    return posted_image_id
+
+
+def _import_staged(
+    staged: List[Tuple[ImageContext, Optional[tuple]]],
+    stage: str,
+    image_name: Callable[[ImageContext], str],
+    project_id: int,
+    omero_client: OmeroClient,
+    ledger: JobLedger,
+    model: str,
+) -> None:
+    """Imports the first output of the staged results, with one importer run per dataset, and records the uploads in the ledger."""
+    by_dataset: Dict[int, List[Tuple[ImageContext, np.ndarray]]] = {}
+    for ctx, outputs in staged:
+        if outputs is None or _find_upload(ledger, stage, ctx.image_id, model, omero_client) is not None:  # type: ignore
+            continue
+        by_dataset.setdefault(ctx.dataset_id, []).append((ctx, outputs[0]))  # type: ignore
+
+    for dataset_id, items in by_dataset.items():
+        try:
+            posted_image_ids = omero_client.import_images_to_ds(
+                [image for _, image in items],
+                project_id,
+                dataset_id,
+                [image_name(ctx) for ctx, _ in items],
+            )
+        except Exception as e:
+            # The images are then imported one by one
+            print(f"⚠️ Could not import these images together (Dataset ID: {dataset_id}): {e}")
+            continue
+        for (ctx, _), posted_image_id in zip(items, posted_image_ids):
+            ledger.set_state(stage, ctx.image_id, "uploaded", posted_image_id, model)  # type: ignore
+
+
+def _staged_imports(
+    results: Iterable[Tuple[ImageContext, Optional[tuple]]],
+    stage: str,
+    image_name: Callable[[ImageContext], str],
+    project_id: int,
+    omero_client: OmeroClient,
+    ledger: JobLedger,
+    model: str,
+    save_outputs: Optional[Callable[[ImageContext, tuple], None]] = None,
+    n_staged: int = 8,
+) -> Iterator[Tuple[ImageContext, Optional[tuple]]]:
+    """Passes `results` through, `n_staged` at a time, after importing their images together.
+
+    `_upload_roi` and `_upload_nnunet` then find the uploads in the ledger instead of importing each image.
+    If the run stops (an error, or the generator is closed) while outputs are staged, they are passed to
+    `save_outputs`, so that the next run can resume them.
+    """
+    staged: Deque[Tuple[ImageContext, Optional[tuple]]] = deque()
+    try:
+        for ctx, outputs in results:
+            staged.append((ctx, outputs))
+            if len(staged) >= n_staged:
+                _import_staged(list(staged), stage, image_name, project_id, omero_client, ledger, model)
+                while len(staged) > 0:
+                    yield staged.popleft()
+
+        if len(staged) > 0:
+            _import_staged(list(staged), stage, image_name, project_id, omero_client, ledger, model)
+            while len(staged) > 0:
+                yield staged.popleft()
+    except BaseException:
+        if save_outputs is not None:
+            for ctx, outputs in staged:
+                if outputs is not None:
+                    save_outputs(ctx, outputs)
+        raise
+
+
+def _upload_roi(
+    roi: np.ndarray,
+    lungs_roi: np.ndarray,
     image_name: str,
     image_id: int,
     dataset_id: int,
     project_id: int,
     omero_client: OmeroClient,
-):
-    predictor = LungsPredictor(model)
+    artifacts: Optional[ArtifactStore] = None,
+    ledger: Optional[JobLedger] = None,
+    model: Optional[str] = None,
+    posted_image_id: Optional[int] = None,
+    on_import: Optional[Callable[[int], None]] = None,
+) -> int:
+    """Uploads a ROI and its lungs mask, and tags it.
 
-    image = omero_client.download_image(image_id)
+    `posted_image_id` is a ROI that an interrupted job already imported (found in the ledger otherwise), and
+    `on_import` is called with the ID of the ROI as soon as it is imported, before it is tagged.
+    """
+    if posted_image_id is not None:
+        try:
+            omero_client.get_image(posted_image_id)
+        except LookupError:
+            posted_image_id = None
 
-    try:
-        roi, lungs_roi = predictor.compute_3d_roi(image)
-    except:
-        print(
-            f"An error occured while computing the ROI in this image: ID={image_id}. Skipping...",
+    if posted_image_id is None:
+        posted_image_id = _find_upload(ledger, "roi", image_id, model, omero_client)
+    resumed = posted_image_id is not None
+    if not resumed:
+        posted_image_id = omero_client.import_image_to_ds(
+            roi, project_id, dataset_id, image_name
         )
+        if ledger is not None:
+            ledger.set_state("roi", image_id, "uploaded", posted_image_id, model)
 
-    posted_image_id = omero_client.import_image_to_ds(
-        roi, project_id, dataset_id, image_name
-    )
+    if on_import is not None:
+        on_import(posted_image_id)
 
     # Upload the lungs as omero ROI
-    omero_client.post_binary_mask_as_roi(posted_image_id, lungs_roi)
+    if (not resumed) or (len(omero_client.get_image_rois(posted_image_id)) == 0):
+        omero_client.post_binary_mask_as_roi(posted_image_id, lungs_roi)
+
+    # Keep the lungs mask locally, so that tracking doesn't need to download it again
+    if artifacts is not None:
+        artifacts.put(posted_image_id, "lungs", (lungs_roi > 0).astype(np.uint8))
+
+    # Add tags (an interrupted job may have added some of them already)
+    posted_image_tags = omero_client.get_image_tags(posted_image_id) if resumed else []
 
-    # Add tags
-    roi_tag_id = omero_client.create_tag(project_id, "roi")
-    omero_client.tag_image_with_tag(posted_image_id, tag_id=roi_tag_id)
+    if "roi" not in posted_image_tags:
+        roi_tag_id = omero_client.create_tag(project_id, "roi")
+        omero_client.tag_image_with_tag(posted_image_id, tag_id=roi_tag_id)
 
     image_tags_list = find_image_tag(omero_client.get_image_tags(image_id))
 
     omero_client.copy_image_tags(
         src_image_id=image_id,
         dst_image_id=posted_image_id,
-        exclude_tags=image_tags_list,
+        exclude_tags=image_tags_list + posted_image_tags,
     )
 
+    record_provenance(omero_client, posted_image_id, image_id, roi, model)
+
+    if ledger is not None:
+        ledger.set_state("roi", image_id, "tagged")
+
     print("ROI detection workflow completed!")
 
+    return posted_image_id
 
-def _compute_nnunet(
-    model,
+
+def _upload_nnunet(
+    image_pred: np.ndarray,
     image_name: str,
     image_id: int,
     dataset_id: int,
     project_id: int,
     omero_client: OmeroClient,
-):
-    predictor = TumorPredictor(model)
-
-    image = omero_client.download_image(image_id)
-
-    try:
-        image_pred = predictor.predict(image)
-    except:
-        print(
-            f"An error occured while computing the NNUNET prediction in this image: ID={image_id}."
+    ledger: Optional[JobLedger] = None,
+    model: Optional[str] = None,
+) -> int:
+    posted_image_id = _find_upload(ledger, "pred", image_id, model, omero_client)
+    resumed = posted_image_id is not None
+    if not resumed:
+        posted_image_id = omero_client.import_image_to_ds(
+            image_pred, project_id, dataset_id, image_name
         )
-        return
+        if ledger is not None:
+            ledger.set_state("pred", image_id, "uploaded", posted_image_id, model)
 
-    posted_image_id = omero_client.import_image_to_ds(
-        image_pred, project_id, dataset_id, image_name
-    )
+    # Add tags (an interrupted job may have added some of them already)
+    posted_image_tags = omero_client.get_image_tags(posted_image_id) if resumed else []
+
+    if "raw_pred" not in posted_image_tags:
+        pred_tag_id = omero_client.create_tag(project_id, "raw_pred")
+        omero_client.tag_image_with_tag(posted_image_id, tag_id=pred_tag_id)
 
-    pred_tag_id = omero_client.create_tag(project_id, "raw_pred")
-    omero_client.tag_image_with_tag(posted_image_id, tag_id=pred_tag_id)
     omero_client.copy_image_tags(
         src_image_id=image_id,
         dst_image_id=posted_image_id,
-        exclude_tags=["roi"],
+        exclude_tags=["roi"] + posted_image_tags,
     )
 
+    record_provenance(omero_client, posted_image_id, image_id, image_pred, model)
+
+    # Per-tumor statistics, while the mask is still in memory
+    attach_tumor_statistics(omero_client, posted_image_id, image_pred)
+
+    if ledger is not None:
+        ledger.set_state("pred", image_id, "tagged")
+
     print("Segmentation workflow completed!")
 
+    return posted_image_id
 
-def _compute_tracking(
-    image_id: int,
+
+def _shape_batches(
+    image_contexts: List[ImageContext],
+    omero_client: OmeroClient,
+    batch_size: int,
+    bucket_size: int = 32,
+) -> List[List[ImageContext]]:
+    """Groups images of similar shapes (read from the OMERO metadata) into batches of at most `batch_size` images."""
+    buckets: Dict[Tuple[int, ...], List[ImageContext]] = {}
+    for ctx in image_contexts:
+        shape = omero_client.get_image_shape(ctx.image_id)  # type: ignore
+        bucket = tuple(int(np.ceil(s / bucket_size)) for s in shape)
+        buckets.setdefault(bucket, []).append(ctx)
+
+    batches = []
+    for bucket in sorted(buckets):
+        bucket_ctx = buckets[bucket]
+        for start in range(0, len(bucket_ctx), batch_size):
+            batches.append(bucket_ctx[start : start + batch_size])
+
+    return batches
+
+
+def _download_batch(
+    batch: List[ImageContext],
+    omero_client: OmeroClient,
+    ledger: Optional[JobLedger] = None,
+    stage: Optional[str] = None,
+) -> List[np.ndarray]:
+    images = []
+    for ctx in batch:
+        images.append(omero_client.download_image(ctx.image_id))  # type: ignore
+        if ledger is not None:
+            ledger.set_state(stage, ctx.image_id, "downloaded")  # type: ignore
+    return images
+
+
+def _as_outputs(outputs) -> Optional[tuple]:
+    if isinstance(outputs, np.ndarray):
+        return (outputs,)
+    return outputs
+
+
+def _compute_one(
+    pool: Optional[ComputePool], func: Callable, model: Any, image: np.ndarray
+) -> tuple:
+    """Runs `func(model, [image])` in the current process (or in a pool worker) and returns the outputs of the image."""
+    if pool is None:
+        return _as_outputs(func(model, [image])[0])  # type: ignore
+
+    shared_images, future = pool.submit_shared(func, model, [image])
+    try:
+        (outputs,) = future.result()
+    finally:
+        for shared_image in shared_images:
+            shared_image.unlink()
+
+    return _as_outputs(from_shared(outputs))  # type: ignore
+
+
+def _batched_predictions(
+    func: Callable,
+    model: Any,
+    batches: List[List[ImageContext]],
+    omero_client: OmeroClient,
+    ledger: Optional[JobLedger] = None,
+    stage: Optional[str] = None,
+) -> Iterator[Tuple[ImageContext, Optional[tuple]]]:
+    """Runs `func(model, images)` batch by batch and yields the outputs of each image. Failed batches yield `None` as outputs."""
+    for batch in batches:
+        images = _download_batch(batch, omero_client, ledger, stage)
+
+        try:
+            batch_outputs = func(model, images)
+        except Exception:
+            print(
+                f"An error occured while processing these images: IDs={[ctx.image_id for ctx in batch]}."
+            )
+            batch_outputs = [None] * len(batch)
+
+        for ctx, outputs in zip(batch, batch_outputs):
+            yield ctx, _as_outputs(outputs)
+
+
+def _pooled_predictions(
+    pool: ComputePool,
+    func: Callable,
+    model: Any,
+    batches: List[List[ImageContext]],
+    omero_client: OmeroClient,
+    ledger: Optional[JobLedger] = None,
+    stage: Optional[str] = None,
+) -> Iterator[Tuple[ImageContext, Optional[tuple]]]:
+    """Same as `_batched_predictions`, with one job per batch on the pool workers.
+
+    Images are downloaded in the main process while the workers compute, keeping up to
+    two jobs per worker in flight. Outputs are yielded in input order.
+    """
+    pending = deque()
+
+    def _collect():
+        batch, shared_images, future = pending.popleft()
+        try:
+            batch_outputs = [from_shared(outputs) for outputs in future.result()]
+        except Exception:
+            print(
+                f"An error occured while processing these images: IDs={[ctx.image_id for ctx in batch]}."
+            )
+            batch_outputs = [None] * len(batch)
+        finally:
+            for shared_image in shared_images:
+                shared_image.unlink()
+
+        return [(ctx, _as_outputs(outputs)) for ctx, outputs in zip(batch, batch_outputs)]
+
+    try:
+        for batch in batches:
+            images = _download_batch(batch, omero_client, ledger, stage)
+            shared_images, future = pool.submit_shared(func, model, images)
+            pending.append((batch, shared_images, future))
+            if len(pending) >= 2 * pool.n_workers:
+                yield from _collect()
+
+        while pending:
+            yield from _collect()
+    finally:
+        # Release the inputs of jobs left behind (e.g. if the generator was closed early)
+        for _, shared_images, future in pending:
+            future.cancel()
+            for shared_image in shared_images:
+                shared_image.unlink()
+
+
+def _load_lungs(
+    roi_id: int,
+    omero_client: OmeroClient,
+    artifacts: Optional[ArtifactStore] = None,
+) -> np.ndarray:
+    """Returns the lungs mask of a ROI image, from the local store if possible, otherwise from OMERO."""
+    lungs = artifacts.get(roi_id, "lungs") if artifacts is not None else None
+    if lungs is None:
+        lungs = omero_client.download_binary_mask_from_image_rois(roi_id)
+        if artifacts is not None:
+            artifacts.put(roi_id, "lungs", lungs)
+
+    return lungs
+
+
+def _download_tracking_inputs(
+    roi_timeseries_ids: List[int],
+    tumor_timeseries_ids: List[int],
+    omero_client: OmeroClient,
+    artifacts: Optional[ArtifactStore] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the tumor and lungs timeseries of a case (the lungs are used for the registration)."""
+    lungs_timeseries = stack_timeseries(
+        [omero_client.get_image_shape(roi_id) for roi_id in roi_timeseries_ids],
+        (_load_lungs(roi_id, omero_client, artifacts) for roi_id in roi_timeseries_ids),
+    )
+
+    tumor_timeseries = stack_timeseries(
+        [omero_client.get_image_shape(tumor_id) for tumor_id in tumor_timeseries_ids],
+        (omero_client.download_image(tumor_id) for tumor_id in tumor_timeseries_ids),
+    )
+
+    return tumor_timeseries, lungs_timeseries
+
+
+def _load_transforms(
+    roi_timeseries_ids: List[int],
+    lungs_timeseries: np.ndarray,
+    registrations: Optional[RegistrationCache] = None,
+) -> Tuple[List[str], Optional[List[Optional[np.ndarray]]]]:
+    if registrations is None:
+        return [], None
+    return registrations.load(roi_timeseries_ids, lungs_timeseries)
+
+
+def _save_transforms(
     roi_timeseries_ids: List[int],
+    checksums: List[str],
+    transforms: Optional[List[np.ndarray]],
+    registrations: Optional[RegistrationCache] = None,
+) -> None:
+    if (registrations is not None) and (transforms is not None):
+        registrations.save(roi_timeseries_ids, checksums, transforms)
+
+
+def _attach_tracking_table(
+    formatted_df: pd.DataFrame,
+    image_id: int,
     tumor_timeseries_ids: List[int],
     omero_client: OmeroClient,
-):
-    rois_timeseries_list = []
-    lungs_timeseries_list = []
-    for roi_id in roi_timeseries_ids:
-        rois_timeseries_list.append(omero_client.download_image(roi_id))
-        lungs_timeseries_list.append(
-            omero_client.download_binary_mask_from_image_rois(roi_id)
+) -> int:
+    """Attaches a tracking table to an image, and records the tumor masks it was computed from."""
+    table_id = omero_client.attach_table_to_image(table=formatted_df, image_id=image_id)
+    record_tracking_provenance(omero_client, image_id, tumor_timeseries_ids)
+    return table_id
+
+
+def _table_to_linkage_df(formatted_df: pd.DataFrame) -> Tuple[pd.DataFrame, int]:
+    """Returns the linkage (tumor, scan, label, volume) stored in a tracking table and its number of scans.
+
+    Untracked entries (label 0) are dropped.
+    """
+    scans = sorted(
+        int(col.split("SCAN")[1])
+        for col in formatted_df.columns
+        if col.startswith("label - SCAN")
+    )
+
+    linkage_dfs = []
+    for scan in scans:
+        labels = formatted_df[f"label - SCAN{scan:02d}"]
+        tracked = labels != 0
+        linkage_dfs.append(
+            pd.DataFrame(
+                {
+                    "tumor": formatted_df.loc[tracked, "Tumor ID"].astype(int),
+                    "scan": scan,
+                    "label": labels[tracked].astype(int),
+                    "volume": formatted_df.loc[tracked, f"volume - SCAN{scan:02d}"],
+                }
+            )
         )
 
-    tumor_timeseries_list = []
-    for tumor_id in tumor_timeseries_ids:
-        tumor_timeseries_list.append(omero_client.download_image(tumor_id))
-
-    rois_timeseries = combine_images(rois_timeseries_list)
-    lungs_timeseries = combine_images(lungs_timeseries_list)
-    tumor_timeseries = combine_images(tumor_timeseries_list)
-
-    linkage_df = run_tracking(
-        tumor_timeseries,
-        rois_timeseries,
-        lungs_timeseries,
-        with_lungs_registration=True,
-        method="laptrack",
-        max_dist_px=30,
-        dist_weight_ratio=0.9,
-        max_volume_diff_rel=1.0,
-        memory=0,
-        remove_partially_tracked=False,  # TODO: control this. Do we still get CSVs?
+    if len(linkage_dfs) == 0:
+        return pd.DataFrame(columns=["tumor", "scan", "label", "volume"]), 0
+
+    return pd.concat(linkage_dfs, ignore_index=True), len(scans)
+
+
+def _extend_linkage_df(
+    linkage_df: pd.DataFrame, pair_linkage_df: pd.DataFrame, scan: int
+) -> pd.DataFrame:
+    """Adds the tumors of `scan` to the linkage, based on a two-frame tracking of `scan - 1` and `scan`.
+
+    Tumors linked to a tumor of the previous scan keep its ID; the others get new IDs.
+    """
+    previous_tumors = dict(
+        zip(
+            linkage_df.loc[linkage_df["scan"] == scan - 1, "label"],
+            linkage_df.loc[linkage_df["scan"] == scan - 1, "tumor"],
+        )
     )
 
-    formatted_df = to_formatted_df(linkage_df)
+    # Track IDs of the two-frame run => tumor IDs of the existing table
+    pair_to_tumor = {}
+    pair_previous_df = pair_linkage_df[pair_linkage_df["scan"] == 0]
+    for pair_tumor, label in zip(pair_previous_df["tumor"], pair_previous_df["label"]):
+        if int(label) in previous_tumors:
+            pair_to_tumor[pair_tumor] = previous_tumors[int(label)]
+
+    next_tumor = int(linkage_df["tumor"].max()) + 1 if len(linkage_df) else 1
+
+    rows = []
+    pair_new_df = pair_linkage_df[pair_linkage_df["scan"] == 1]
+    for pair_tumor, label, volume in zip(
+        pair_new_df["tumor"], pair_new_df["label"], pair_new_df["volume"]
+    ):
+        if pair_tumor not in pair_to_tumor:
+            pair_to_tumor[pair_tumor] = next_tumor
+            next_tumor += 1
+        rows.append(
+            {
+                "tumor": pair_to_tumor[pair_tumor],
+                "scan": scan,
+                "label": int(label),
+                "volume": volume,
+            }
+        )
+
+    return pd.concat(
+        [linkage_df, pd.DataFrame(rows, columns=["tumor", "scan", "label", "volume"])],
+        ignore_index=True,
+    )
+
+
+# (destination image ID, ROI IDs, tumor mask IDs, ID of the tracking table to extend or `None` to track from scratch,
+# ID of an outdated tracking table to delete once the new one is attached or `None`)
+TrackingJob = Tuple[int, List[int], List[int], Optional[int], Optional[int]]
+
+# (function to run on the input arrays, input arrays, function saving the result with an OMERO client)
+PreparedTracking = Tuple[Callable, List[np.ndarray], Callable[[Any, OmeroClient], None]]
+
+
+def _prepare_tracking(
+    job: TrackingJob,
+    omero_client: OmeroClient,
+    artifacts: Optional[ArtifactStore] = None,
+    registrations: Optional[RegistrationCache] = None,
+) -> Optional[PreparedTracking]:
+    """Downloads the inputs of a tracking job, so that it can be computed in a pool worker.
+
+    Returns `None` if there is nothing to track (the table to extend is already up to date).
+    The result is saved with the client passed to the returned function, which may be another session than `omero_client`.
+    """
+    image_id, roi_timeseries_ids, tumor_timeseries_ids, table_id, replaced_table_id = job
+
+    if table_id is None:
+        tumor_timeseries, lungs_timeseries = _download_tracking_inputs(
+            roi_timeseries_ids, tumor_timeseries_ids, omero_client, artifacts
+        )
+        checksums, transforms = _load_transforms(roi_timeseries_ids, lungs_timeseries, registrations)
+
+        def _finish(result: Tuple[pd.DataFrame, List[np.ndarray]], client: OmeroClient) -> None:
+            formatted_df, transforms = result
+            _save_transforms(roi_timeseries_ids, checksums, transforms, registrations)
+            _attach_tracking_table(formatted_df, image_id, tumor_timeseries_ids, client)
+
+            # Only one tracking table per image
+            if replaced_table_id is not None:
+                client.delete_table(replaced_table_id)
+
+            print("Tracking workflow completed!")
+
+        return (
+            partial(track_timeseries, transforms=transforms),
+            [tumor_timeseries, lungs_timeseries],
+            _finish,
+        )
+
+    # Link the scans missing from the table against the last tracked scan; only two scans are registered and tracked at a time
+    linkage_df, n_tracked = _table_to_linkage_df(omero_client.get_table(table_id))
+
+    n_scans = len(tumor_timeseries_ids)
+    if n_tracked >= n_scans:
+        print(f"⚠️ Tracking table is up to date (Table ID: {table_id}). Skipping...")
+        return
+
+    if n_tracked == 0:
+        raise RuntimeError(f"The tracking table (Table ID: {table_id}) has no tracked scans.")
+
+    arrays = []
+    pairs = []
+    for scan in range(n_tracked, n_scans):
+        pair_roi_ids = roi_timeseries_ids[scan - 1 : scan + 1]
+        tumor_timeseries, lungs_timeseries = _download_tracking_inputs(
+            pair_roi_ids,
+            tumor_timeseries_ids[scan - 1 : scan + 1],
+            omero_client,
+            artifacts,
+        )
+        checksums, transforms = _load_transforms(pair_roi_ids, lungs_timeseries, registrations)
+        arrays.extend([tumor_timeseries, lungs_timeseries])
+        pairs.append((pair_roi_ids, checksums, transforms))
+
+    def _finish_incremental(
+        results: List[Tuple[pd.DataFrame, List[np.ndarray]]], client: OmeroClient
+    ) -> None:
+        extended_df = linkage_df
+        for scan, (pair_roi_ids, checksums, _), (pair_linkage_df, transforms) in zip(
+            range(n_tracked, n_scans), pairs, results
+        ):
+            _save_transforms(pair_roi_ids, checksums, transforms, registrations)
+            extended_df = _extend_linkage_df(extended_df, pair_linkage_df, scan)
 
-    omero_client.attach_table_to_image(
-        table=formatted_df,
-        image_id=image_id,
+        _attach_tracking_table(
+            to_formatted_df(extended_df), image_id, tumor_timeseries_ids, client
+        )
+
+        # Only one tracking table per image
+        client.delete_table(table_id)
+
+        print(f"Tracking workflow completed! (Scans {n_tracked} to {n_scans - 1} were added)")
+
+    return (
+        partial(track_scan_pairs, transforms=[transforms for _, _, transforms in pairs]),
+        arrays,
+        _finish_incremental,
     )
 
-    print("Tracking workflow completed!")
+
+def _run_tracking(pool: Optional[ComputePool], prepared: PreparedTracking) -> Any:
+    """Runs a prepared tracking in the current process (or in a pool worker) and returns its result."""
+    func, arrays, _ = prepared
+    if pool is None:
+        return func(*arrays)
+
+    shared_arrays, future = pool.submit_arrays(func, arrays)
+    try:
+        return future.result()
+    finally:
+        for shared_array in shared_arrays:
+            shared_array.unlink()
+
+
+def _compute_tracking(
+    job: TrackingJob,
+    omero_client: OmeroClient,
+    artifacts: Optional[ArtifactStore] = None,
+    registrations: Optional[RegistrationCache] = None,
+) -> None:
+    prepared = _prepare_tracking(job, omero_client, artifacts, registrations)
+    if prepared is None:
+        return
+
+    _, _, finish = prepared
+    finish(_run_tracking(None, prepared), omero_client)
+
+
+def _pooled_tracking(
+    pool: ComputePool,
+    jobs: Iterable[Optional[TrackingJob]],
+    omero_client: OmeroClient,
+    artifacts: Optional[ArtifactStore] = None,
+    registrations: Optional[RegistrationCache] = None,
+) -> Iterator[int]:
+    """Tracks several cases at once on the pool workers.
+
+    Each job is a `TrackingJob`, or `None` for a case to skip. Inputs are downloaded in the main
+    process while the workers compute, keeping up to two jobs per worker in flight, and each table
+    is attached as soon as its case is tracked. Yields the number of cases processed so far, in input order.
+    """
+    in_flight: Dict[Future, Tuple[int, int, Callable[[Any], None], List[SharedArray]]] = {}
+    finished: Set[int] = set()
+
+    def _collect(timeout: Optional[float]):
+        done, _ = wait(list(in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            k, image_id, finish, shared_arrays = in_flight.pop(future)
+            try:
+                finish(future.result(), omero_client)
+            except Exception:
+                print(f"An error occured while tracking the tumors of this case: Image ID={image_id}.")
+            finally:
+                for shared_array in shared_arrays:
+                    shared_array.unlink()
+            finished.add(k)
+
+    n_processed = 0
+    try:
+        for k, job in enumerate(jobs):
+            prepared = None
+            if job is not None:
+                try:
+                    prepared = _prepare_tracking(job, omero_client, artifacts, registrations)
+                except Exception:
+                    print(f"An error occured while tracking the tumors of this case: Image ID={job[0]}.")
+
+            # Skipped, up to date, or failed to download
+            if prepared is None:
+                finished.add(k)
+            else:
+                func, arrays, finish = prepared
+                shared_arrays, future = pool.submit_arrays(func, arrays)
+                in_flight[future] = (k, job[0], finish, shared_arrays)  # type: ignore
+                while len(in_flight) >= 2 * pool.n_workers:
+                    _collect(timeout=None)
+
+            if in_flight:
+                _collect(timeout=0)
+
+            while n_processed in finished:
+                n_processed += 1
+                yield n_processed
+
+        while in_flight:
+            _collect(timeout=None)
+            while n_processed in finished:
+                n_processed += 1
+                yield n_processed
+    finally:
+        # Release the inputs of jobs left behind (e.g. if the generator was closed early)
+        for future, (_, _, _, shared_arrays) in in_flight.items():
+            future.cancel()
+            for shared_array in shared_arrays:
+                shared_array.unlink()
@@ -16,6 +16,10 @@ class ImageContext:
     time_tag: Optional[str] = None
     image: Optional[np.ndarray] = None
     original_image_id: Optional[int] = None
+    source_id: Optional[int] = None
+    model: Optional[str] = None
+    content_hash: Optional[str] = None
+    source_hash: Optional[str] = None
 
 
 @dataclass
@@ -29,3 +33,5 @@ class SpecimenContext:
     roi_series: List[int]
     tumor_series: List[int]
     tracking_table_id: Optional[int] = None
+    tracking_outdated: bool = False
+    tracked_tumor_ids: Optional[List[int]] = None
@@ -0,0 +1,51 @@
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Callable, Dict, Union
+
+
+def _size(file: Path) -> int:
+    if file.is_dir():
+        return sum(f.stat().st_size for f in file.rglob("*") if f.is_file())
+    return file.stat().st_size
+
+
+class ExportManifest:
+    """Sizes of the files written in an export folder, so that a restarted export skips the complete ones.
+
+    Files are written under a temporary name and renamed once complete. A "file" can also be a directory
+    (e.g. an OME-Zarr image), whose size is the total size of the files in it.
+    """
+
+    FILE_NAME = ".export_manifest.json"
+
+    def __init__(self, out_dir: Union[str, Path]):
+        self.path = Path(out_dir) / self.FILE_NAME
+        self.sizes: Dict[str, int] = {}
+        if self.path.exists():
+            with open(self.path) as f:
+                self.sizes = json.load(f)
+
+    def is_complete(self, file: Path) -> bool:
+        return file.exists() and (self.sizes.get(file.name) == _size(file))
+
+    def write(self, file: Path, write_func: Callable[[str], None]) -> None:
+        """Writes a file with `write_func(path)` and records its size."""
+        # Keep the extension, which can decide the file format
+        tmp_file = file.with_name(f".tmp_{file.name}")
+        if tmp_file.is_dir():
+            shutil.rmtree(tmp_file)
+        write_func(str(tmp_file))
+        if file.is_dir():
+            shutil.rmtree(file)
+        os.replace(tmp_file, file)
+
+        self.sizes[file.name] = _size(file)
+        self._save()
+
+    def _save(self) -> None:
+        tmp_path = self.path.with_name(f".tmp_{self.path.name}")
+        with open(tmp_path, "w") as f:
+            json.dump(self.sizes, f)
+        os.replace(tmp_path, self.path)
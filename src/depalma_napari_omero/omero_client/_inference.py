@@ -0,0 +1,283 @@
+import glob
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+import nibabel as nib
+import numpy as np
+import pandas as pd
+import scipy.ndimage as ndi
+import skimage.io
+import skimage.morphology
+from mousetumorpy import (
+    LungsPredictor,
+    TumorPredictor,
+    initialize_df,
+    to_formatted_df,
+)
+from mousetumorpy.configuration import MIN_SIZE_PX, NNUNET_MODELS
+from mousetumorpy.nnunet import DEVICE
+
+# mousetumorpy has no public way to track with known registration transforms. `track_linkage` follows
+# `run_tracking` of mousetumorpy 0.0.6 (pinned in pyproject.toml; see tests/test_tracking.py).
+from mousetumorpy.register import _fit_affine_from_lungs_masks
+from mousetumorpy.track import _track_laptrack
+
+# Predictors are cached per process, so that models are only loaded once
+_LUNGS_PREDICTORS: Dict[str, LungsPredictor] = {}
+_TUMOR_PREDICTORS: Dict[str, TumorPredictor] = {}
+
+# Folder of each nnUNet model, as set up by `TumorPredictor` (it points `nnUNet_results` to it)
+_TUMOR_MODEL_PATHS: Dict[str, str] = {}
+
+# Parameters of the tumor tracking (laptrack)
+_TRACKING_PARAMS = dict(max_dist_px=30, memory=0, dist_weight_ratio=0.9, max_volume_diff_rel=1.0)
+
+# Set by the process pool initializer to keep workers on the CPU
+_CPU_ONLY = False
+_NNUNET_N_PROCESSES: Optional[int] = None
+
+
+def get_lungs_predictor(model: str) -> LungsPredictor:
+    if model not in _LUNGS_PREDICTORS:
+        _LUNGS_PREDICTORS[model] = LungsPredictor(model)
+    return _LUNGS_PREDICTORS[model]
+
+
+def get_tumor_predictor(model: str) -> TumorPredictor:
+    if model not in _TUMOR_PREDICTORS:
+        if model not in NNUNET_MODELS:
+            raise ValueError(f"Unknown tumor model: {model}. Available models: {list(NNUNET_MODELS)}")
+        _TUMOR_PREDICTORS[model] = TumorPredictor(model)
+        _TUMOR_MODEL_PATHS[model] = os.environ["nnUNet_results"]
+    return _TUMOR_PREDICTORS[model]
+
+
+def _model_file_ending(model_path: str) -> str:
+    """File format that an nnUNet model was trained on (e.g. `.nii.gz` or `.tif`), from its `dataset.json`."""
+    dataset_files = glob.glob(os.path.join(model_path, "**", "dataset.json"), recursive=True)
+    if len(dataset_files) == 0:
+        raise RuntimeError(f"No nnUNet model found in {model_path}.")
+    with open(dataset_files[0]) as f:
+        return json.load(f)["file_ending"]
+
+
+def warm_up_models(lungs_model: Optional[str] = None, tumor_model: Optional[str] = None) -> None:
+    """Loads (and downloads if needed) the models ahead of time, so that the first images don't wait for them."""
+    if lungs_model is not None:
+        get_lungs_predictor(lungs_model)
+    if tumor_model is not None:
+        get_tumor_predictor(tumor_model)
+
+
+def compute_roi(model: str, image: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the cropped lungs ROI and the lungs mask within it."""
+    return get_lungs_predictor(model).compute_3d_roi(image)
+
+
+def compute_rois(
+    model: str, images: List[np.ndarray]
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    return [compute_roi(model, image) for image in images]
+
+
+def compute_rois_and_tumors(
+    models: Tuple[str, str], images: List[np.ndarray]
+) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Returns the ROI, lungs mask and tumor mask of each image. The ROIs are passed to nnUNet in memory.
+
+    If the tumor detection fails, the tumor masks are `None`, so that the ROIs can still be uploaded.
+    """
+    lungs_model, tumor_model = models
+    rois = compute_rois(lungs_model, images)
+    try:
+        preds = predict_tumors(tumor_model, [roi for roi, _ in rois])
+    except Exception as e:
+        print(f"⚠️ Tumor detection failed; only the ROIs were computed: {e}")
+        preds = [None] * len(rois)
+    return [(roi, lungs_roi, pred) for (roi, lungs_roi), pred in zip(rois, preds)]
+
+
+def predict_tumor(model: str, image: np.ndarray) -> np.ndarray:
+    """Runs nnUNet on an image and returns the labeled tumor mask."""
+    return predict_tumors(model, [image])[0]
+
+
+def predict_tumors(model: str, images: List[np.ndarray]) -> List[np.ndarray]:
+    """Runs nnUNet on several images at once and returns their labeled tumor masks.
+
+    Same as `TumorPredictor.predict`, except that all images go through a single nnUNet
+    run (the model is loaded once), and that nnUNet reads and writes in a private
+    temporary folder, so that several processes can predict at the same time.
+    """
+    get_tumor_predictor(model)  # Downloads the model if needed
+    model_path = _TUMOR_MODEL_PATHS[model]
+    file_ext = _model_file_ending(model_path)
+
+    tmp_dir = os.path.join(model_path, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="nnunet_", dir=tmp_dir)
+    try:
+        input_folder = os.path.join(work_dir, "input")
+        output_folder = os.path.join(work_dir, "output")
+        os.makedirs(input_folder)
+        os.makedirs(output_folder)
+
+        for k, image in enumerate(images):
+            input_file = os.path.join(input_folder, f"img{k:03d}_0000{file_ext}")
+            if file_ext == ".nii.gz":
+                nib.save(nib.Nifti1Image(image, None), input_file)
+            else:
+                skimage.io.imsave(input_file, image)
+
+        device = "cpu" if _CPU_ONLY else DEVICE
+        try:
+            _run_nnunet(model_path, input_folder, output_folder, device)
+        except subprocess.CalledProcessError:
+            if device == "cuda":
+                print("Could not run nnUNet with CUDA even if it is available. Falling back to CPU instead...")
+                _run_nnunet(model_path, input_folder, output_folder, "cpu")
+            else:
+                raise
+
+        segmentations = []
+        for k in range(len(images)):
+            output_files = glob.glob(os.path.join(output_folder, f"img{k:03d}.*"))
+            if len(output_files) == 0:
+                raise RuntimeError(f"Running nnUNet (model {model}) on this image was unsuccessful.")
+
+            if output_files[0].endswith(".gz"):
+                segmentation = nib.load(output_files[0]).get_fdata().astype(np.uint16)  # type: ignore
+            else:
+                segmentation = skimage.io.imread(output_files[0]).astype(np.uint16)
+
+            segmentations.append(_postprocess_tumor_mask(segmentation))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return segmentations
+
+
+def _run_nnunet(model_path: str, input_folder: str, output_folder: str, device: str):
+    command = [
+        "nnUNetv2_predict",
+        "-i", input_folder,
+        "-o", output_folder,
+        "-d", "001",
+        "-f", "0",
+        "-c", "3d_fullres",
+        "-device", device,
+        "--disable_tta",
+    ]
+    if _NNUNET_N_PROCESSES is not None:
+        command.extend(["-npp", str(_NNUNET_N_PROCESSES), "-nps", str(_NNUNET_N_PROCESSES)])
+
+    env = dict(os.environ, nnUNet_results=model_path)
+
+    return subprocess.run(command, check=True, env=env)
+
+
+def _postprocess_tumor_mask(segmentation: np.ndarray) -> np.ndarray:
+    """Same post-processing as `TumorPredictor.predict`."""
+    segmentation, _ = ndi.label(segmentation)  # type: ignore
+    segmentation = skimage.morphology.remove_small_objects(segmentation, min_size=MIN_SIZE_PX)
+
+    # Fill holes in each Z slice
+    for z in range(segmentation.shape[0]):
+        segmentation[z] = ndi.binary_fill_holes(segmentation[z])
+
+    segmentation, _ = ndi.label(segmentation)  # type: ignore
+
+    return segmentation.astype(np.uint16)
+
+
+def fit_lungs_transforms(
+    lungs_timeseries: np.ndarray,
+    transforms: Optional[List[Optional[np.ndarray]]] = None,
+) -> List[np.ndarray]:
+    """Returns the affine transforms that bring the lungs of each frame onto the lungs of the first frame.
+
+    Transforms that are already known (not `None` in `transforms`) are not fitted again.
+    """
+    if transforms is None:
+        transforms = [None] * len(lungs_timeseries)
+
+    fitted_transforms = [np.eye(4)]
+    for lungs, transform in zip(lungs_timeseries[1:], transforms[1:]):
+        if transform is None:
+            transform = _fit_affine_from_lungs_masks(lungs_timeseries[0], lungs)
+        fitted_transforms.append(np.asarray(transform))
+
+    return fitted_transforms
+
+
+def track_linkage(
+    tumor_timeseries: np.ndarray,
+    lungs_timeseries: np.ndarray,
+    transforms: Optional[List[Optional[np.ndarray]]] = None,
+) -> Tuple[pd.DataFrame, List[np.ndarray]]:
+    """Tracks the tumors across time (with lungs registration) and returns the linkage (tumor, scan, label, volume...).
+
+    Same as `run_tracking(..., with_lungs_registration=True, method="laptrack", remove_partially_tracked=False)`,
+    except that the registration transforms can be given. They are returned with the linkage, so that they can be reused.
+    Tumors that aren't found in every scan are kept, so that the tracking table lists all of them.
+    """
+    transforms = fit_lungs_transforms(lungs_timeseries, transforms)
+
+    registered_timeseries = np.empty_like(tumor_timeseries)
+    registered_timeseries[0] = tumor_timeseries[0]
+    for k, transform in enumerate(transforms[1:], start=1):
+        registered_timeseries[k] = ndi.affine_transform(
+            tumor_timeseries[k], matrix=transform[:3, :3], offset=transform[:3, 3], order=0
+        )
+
+    # As in `run_tracking`: volumes are measured on the original labels, positions on the registered labels
+    df = pd.merge(
+        initialize_df(tumor_timeseries, properties=["area", "label"]),
+        initialize_df(registered_timeseries, properties=["centroid", "label"]),
+        on=["label", "frame_forward", "frame"],
+    )
+    df.rename(
+        columns={"centroid-0": "z", "centroid-1": "y", "centroid-2": "x", "area": "volume"},
+        inplace=True,
+    )
+
+    linkage_df = _track_laptrack(df, registered_timeseries, **_TRACKING_PARAMS)
+    linkage_df = linkage_df.merge(
+        pd.DataFrame({"length": linkage_df["tumor"].value_counts()}),
+        left_on="tumor",
+        right_index=True,
+    )
+    linkage_df = linkage_df.sort_values(by="length", ascending=False)
+    linkage_df = linkage_df.fillna(0)
+
+    return linkage_df, transforms
+
+
+def track_timeseries(
+    tumor_timeseries: np.ndarray,
+    lungs_timeseries: np.ndarray,
+    transforms: Optional[List[Optional[np.ndarray]]] = None,
+) -> Tuple[pd.DataFrame, List[np.ndarray]]:
+    """Tracks the tumors across time (with lungs registration) and returns the formatted tracking table and the registration transforms."""
+    linkage_df, transforms = track_linkage(tumor_timeseries, lungs_timeseries, transforms)
+    return to_formatted_df(linkage_df), transforms
+
+
+def track_scan_pairs(
+    *timeseries: np.ndarray,
+    transforms: List[Optional[List[Optional[np.ndarray]]]],
+) -> List[Tuple[pd.DataFrame, List[np.ndarray]]]:
+    """Tracks the tumors of several pairs of consecutive scans (`timeseries` alternates the tumor and lungs timeseries of each pair).
+
+    Returns the linkage and registration transforms of each pair, as `track_linkage` does.
+    """
+    return [
+        track_linkage(tumor_timeseries, lungs_timeseries, pair_transforms)
+        for tumor_timeseries, lungs_timeseries, pair_transforms in zip(
+            timeseries[::2], timeseries[1::2], transforms
+        )
+    ]
@@ -0,0 +1,146 @@
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from depalma_napari_omero.omero_client._context import ImageContext
+
+# A job goes through these states, in this order
+JOB_STATES = ["pending", "downloaded", "computed", "uploaded", "tagged"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    stage TEXT NOT NULL,
+    image_id INTEGER NOT NULL,
+    model TEXT,
+    image_class TEXT,
+    image_name TEXT,
+    dataset_id INTEGER,
+    project_id INTEGER,
+    state TEXT NOT NULL,
+    output_id INTEGER,
+    updated REAL,
+    PRIMARY KEY (stage, image_id)
+)
+"""
+
+
+class JobLedger:
+    """Local SQLite record of the batch jobs, so that interrupted runs can resume where they stopped.
+
+    A job is identified by its stage (e.g. "roi", "pred") and its source image ID.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._execute(_SCHEMA)
+
+    def _execute(self, query: str, params=()) -> List[tuple]:
+        # One connection per query, so that the ledger can be used from worker threads
+        with closing(sqlite3.connect(self.path, timeout=30)) as conn:
+            with conn:
+                return conn.execute(query, params).fetchall()
+
+    def add(self, stage: str, model: str, image_contexts: List[ImageContext]) -> None:
+        """Records pending jobs.
+
+        Jobs that were completed before are reset, since their outputs are missing again, and so are jobs
+        started with another model, whose outputs (kept or uploaded) must not be reused.
+        """
+        for ctx in image_contexts:
+            self._execute(
+                """
+                INSERT INTO jobs (stage, image_id, model, image_class, image_name, dataset_id, project_id, state, updated)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 'pending', ?)
+                ON CONFLICT (stage, image_id) DO UPDATE SET
+                    model = excluded.model, state = 'pending', output_id = NULL, updated = excluded.updated
+                WHERE jobs.state = 'tagged' OR jobs.model IS NOT excluded.model
+                """,
+                (
+                    stage,
+                    ctx.image_id,
+                    model,
+                    ctx.image_class,
+                    ctx.image_name,
+                    ctx.dataset_id,
+                    ctx.project_id,
+                    time.time(),
+                ),
+            )
+
+    def state(self, stage: str, image_id: int) -> Optional[str]:
+        rows = self._execute(
+            "SELECT state FROM jobs WHERE stage = ? AND image_id = ?", (stage, image_id)
+        )
+        if len(rows) == 0:
+            return
+        return rows[0][0]
+
+    def model(self, stage: str, image_id: int) -> Optional[str]:
+        """Returns the model that a job was run with."""
+        rows = self._execute(
+            "SELECT model FROM jobs WHERE stage = ? AND image_id = ?", (stage, image_id)
+        )
+        if len(rows) == 0:
+            return
+        return rows[0][0]
+
+    def output_id(self, stage: str, image_id: int) -> Optional[int]:
+        """Returns the ID of the image uploaded by a job, if it got that far."""
+        rows = self._execute(
+            "SELECT output_id FROM jobs WHERE stage = ? AND image_id = ?", (stage, image_id)
+        )
+        if len(rows) == 0:
+            return
+        return rows[0][0]
+
+    def set_state(
+        self,
+        stage: str,
+        image_id: int,
+        state: str,
+        output_id: Optional[int] = None,
+        model: Optional[str] = None,
+    ) -> None:
+        if state not in JOB_STATES:
+            raise ValueError(f"Unknown job state: {state} (available: {JOB_STATES}).")
+
+        self._execute(
+            """
+            INSERT INTO jobs (stage, image_id, model, state, output_id, updated)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (stage, image_id) DO UPDATE SET
+                model = COALESCE(excluded.model, jobs.model),
+                state = excluded.state,
+                output_id = COALESCE(excluded.output_id, jobs.output_id),
+                updated = excluded.updated
+            """,
+            (stage, image_id, model, state, output_id, time.time()),
+        )
+
+    def unfinished(self, stage: str) -> Dict[str, List[ImageContext]]:
+        """Returns the contexts of the jobs of a stage that were not completed, grouped by model."""
+        rows = self._execute(
+            """
+            SELECT model, image_id, image_class, image_name, dataset_id, project_id FROM jobs
+            WHERE stage = ? AND state != 'tagged' AND model IS NOT NULL
+            ORDER BY updated
+            """,
+            (stage,),
+        )
+
+        jobs: Dict[str, List[ImageContext]] = {}
+        for model, image_id, image_class, image_name, dataset_id, project_id in rows:
+            jobs.setdefault(model, []).append(
+                ImageContext(
+                    image_class=image_class,
+                    project_id=project_id,
+                    dataset_id=dataset_id,
+                    image_id=image_id,
+                    image_name=image_name,
+                )
+            )
+
+        return jobs
@@ -0,0 +1,178 @@
+import multiprocessing as mp
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Any, Callable, List, Optional, Tuple, Union
+
+import numpy as np
+
+import depalma_napari_omero.omero_client._inference as inference
+
+_THREAD_ENV_VARS = [
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+]
+
+
+@dataclass
+class SharedArray:
+    """Handle to a numpy array stored in shared memory, cheap to send to a worker process."""
+
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+    @classmethod
+    def from_array(cls, array: np.ndarray) -> "SharedArray":
+        shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+        shm.close()
+        return cls(name=shm.name, shape=tuple(array.shape), dtype=array.dtype.str)
+
+    def read(self, unlink: bool = False) -> np.ndarray:
+        """Returns a copy of the shared array, optionally freeing the shared memory."""
+        shm = shared_memory.SharedMemory(name=self.name)
+        try:
+            array = np.ndarray(self.shape, dtype=np.dtype(self.dtype), buffer=shm.buf).copy()
+        finally:
+            shm.close()
+            if unlink:
+                shm.unlink()
+        return array
+
+    def unlink(self) -> None:
+        try:
+            shm = shared_memory.SharedMemory(name=self.name)
+        except FileNotFoundError:
+            return
+        shm.close()
+        shm.unlink()
+
+
+SharedOutputs = Union[SharedArray, Tuple[Optional[SharedArray], ...]]
+
+
+def to_shared(outputs: Union[np.ndarray, Tuple[Optional[np.ndarray], ...]]) -> SharedOutputs:
+    """Moves the outputs of a job to shared memory (outputs that are `None` are passed as is)."""
+    if isinstance(outputs, np.ndarray):
+        return SharedArray.from_array(outputs)
+    return tuple(
+        SharedArray.from_array(np.asarray(output)) if output is not None else None
+        for output in outputs
+    )
+
+
+def from_shared(outputs: SharedOutputs) -> Union[np.ndarray, Tuple[Optional[np.ndarray], ...]]:
+    """Copies the outputs of a job back into the current process and frees the shared memory."""
+    if isinstance(outputs, SharedArray):
+        return outputs.read(unlink=True)
+    return tuple(output.read(unlink=True) if output is not None else None for output in outputs)
+
+
+def _shared_job(
+    func: Callable, model: Any, images: List[SharedArray]
+) -> List[SharedOutputs]:
+    """Runs `func(model, images)` in a worker. Inputs and outputs go through shared memory."""
+    return [to_shared(outputs) for outputs in func(model, [image.read() for image in images])]
+
+
+def _shared_call(func: Callable, arrays: List[SharedArray]) -> Any:
+    """Runs `func(*arrays)` in a worker. Only the inputs go through shared memory."""
+    return func(*[array.read() for array in arrays])
+
+
+def _init_worker(
+    counter, n_threads: int, warm_models: Optional[Tuple[str, str]] = None
+) -> None:
+    with counter.get_lock():
+        worker_idx = counter.value
+        counter.value += 1
+
+    # Inherited by the nnUNet subprocesses
+    for var in _THREAD_ENV_VARS:
+        os.environ[var] = str(n_threads)
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+
+    # Pin each worker to its own set of cores (Linux only)
+    if hasattr(os, "sched_setaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+        start = (worker_idx * n_threads) % len(cpus)
+        worker_cpus = cpus[start : start + n_threads]
+        if len(worker_cpus) > 0:
+            os.sched_setaffinity(0, worker_cpus)
+
+    try:
+        import torch
+
+        torch.set_num_threads(n_threads)
+    except ImportError:
+        pass
+
+    inference._CPU_ONLY = True
+    inference._NNUNET_N_PROCESSES = 1
+
+    if warm_models is not None:
+        inference.warm_up_models(*warm_models)
+
+
+class ComputePool:
+    """Pool of CPU-only worker processes, each running with a bounded number of threads.
+
+    Arrays are passed to and from the workers as `SharedArray` handles. With `warm_models=(lungs_model, tumor_model)`,
+    each worker loads the models when it starts.
+    """
+
+    def __init__(
+        self,
+        n_workers: int,
+        n_threads: Optional[int] = None,
+        warm_models: Optional[Tuple[str, str]] = None,
+    ):
+        if os.name == "nt":
+            raise RuntimeError("The process pool relies on POSIX shared memory and is not available on Windows.")
+
+        if n_workers < 1:
+            raise ValueError(f"The pool needs at least one worker ({n_workers=}).")
+
+        if n_threads is None:
+            n_threads = max(1, (os.cpu_count() or 1) // n_workers)
+
+        self.n_workers = n_workers
+        self.n_threads = n_threads
+
+        mp_context = mp.get_context("spawn")
+        self.executor = ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=mp_context,
+            initializer=_init_worker,
+            initargs=(mp_context.Value("i", 0), n_threads, warm_models),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        return self.executor.submit(func, *args, **kwargs)
+
+    def submit_shared(
+        self, func: Callable, model: Any, images: List[np.ndarray]
+    ) -> Tuple[List[SharedArray], Future]:
+        """Copies `images` to shared memory and runs `func(model, images)` in a worker."""
+        shared_images = [SharedArray.from_array(image) for image in images]
+        return shared_images, self.submit(_shared_job, func, model, shared_images)
+
+    def submit_arrays(
+        self, func: Callable, arrays: List[np.ndarray]
+    ) -> Tuple[List[SharedArray], Future]:
+        """Copies `arrays` to shared memory and runs `func(*arrays)` in a worker. The result is pickled back."""
+        shared_arrays = [SharedArray.from_array(array) for array in arrays]
+        return shared_arrays, self.submit(_shared_call, func, shared_arrays)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True, cancel_futures=True)
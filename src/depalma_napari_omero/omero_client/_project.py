@@ -1,24 +1,74 @@
 import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from contextlib import closing, contextmanager, nullcontext
+from functools import partial
+from itertools import chain
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
 
 import numpy as np
 import pandas as pd
-import skimage.io
 from mousetumorpy import (
     NNUNET_MODELS,
     YOLO_MODELS,
-    combine_images,
-    generate_tracked_tumors,
     to_linkage_df,
 )
 from tqdm import tqdm
 
-from depalma_napari_omero.omero_client._client import OmeroClient
+from depalma_napari_omero.omero_client._artifacts import ArtifactStore
+from depalma_napari_omero.omero_client._client import OmeroClient, rasterize_polygons
 from depalma_napari_omero.omero_client._compute import (
     _compute_tracking,
-    _compute_roi,
-    _compute_nnunet,
+    _batched_predictions,
+    _compute_one,
+    _prepare_tracking,
+    _run_tracking,
+    _pooled_predictions,
+    _pooled_tracking,
+    TrackingJob,
+    _shape_batches,
+    _staged_imports,
+    _upload_roi,
+    _upload_nnunet,
+)
+from depalma_napari_omero.omero_client._inference import (
+    compute_rois,
+    compute_rois_and_tumors,
+    predict_tumors,
+    warm_up_models,
+)
+from depalma_napari_omero.omero_client._export import ExportManifest
+from depalma_napari_omero.omero_client._ledger import JobLedger
+from depalma_napari_omero.omero_client._pool import ComputePool
+from depalma_napari_omero.omero_client._provenance import (
+    read_project_tracking_provenance,
+    read_provenance,
+    read_tracking_provenance,
+)
+from depalma_napari_omero.omero_client._queue import Lease, WorkItem, WorkQueue, worker_name
+from depalma_napari_omero.omero_client._relabel import (
+    relabel_timepoint,
+    relabel_timeseries,
+    tracking_luts,
+)
+from depalma_napari_omero.omero_client._registration import (
+    REGISTRATION_TABLE_TITLE,
+    RegistrationCache,
+)
+from depalma_napari_omero.omero_client._scheduler import DagScheduler
+from depalma_napari_omero.omero_client._sessions import SessionPool
+from depalma_napari_omero.omero_client._stats import attach_tumor_statistics
+from depalma_napari_omero.omero_client._timeseries import (
+    TimeseriesWriter,
+    read_timeseries,
+    write_compressed_timeseries,
+    write_timeseries,
+)
+from depalma_napari_omero.omero_client._zarr import (
+    read_ome_zarr_timeseries,
+    write_ome_zarr_timeseries,
 )
 from depalma_napari_omero.omero_client._context import ImageContext, SpecimenContext
 from depalma_napari_omero.omero_client.omero_config import OmeroConfig
@@ -26,6 +76,12 @@ from depalma_napari_omero.omero_client._tags_processor import TagsProcessor
 from depalma_napari_omero.omero_client._scanner import ProjectScanner
 import depalma_napari_omero.omero_client._utils as utils
 
+# Fields of the image contexts stored in the work queue items
+_QUEUE_CTX_FIELDS = ["image_class", "project_id", "dataset_id", "image_id", "image_name", "specimen_tag"]
+
+# Number of arrays computed by the jobs of each stage (kept until they are uploaded)
+_STAGE_N_OUTPUTS = {"roi": 2, "pred": 1, "fused": 3}
+
 
 class OmeroProjectManager:
     def __init__(
@@ -44,6 +100,18 @@ class OmeroProjectManager:
         self.id = project_id
         self.name = project_name
 
+        # Local store of the lungs masks, reused by tracking (and of the outputs of interrupted jobs)
+        self.artifacts = ArtifactStore(namespace=self.client.omero_cfg.host)
+
+        # Lungs registration transforms, reused when retracking (set `share=True` to also keep them on OMERO)
+        self.registrations = RegistrationCache(self.client, self.artifacts)
+
+        # Record of the batch jobs, so that interrupted runs can be resumed
+        self.ledger = JobLedger(self.artifacts.root / f"project_{project_id}_jobs.sqlite")
+
+        # Long-lived process pool (e.g. in watch mode), used instead of starting one per run
+        self.pool: Optional[ComputePool] = None
+
         # Creat the categorical tags if they do not exist
         self.image_tag_id = self.client.create_tag(self.id, "image")
         self.corrected_tag_id = self.client.create_tag(self.id, "corrected_pred")
@@ -56,7 +124,10 @@ class OmeroProjectManager:
     def tumor_models(self) -> List[str]:
         return list(NNUNET_MODELS.keys())
 
-    def batch_roi(self, lungs_model: str, ask_confirm: bool = True) -> None:
+    def batch_roi(
+        self, lungs_model: str, ask_confirm: bool = True, n_workers: int = 0
+    ) -> None:
+        """Compute the missing ROIs. With `n_workers > 0`, inference runs in a pool of CPU worker processes."""
         if not lungs_model in self.lungs_models:
             raise ValueError(
                 f"⚠️ {lungs_model} is not an available model (available: {self.lungs_models})."
@@ -74,7 +145,7 @@ class OmeroProjectManager:
             print(
                 f"  → {', '.join(map(str, [ctx.image_id for ctx in roi_missing_ctx]))}"
             )
-            print(f"\nThe resulting tumor masks will be uploaded to the OMERO project:")
+            print("\nThe resulting tumor masks will be uploaded to the OMERO project:")
             print(f"  → `{self.name}`")
 
             confirm = (
@@ -87,60 +158,209 @@ class OmeroProjectManager:
             if confirm == "n":
                 return
 
-        for _ in self._run_batch_roi(lungs_model, roi_missing_ctx):
+        for _ in self._run_batch_roi(lungs_model, roi_missing_ctx, n_workers):
             continue
 
-    def _run_batch_roi(self, lungs_model: str, roi_missing_ctx: List[ImageContext]):
-        with tqdm(total=len(roi_missing_ctx), desc="Computing ROIs") as pbar:
-            for k, ctx in enumerate(roi_missing_ctx):
-                print(
-                    f"Computing {k+1} / {len(roi_missing_ctx)} ROIs. Image ID = {ctx.image_id}"
-                )
+    def _run_batch_roi(
+        self,
+        lungs_model: str,
+        roi_missing_ctx: List[ImageContext],
+        n_workers: int = 0,
+        rescan: bool = True,
+    ):
+        for ctx in roi_missing_ctx:
+            _check_context(ctx)
+
+        self.ledger.add("roi", lungs_model, roi_missing_ctx)
+        resumed, to_compute = self._resume_jobs("roi", lungs_model, roi_missing_ctx)
+        batches = [[ctx] for ctx in to_compute]
+
+        pool_ctx = self._compute_pool(n_workers)
+        with pool_ctx as pool, tqdm(
+            total=len(roi_missing_ctx), desc="Computing ROIs"
+        ) as pbar:
+            results = chain(
+                resumed, self._predictions(pool, compute_rois, lungs_model, batches, "roi")
+            )
+            results = _staged_imports(
+                results, "roi", _roi_image_name, self.id, self.client, self.ledger, lungs_model,
+                save_outputs=lambda ctx, outputs: self._save_outputs("roi", ctx.image_id, outputs),  # type: ignore
+            )
+            with closing(results):
+                for k, (ctx, outputs) in enumerate(results):
+                    print(
+                        f"Computed {k+1} / {len(roi_missing_ctx)} ROIs. Image ID = {ctx.image_id}"
+                    )
+
+                    if outputs is not None:
+                        roi, lungs_roi = outputs
+                        try:
+                            _upload_roi(
+                                roi,
+                                lungs_roi,
+                                image_name=_roi_image_name(ctx),
+                                image_id=ctx.image_id,  # type: ignore
+                                dataset_id=ctx.dataset_id,  # type: ignore
+                                project_id=self.id,
+                                omero_client=self.client,
+                                artifacts=self.artifacts,
+                                ledger=self.ledger,
+                                model=lungs_model,
+                            )
+                        except BaseException:
+                            # Kept locally only when the upload doesn't go through, so that the next run can resume it
+                            self._save_outputs("roi", ctx.image_id, outputs)  # type: ignore
+                            raise
+                        self._clear_outputs("roi", ctx.image_id)  # type: ignore
+
+                    pbar.update(1)
+                    yield k + 1
+
+        if rescan:
+            self.scanner.update()
+
+    def batch_nnunet(
+        self,
+        model: str,
+        ask_confirm: bool = True,
+        n_workers: int = 0,
+        batch_size: int = 1,
+    ) -> None:
+        """Compute the missing tumor masks. With `n_workers > 0`, inference runs in a pool of CPU worker processes.
+        With `batch_size > 1`, ROIs of similar shapes are predicted together in a single nnUNet run."""
+        if not model in self.tumor_models:
+            raise ValueError(
+                f"⚠️ {model} is not an available model (available: {self.tumor_models})."
+            )
+
+        pred_missing_ctx: List[ImageContext] = self.scanner.view.pred_missing
+
+        if len(pred_missing_ctx) == 0:
+            print("No tumor mask to compute.")
+            return
 
-                if ctx.image_name is None:
-                    raise RuntimeError("Context should have an image name!")
+        if ask_confirm:
+            print("\n" + "-" * 60)
+            print("The following image IDs will be used for tumor mask computation:")
+            print(
+                f"  → {', '.join(map(str, [ctx.image_id for ctx in pred_missing_ctx]))}"
+            )
+            print("\nThe resulting tumor masks will be uploaded to the OMERO project:")
+            print(f"  → `{self.name}`")
 
-                if ctx.image_id is None:
-                    raise RuntimeError("Context should have an image ID!")
+            confirm = (
+                input("\n✅ Press [Enter] to confirm, or type [n] to cancel: ")
+                .strip()
+                .lower()
+            )
+            print()
 
-                if ctx.dataset_id is None:
-                    raise RuntimeError("Context should have a dataset ID!")
+            if confirm == "n":
+                return
 
-                posted_image_name = f"{os.path.splitext(ctx.image_name)[0]}_roi.tif"
+        for _ in self._run_batch_nnunet(model, pred_missing_ctx, n_workers, batch_size):
+            continue
 
-                _compute_roi(
-                    model=lungs_model,
-                    image_name=posted_image_name,
-                    image_id=ctx.image_id,
-                    dataset_id=ctx.dataset_id,
-                    project_id=self.id,
-                    omero_client=self.client,
-                )
+    def _run_batch_nnunet(
+        self,
+        model: str,
+        pred_missing_ctx: List[ImageContext],
+        n_workers: int = 0,
+        batch_size: int = 1,
+        rescan: bool = True,
+    ):
+        for ctx in pred_missing_ctx:
+            _check_context(ctx)
 
-                pbar.update(1)
-                yield k + 1
+        self.ledger.add("pred", model, pred_missing_ctx)
+        resumed, to_compute = self._resume_jobs("pred", model, pred_missing_ctx)
 
-        self.scanner.update()
+        if batch_size > 1:
+            batches = _shape_batches(to_compute, self.client, batch_size)
+        else:
+            batches = [[ctx] for ctx in to_compute]
+
+        pool_ctx = self._compute_pool(n_workers)
+        with pool_ctx as pool, tqdm(
+            total=len(pred_missing_ctx), desc="Detecting tumors"
+        ) as pbar:
+            results = chain(
+                resumed, self._predictions(pool, predict_tumors, model, batches, "pred")
+            )
+            pred_image_name = partial(_pred_image_name, model=model)
+            results = _staged_imports(
+                results, "pred", pred_image_name, self.id, self.client, self.ledger, model,
+                save_outputs=lambda ctx, outputs: self._save_outputs("pred", ctx.image_id, outputs),  # type: ignore
+            )
+            with closing(results):
+                for k, (ctx, outputs) in enumerate(results):
+                    print(
+                        f"Computed {k+1} / {len(pred_missing_ctx)} tumor predictions. Image ID = {ctx.image_id}"
+                    )
+
+                    if outputs is not None:
+                        (image_pred,) = outputs
+                        try:
+                            _upload_nnunet(
+                                image_pred,
+                                image_name=pred_image_name(ctx),
+                                image_id=ctx.image_id,  # type: ignore
+                                dataset_id=ctx.dataset_id,  # type: ignore
+                                project_id=self.id,
+                                omero_client=self.client,
+                                ledger=self.ledger,
+                                model=model,
+                            )
+                        except BaseException:
+                            # Kept locally only when the upload doesn't go through, so that the next run can resume it
+                            self._save_outputs("pred", ctx.image_id, outputs)  # type: ignore
+                            raise
+                        self._clear_outputs("pred", ctx.image_id)  # type: ignore
+
+                    pbar.update(1)
+                    yield k + 1
+
+        if rescan:
+            self.scanner.update()
+
+    def batch_fused(
+        self,
+        lungs_model: str,
+        tumor_model: str,
+        ask_confirm: bool = True,
+        n_workers: int = 0,
+        batch_size: int = 1,
+    ) -> None:
+        """Compute the missing ROIs and tumor masks in a single pass.
+
+        Each raw image goes image → ROI → tumor mask in one go; the ROI is handed to the
+        tumor model in memory instead of being downloaded again from OMERO. ROIs that are
+        already on OMERO but have no tumor mask yet are predicted in the same run.
+        """
+        if not lungs_model in self.lungs_models:
+            raise ValueError(
+                f"⚠️ {lungs_model} is not an available model (available: {self.lungs_models})."
+            )
 
-    def batch_nnunet(self, model: str, ask_confirm: bool = True) -> None:
-        if not model in self.tumor_models:
+        if not tumor_model in self.tumor_models:
             raise ValueError(
-                f"⚠️ {model} is not an available model (available: {self.tumor_models})."
+                f"⚠️ {tumor_model} is not an available model (available: {self.tumor_models})."
             )
 
+        roi_missing_ctx: List[ImageContext] = self.scanner.view.roi_missing
         pred_missing_ctx: List[ImageContext] = self.scanner.view.pred_missing
 
-        if len(pred_missing_ctx) == 0:
-            print("No tumor mask to compute.")
+        if len(roi_missing_ctx) + len(pred_missing_ctx) == 0:
+            print("No ROIs or tumor masks to compute.")
             return
 
         if ask_confirm:
             print("\n" + "-" * 60)
-            print("The following image IDs will be used for tumor mask computation:")
+            print("The following image IDs will be used for ROI and tumor mask computation:")
             print(
-                f"  → {', '.join(map(str, [ctx.image_id for ctx in pred_missing_ctx]))}"
+                f"  → {', '.join(map(str, [ctx.image_id for ctx in roi_missing_ctx + pred_missing_ctx]))}"
             )
-            print(f"\nThe resulting tumor masks will be uploaded to the OMERO project:")
+            print("\nThe resulting ROIs and tumor masks will be uploaded to the OMERO project:")
             print(f"  → `{self.name}`")
 
             confirm = (
@@ -153,81 +373,967 @@ class OmeroProjectManager:
             if confirm == "n":
                 return
 
-        for _ in self._run_batch_nnunet(model, pred_missing_ctx):
+        for _ in self._run_batch_fused(
+            lungs_model,
+            tumor_model,
+            roi_missing_ctx,
+            pred_missing_ctx,
+            n_workers,
+            batch_size,
+        ):
             continue
 
-    def _run_batch_nnunet(self, model: str, pred_missing_ctx: List[ImageContext]):
-        with tqdm(total=len(pred_missing_ctx), desc="Detecting tumors") as pbar:
-            for k, ctx in enumerate(pred_missing_ctx):
+    def _run_batch_fused(
+        self,
+        lungs_model: str,
+        tumor_model: str,
+        roi_missing_ctx: List[ImageContext],
+        pred_missing_ctx: List[ImageContext],
+        n_workers: int = 0,
+        batch_size: int = 1,
+        rescan: bool = True,
+    ):
+        for ctx in roi_missing_ctx:
+            _check_context(ctx)
+
+        fused_model = f"{lungs_model},{tumor_model}"
+        self.ledger.add("fused", fused_model, roi_missing_ctx)
+        resumed, to_compute = self._resume_jobs("fused", fused_model, roi_missing_ctx)
+
+        # One image per job, so that a failed ROI does not affect the others
+        batches = [[ctx] for ctx in to_compute]
+        models = (lungs_model, tumor_model)
+
+        # ROIs that were uploaded without a tumor mask (the tumor detection failed); their mask is retried below
+        pred_retry_ctx: List[ImageContext] = []
+
+        pool_ctx = self._compute_pool(n_workers)
+        with pool_ctx as pool, tqdm(
+            total=len(roi_missing_ctx), desc="Computing ROIs and tumors"
+        ) as pbar:
+            results = chain(
+                resumed,
+                self._predictions(pool, compute_rois_and_tumors, models, batches, "fused"),
+            )
+            for k, (ctx, outputs) in enumerate(results):
                 print(
-                    f"Computing {k+1} / {len(pred_missing_ctx)} tumor predictions. Image ID = {ctx.image_id}"
+                    f"Computed {k+1} / {len(roi_missing_ctx)} ROIs and tumor predictions. Image ID = {ctx.image_id}"
                 )
 
-                if ctx.image_name is None:
-                    raise RuntimeError("Context should have an image name!")
+                if outputs is not None:
+                    roi, lungs_roi, image_pred = outputs
+                    roi_name = _roi_image_name(ctx)
+                    try:
+                        posted_roi_id = _upload_roi(
+                            roi,
+                            lungs_roi,
+                            image_name=roi_name,
+                            image_id=ctx.image_id,  # type: ignore
+                            dataset_id=ctx.dataset_id,  # type: ignore
+                            project_id=self.id,
+                            omero_client=self.client,
+                            artifacts=self.artifacts,
+                            ledger=self.ledger,
+                            model=lungs_model,
+                        )
+
+                        if image_pred is None:
+                            pred_retry_ctx.append(
+                                ImageContext(
+                                    image_class="roi",
+                                    project_id=self.id,
+                                    dataset_id=ctx.dataset_id,
+                                    image_id=posted_roi_id,
+                                    image_name=roi_name,
+                                )
+                            )
+                        else:
+                            _upload_nnunet(
+                                image_pred,
+                                image_name=f"{os.path.splitext(roi_name)[0]}_pred_nnunet_{tumor_model}.tif",
+                                image_id=posted_roi_id,
+                                dataset_id=ctx.dataset_id,  # type: ignore
+                                project_id=self.id,
+                                omero_client=self.client,
+                                ledger=self.ledger,
+                                model=tumor_model,
+                            )
+                    except BaseException:
+                        # Kept locally only when the uploads don't go through, so that the next run can resume them
+                        if image_pred is not None:
+                            self._save_outputs("fused", ctx.image_id, outputs)  # type: ignore
+                        raise
+
+                    self.ledger.set_state("fused", ctx.image_id, "tagged")  # type: ignore
+                    self._clear_outputs("fused", ctx.image_id)  # type: ignore
 
-                if ctx.image_id is None:
-                    raise RuntimeError("Context should have an image ID!")
+                pbar.update(1)
+                yield k + 1
 
-                if ctx.dataset_id is None:
-                    raise RuntimeError("Context should have a dataset ID!")
+        # ROIs that were already on OMERO still need a tumor mask
+        pred_missing_ctx = pred_missing_ctx + pred_retry_ctx
+        if len(pred_missing_ctx) > 0:
+            for k in self._run_batch_nnunet(
+                tumor_model, pred_missing_ctx, n_workers, batch_size, rescan=False
+            ):
+                yield len(roi_missing_ctx) + k
+
+        if rescan:
+            self.scanner.update()
+
+    def resume_jobs(self, n_workers: int = 0, batch_size: int = 1) -> int:
+        """Finish the jobs that an interrupted batch run left behind, as recorded in the job ledger.
+
+        The project doesn't need to be scanned. Returns the number of resumed jobs.
+        """
+        n_jobs = 0
+
+        for lungs_model, ctxs in self.ledger.unfinished("roi").items():
+            n_jobs += len(ctxs)
+            for _ in self._run_batch_roi(lungs_model, ctxs, n_workers, rescan=False):
+                continue
+
+        for models, ctxs in self.ledger.unfinished("fused").items():
+            n_jobs += len(ctxs)
+            lungs_model, tumor_model = models.split(",")
+            for _ in self._run_batch_fused(
+                lungs_model, tumor_model, ctxs, [], n_workers, batch_size, rescan=False
+            ):
+                continue
+
+        for model, ctxs in self.ledger.unfinished("pred").items():
+            n_jobs += len(ctxs)
+            for _ in self._run_batch_nnunet(
+                model, ctxs, n_workers, batch_size, rescan=False
+            ):
+                continue
+
+        return n_jobs
+
+    def refresh_outdated(
+        self,
+        ask_confirm: bool = True,
+        lungs_model: Optional[str] = None,
+        tumor_model: Optional[str] = None,
+    ) -> int:
+        """Delete the ROIs and tumor masks computed from a source image that was replaced since.
+
+        With `lungs_model` and `tumor_model`, those computed with other models are deleted too.
+        They are then missing from the project, so the next batch run computes them again (and only them).
+        Corrected masks are kept. Returns the number of deleted images.
+        """
+        roi_outdated_ctx, pred_outdated_ctx = self.scanner.view.outdated(lungs_model, tumor_model)
+        outdated_ctx = pred_outdated_ctx + roi_outdated_ctx
+
+        if len(outdated_ctx) == 0:
+            print("No outdated ROIs or tumor masks.")
+            return 0
 
-                posted_image_name = (
-                    f"{os.path.splitext(ctx.image_name)[0]}_pred_nnunet_{model}.tif"
-                )
+        if ask_confirm:
+            print("\n" + "-" * 60)
+            print("The following outdated images will be deleted from OMERO and computed again:")
+            print(
+                f"  → {', '.join(map(str, [ctx.image_id for ctx in outdated_ctx]))}"
+            )
 
-                _compute_nnunet(
-                    model=model,
-                    image_name=posted_image_name,
-                    image_id=ctx.image_id,
-                    dataset_id=ctx.dataset_id,
-                    project_id=self.id,
-                    omero_client=self.client,
-                )
+            confirm = (
+                input("\n✅ Press [Enter] to confirm, or type [n] to cancel: ")
+                .strip()
+                .lower()
+            )
+            print()
 
-                pbar.update(1)
-                yield k + 1
+            if confirm == "n":
+                return 0
+
+        for ctx in outdated_ctx:
+            print(f"Deleting outdated {ctx.image_class} (ID={ctx.image_id}, source ID={ctx.source_id}, model={ctx.model}).")
+            self.client.delete_image(ctx.image_id)  # type: ignore
+            self.artifacts.remove(ctx.image_id)  # type: ignore
+
+            if ctx.image_class == "roi":
+                corrected = self.scanner.view.specimen_image_classes(ctx.specimen_tag, ctx.time_tag)  # type: ignore
+                if "corrected_pred" in corrected:
+                    print(f"⚠️ The corrected tumor mask of {ctx.specimen_tag} (scan {ctx.time_tag}) was made on the outdated ROI; you may want to check it.")
 
         self.scanner.update()
 
-    def batch_track(self):
+        return len(outdated_ctx)
+
+    def _compute_pool(self, n_workers: int):
+        """Process pool of a run: the long-lived pool if there is one, otherwise a new pool (or none with `n_workers=0`)."""
+        if self.pool is not None:
+            return nullcontext(self.pool)
+        return ComputePool(n_workers) if n_workers > 0 else nullcontext()
+
+    def watch(
+        self,
+        lungs_model: str,
+        tumor_model: str,
+        interval: float = 60,
+        n_workers: int = 0,
+        batch_size: int = 1,
+        max_polls: Optional[int] = None,
+    ) -> None:
+        """Process the new scans of the project as they are uploaded.
+
+        Every `interval` seconds, the number of images and highest image ID of each dataset are polled
+        (a single query). Only the datasets that changed are rescanned, and their missing ROIs, tumor masks
+        and tracking tables are computed. The models stay loaded between polls (also in the `n_workers`
+        pool workers, which are kept alive). Tracking tables are updated incrementally.
+        Errors are logged and the cases involved are tried again after the next poll; only an interruption
+        (e.g. Ctrl+C) stops the watch.
+        """
+        if not lungs_model in self.lungs_models:
+            raise ValueError(
+                f"⚠️ {lungs_model} is not an available model (available: {self.lungs_models})."
+            )
+
+        if not tumor_model in self.tumor_models:
+            raise ValueError(
+                f"⚠️ {tumor_model} is not an available model (available: {self.tumor_models})."
+            )
+
+        pool_ctx = (
+            ComputePool(n_workers, warm_models=(lungs_model, tumor_model))
+            if n_workers > 0
+            else nullcontext()
+        )
+        with pool_ctx as pool:
+            self.pool = pool
+            try:
+                if pool is None:
+                    warm_up_models(lungs_model, tumor_model)
+
+                # Markers are read before scanning, so that nothing uploaded in between is missed
+                markers = self.client.get_dataset_markers(self.id)
+                if len(self.scanner.image_contexts) == 0:
+                    self.scanner.update()
+
+                # Catch up with the work left in the project
+                pending_cases = set(self.scanner.view.cases)
+
+                n_polls = 0
+                while True:
+                    # A failed run is logged and tried again after the next poll, so that the watch keeps going
+                    if len(pending_cases) > 0:
+                        try:
+                            self._process_new_scans(lungs_model, tumor_model, pending_cases, batch_size)
+                            # Our own uploads are not new scans
+                            markers = self._watched_markers(markers, pending_cases)
+                            pending_cases = set()
+                        except Exception as e:
+                            print(f"⚠️ Could not process the new scans of {sorted(pending_cases)} (will try again): {e}")
+
+                    if (max_polls is not None) and (n_polls >= max_polls):
+                        break
+
+                    n_polls += 1
+                    time.sleep(interval)
+
+                    try:
+                        new_markers = self.client.get_dataset_markers(self.id)
+                        changed = [
+                            dataset_id for dataset_id, marker in new_markers.items()
+                            if markers.get(dataset_id) != marker
+                        ]
+                        removed = [dataset_id for dataset_id in markers if dataset_id not in new_markers]
+
+                        if len(changed) + len(removed) > 0:
+                            print(f"{len(changed)} datasets changed and {len(removed)} were removed. Updating...")
+                            for dataset_id in removed:
+                                self.scanner.remove_dataset(dataset_id)
+                            for dataset_id in changed:
+                                self.scanner.update_dataset(dataset_id)
+
+                            pending_cases |= {
+                                ctx.specimen_tag
+                                for ctx in self.scanner.image_contexts
+                                if (ctx.dataset_id in changed) and (ctx.specimen_tag is not None)
+                            }
+
+                        # Only once the changes are rescanned, so that a failed poll sees them again
+                        markers = new_markers
+                    except Exception as e:
+                        print(f"⚠️ Could not poll the project (will try again): {e}")
+            finally:
+                self.pool = None
+
+    def _watched_markers(
+        self, markers: Dict[int, Tuple[int, int]], cases: Set[str]
+    ) -> Dict[int, Tuple[int, int]]:
+        """Updates the markers of the datasets of `cases`, which were rescanned after the uploads of the last run.
+
+        The other datasets keep their previous markers, so that scans uploaded to them in the meantime are picked up.
+        """
+        dataset_ids = {
+            ctx.dataset_id for ctx in self.scanner.image_contexts if ctx.specimen_tag in cases
+        }
+        new_markers = self.client.get_dataset_markers(self.id)
+        markers = dict(markers)
+        for dataset_id in dataset_ids:
+            if dataset_id in new_markers:
+                markers[dataset_id] = new_markers[dataset_id]
+        return markers
+
+    def _process_new_scans(
+        self, lungs_model: str, tumor_model: str, cases: Set[str], batch_size: int = 1
+    ) -> None:
+        """Computes the missing ROIs and tumor masks of the project, then tracks `cases`, rescanning only the datasets involved."""
+        roi_missing_ctx: List[ImageContext] = self.scanner.view.roi_missing
+        if len(roi_missing_ctx) > 0:
+            for _ in self._run_batch_roi(lungs_model, roi_missing_ctx, rescan=False):
+                continue
+            self._rescan_datasets(roi_missing_ctx)
+
+        pred_missing_ctx: List[ImageContext] = self.scanner.view.pred_missing
+        if len(pred_missing_ctx) > 0:
+            for _ in self._run_batch_nnunet(
+                tumor_model, pred_missing_ctx, batch_size=batch_size, rescan=False
+            ):
+                continue
+            self._rescan_datasets(pred_missing_ctx)
+
+        cases = cases | {ctx.specimen_tag for ctx in roi_missing_ctx + pred_missing_ctx}  # type: ignore
+        tracked_cases = [case for case in self.scanner.view.cases if case in cases]
+        for _ in self._run_batch_tracking(tracked_cases, incremental=True):
+            continue
+
+    def _rescan_datasets(self, image_contexts: List[ImageContext]) -> None:
+        for dataset_id in {ctx.dataset_id for ctx in image_contexts}:
+            self.scanner.update_dataset(dataset_id)  # type: ignore
+
+    def _predictions(
+        self,
+        pool: Optional[ComputePool],
+        func: Callable,
+        model: Any,
+        batches: List[List[ImageContext]],
+        stage: str,
+    ):
+        if pool is None:
+            return _batched_predictions(
+                func, model, batches, self.client, self.ledger, stage
+            )
+        return _pooled_predictions(
+            pool, func, model, batches, self.client, self.ledger, stage
+        )
+
+    def _resume_jobs(
+        self, stage: str, model: str, image_contexts: List[ImageContext]
+    ) -> Tuple[List[Tuple[ImageContext, tuple]], List[ImageContext]]:
+        """Splits the jobs into those whose outputs were kept by an interrupted run (with the same model), and those to compute."""
+        resumed = []
+        to_compute = []
+        for ctx in image_contexts:
+            outputs = None
+            if self._has_outputs(stage, model, ctx.image_id):  # type: ignore
+                outputs = self._load_outputs(stage, ctx.image_id)  # type: ignore
+
+            if outputs is None:
+                to_compute.append(ctx)
+            else:
+                resumed.append((ctx, outputs))
+
+        return resumed, to_compute
+
+    def _save_outputs(self, stage: str, image_id: int, outputs: tuple) -> None:
+        if self.ledger.state(stage, image_id) in ["computed", "uploaded"]:
+            return
+
+        for k, output in enumerate(outputs):
+            self.artifacts.put(image_id, f"{stage}_output_{k}", output)
+
+        self.ledger.set_state(stage, image_id, "computed")
+
+    def _load_outputs(self, stage: str, image_id: int) -> Optional[tuple]:
+        outputs = []
+        for k in range(_STAGE_N_OUTPUTS[stage]):
+            output = self.artifacts.get(image_id, f"{stage}_output_{k}")
+            if output is None:
+                return
+            outputs.append(output)
+        return tuple(outputs)
+
+    def _clear_outputs(self, stage: str, image_id: int) -> None:
+        for k in range(_STAGE_N_OUTPUTS[stage]):
+            self.artifacts.delete(image_id, f"{stage}_output_{k}")
+
+    def batch_track(self, n_workers: int = 0, incremental: bool = False):
+        """Track the tumors in every case. With `n_workers > 0`, several cases are tracked at once in a pool of CPU worker processes.
+
+        With `incremental=True`, existing tracking tables are updated with the scans that were added since they were computed.
+        """
         cases: List[str] = self.scanner.view.cases
-        for _ in self._run_batch_tracking(cases):
+        for _ in self._run_batch_tracking(cases, n_workers, incremental):
             continue
 
-    def _run_batch_tracking(self, cases: List[str]):
-        k = 0
+    def _run_batch_tracking(
+        self, cases: List[str], n_workers: int = 0, incremental: bool = False
+    ):
+        if (n_workers > 0) or (self.pool is not None):
+            yield from self._run_pooled_batch_tracking(cases, n_workers, incremental)
+            return
+
         with tqdm(total=len(cases), desc="Tracking tumors") as pbar:
-            for specimen in cases:
+            for k, job in enumerate(self._tracking_jobs(cases, incremental)):
                 pbar.update(1)
-                k += 1
-                yield k
+                yield k + 1
 
-                ctx = self.get_specimen_context(specimen)
+                if job is None:
+                    continue
 
-                # Skip if there is only one time point
-                if ctx.n_labels < 2:
-                    print(f"⚠️ Only one time point is available. Skipping tracking for this case: {specimen}.")
+                _compute_tracking(job, self.client, self.artifacts, self.registrations)
+
+    def _run_pooled_batch_tracking(
+        self, cases: List[str], n_workers: int, incremental: bool = False
+    ):
+        jobs = self._tracking_jobs(cases, incremental)
+
+        with self._compute_pool(n_workers) as pool, tqdm(
+            total=len(cases), desc="Tracking tumors"
+        ) as pbar:
+            for k in _pooled_tracking(
+                pool, jobs, self.client, self.artifacts, self.registrations
+            ):
+                pbar.update(1)
+                yield k
+
+    def _tracking_jobs(
+        self,
+        cases: List[str],
+        incremental: bool = False,
+        omero_client: Optional[OmeroClient] = None,
+    ) -> Iterator[Optional[TrackingJob]]:
+        """Yields the `TrackingJob` of each case, or `None` if it should be skipped.
+
+        With `incremental=True`, cases that already have a tracking table yield a job extending it with the new scans.
+        """
+        client = omero_client if omero_client is not None else self.client
+        tracking_provenance = read_project_tracking_provenance(client, self.id)
+        for specimen in cases:
+            ctx = self.get_specimen_context(specimen, client, tracking_provenance)
+
+            # Skip if there is only one time point
+            if ctx.n_labels < 2:
+                print(f"⚠️ Only one time point is available. Skipping tracking for this case: {specimen}.")
+                yield None
+                continue
+
+            # Skip if the tumor series IDs have NaN values
+            if pd.isna(ctx.tumor_series).sum() > 0:
+                print(f"⚠️ Tumor series IDs has NaN values; tumors weren't computed in all scans? Skipping tracking for this case: {specimen}...")
+                yield None
+                continue
+
+            # Track again from scratch if some of the tumor masks were replaced since the table was computed
+            if ctx.tracking_outdated:
+                print(f"Tracking table is outdated (Table ID: {ctx.tracking_table_id}). Case: {specimen}. Tracking again...")
+                yield ctx.roi_series[0], ctx.roi_series, ctx.tumor_series, None, ctx.tracking_table_id
+                continue
+
+            # Skip if there is already a table attachment (unless it should be updated)
+            if (ctx.tracking_table_id is not None) and (not incremental):
+                print(f"⚠️ Tracking table already exists (Table ID: {ctx.tracking_table_id}). Case: {specimen}. Skipping...")
+                yield None
+                continue
+
+            if ctx.tracking_table_id is not None:
+                # Without a record of the tracked tumor masks, the new scans may not all come after the tracked ones
+                if ctx.tracked_tumor_ids is None:
+                    print(f"Tracking table doesn't record its tumor masks (Table ID: {ctx.tracking_table_id}). Case: {specimen}. Tracking again...")
+                    yield ctx.roi_series[0], ctx.roi_series, ctx.tumor_series, None, ctx.tracking_table_id
                     continue
 
-                # Skip if there is already a table attachment
-                if ctx.tracking_table_id is not None:
-                    print(f"⚠️ Tracking table already exists (Table ID: {ctx.tracking_table_id}). Case: {specimen}. Skipping...")
+                # Link the new scans to the existing table
+                yield ctx.roi_series[0], ctx.roi_series, ctx.tumor_series, ctx.tracking_table_id, None
+                continue
+
+            # Destination image is the first ROI
+            yield ctx.roi_series[0], ctx.roi_series, ctx.tumor_series, None, None
+
+    def batch_workflow(
+        self,
+        lungs_model: str,
+        tumor_model: str,
+        n_workers: int = 0,
+        n_io: int = 2,
+        incremental: bool = False,
+    ) -> None:
+        """Run the full workflow (ROIs, tumor masks and tracking) as a graph of per-image and per-case tasks.
+
+        Each task starts as soon as its inputs exist, e.g. a case is tracked as soon as its own tumor masks
+        are uploaded. I/O tasks (downloads, uploads) run in `n_io` threads; compute tasks run in `n_workers`
+        CPU worker processes (or one at a time in the main process if `n_workers=0`).
+        """
+        if not lungs_model in self.lungs_models:
+            raise ValueError(
+                f"⚠️ {lungs_model} is not an available model (available: {self.lungs_models})."
+            )
+
+        if not tumor_model in self.tumor_models:
+            raise ValueError(
+                f"⚠️ {tumor_model} is not an available model (available: {self.tumor_models})."
+            )
+
+        for _, _, message in self._run_batch_workflow(
+            lungs_model, tumor_model, n_workers, n_io, incremental
+        ):
+            print(message)
+
+    def _run_batch_workflow(
+        self,
+        lungs_model: str,
+        tumor_model: str,
+        n_workers: int = 0,
+        n_io: int = 2,
+        incremental: bool = False,
+    ):
+        """Yields `(n_done, n_tasks, message)` as each task is done."""
+        pool_ctx = self._compute_pool(n_workers)
+        with pool_ctx as pool, SessionPool(self.client) as sessions:
+            scheduler = self._workflow_dag(
+                lungs_model, tumor_model, pool, n_io, incremental, sessions
+            )
+            with tqdm(total=len(scheduler), desc="Running the workflow") as pbar:
+                for k, (key, status) in enumerate(scheduler.run()):
+                    pbar.update(1)
+                    yield k + 1, len(scheduler), f"{key}: {status}"
+
+    def _workflow_dag(
+        self,
+        lungs_model: str,
+        tumor_model: str,
+        pool: Optional[ComputePool],
+        n_io: int = 2,
+        incremental: bool = False,
+        sessions: Optional[SessionPool] = None,
+    ) -> DagScheduler:
+        """Builds the image → roi → pred → tracking(case) task graph of the project.
+
+        The io tasks run on `n_io` threads, so each of them talks to OMERO over a session of `sessions`.
+        """
+        scheduler = DagScheduler(
+            n_io=n_io, n_compute=pool.n_workers if pool is not None else 1
+        )
+
+        roi_missing_ctx: List[ImageContext] = self.scanner.view.roi_missing
+        pred_missing_ctx: List[ImageContext] = self.scanner.view.pred_missing
+        for ctx in roi_missing_ctx + pred_missing_ctx:
+            _check_context(ctx)
+
+        self.ledger.add("roi", lungs_model, roi_missing_ctx)
+        self.ledger.add("pred", tumor_model, pred_missing_ctx)
+
+        # Upload tasks and datasets of each case, which must be done (and rescanned) before tracking
+        case_uploads: Dict[str, List[str]] = {}
+        case_datasets: Dict[str, Set[int]] = {}
+
+        for ctx in roi_missing_ctx:
+            roi = self._add_compute_tasks(
+                scheduler, "roi", compute_rois, lungs_model, ctx, pool, sessions
+            )
+            upload_roi = scheduler.add(
+                f"upload roi:{ctx.image_id}",
+                partial(self._upload_roi_task, ctx, lungs_model, sessions=sessions),
+                [roi],
+            )
+            # The ROI is passed to the tumor model in memory
+            pred = scheduler.add(
+                f"pred:{ctx.image_id}",
+                partial(self._predict_roi_task, pool, tumor_model),
+                [roi],
+                resource="compute",
+            )
+            upload_pred = scheduler.add(
+                f"upload pred:{ctx.image_id}",
+                partial(self._upload_pred_task, ctx, tumor_model, sessions=sessions),
+                [pred, upload_roi],
+            )
+            case_uploads.setdefault(ctx.specimen_tag, []).append(upload_pred)  # type: ignore
+            case_datasets.setdefault(ctx.specimen_tag, set()).add(ctx.dataset_id)  # type: ignore
+
+        for ctx in pred_missing_ctx:
+            pred = self._add_compute_tasks(
+                scheduler, "pred", predict_tumors, tumor_model, ctx, pool, sessions
+            )
+            upload_pred = scheduler.add(
+                f"upload pred:{ctx.image_id}",
+                partial(self._upload_pred_task, ctx, tumor_model, sessions=sessions),
+                [pred],
+            )
+            case_uploads.setdefault(ctx.specimen_tag, []).append(upload_pred)  # type: ignore
+            case_datasets.setdefault(ctx.specimen_tag, set()).add(ctx.dataset_id)  # type: ignore
+
+        for specimen in self.scanner.view.cases:
+            inputs = scheduler.add(
+                f"track inputs:{specimen}",
+                partial(
+                    self._tracking_inputs_task,
+                    specimen,
+                    case_datasets.get(specimen, set()),
+                    incremental,
+                    sessions=sessions,
+                ),
+                case_uploads.get(specimen, []),
+            )
+            tracked = scheduler.add(
+                f"track:{specimen}",
+                partial(self._tracking_task, pool),
+                [inputs],
+                resource="compute",
+            )
+            scheduler.add(
+                f"attach:{specimen}", partial(self._attach_task, sessions=sessions), [tracked]
+            )
+
+        return scheduler
+
+    def _add_compute_tasks(
+        self,
+        scheduler: DagScheduler,
+        stage: str,
+        func: Callable,
+        model: str,
+        ctx: ImageContext,
+        pool: Optional[ComputePool],
+        sessions: Optional[SessionPool] = None,
+    ) -> str:
+        """Adds the download and compute tasks of an image, or a single task loading the outputs kept by an interrupted run."""
+        key = f"{stage}:{ctx.image_id}"
+
+        if self._has_outputs(stage, model, ctx.image_id):  # type: ignore
+            return scheduler.add(key, partial(self._load_outputs, stage, ctx.image_id))
+
+        download = scheduler.add(
+            f"download:{ctx.image_id}", partial(self._download_task, stage, ctx, sessions)
+        )
+        return scheduler.add(
+            key,
+            partial(self._compute_task, pool, stage, func, model, ctx),
+            [download],
+            resource="compute",
+        )
+
+    def _has_outputs(self, stage: str, model: str, image_id: int) -> bool:
+        if self.ledger.state(stage, image_id) not in ["computed", "uploaded"]:
+            return False
+        if self.ledger.model(stage, image_id) != model:
+            return False
+        return all(
+            self.artifacts.has(image_id, f"{stage}_output_{k}")
+            for k in range(_STAGE_N_OUTPUTS[stage])
+        )
+
+    @contextmanager
+    def _io_session(self, sessions: Optional[SessionPool]) -> Iterator[OmeroClient]:
+        """OMERO client of an io task: a session of `sessions` when tasks run on several threads, else the project's client."""
+        if sessions is None:
+            yield self.client
+            return
+
+        with sessions.session() as client:
+            yield client
+
+    def _download_task(
+        self, stage: str, ctx: ImageContext, sessions: Optional[SessionPool] = None
+    ) -> np.ndarray:
+        with self._io_session(sessions) as client:
+            image = client.download_image(ctx.image_id)  # type: ignore
+        self.ledger.set_state(stage, ctx.image_id, "downloaded")  # type: ignore
+        return image
+
+    def _compute_task(
+        self,
+        pool: Optional[ComputePool],
+        stage: str,
+        func: Callable,
+        model: str,
+        ctx: ImageContext,
+        image: np.ndarray,
+    ) -> tuple:
+        outputs = _compute_one(pool, func, model, image)
+        self._save_outputs(stage, ctx.image_id, outputs)  # type: ignore
+        return outputs
+
+    def _predict_roi_task(
+        self, pool: Optional[ComputePool], tumor_model: str, outputs: tuple
+    ) -> tuple:
+        roi, _ = outputs
+        return _compute_one(pool, predict_tumors, tumor_model, roi)
+
+    def _upload_roi_task(
+        self,
+        ctx: ImageContext,
+        lungs_model: str,
+        outputs: tuple,
+        sessions: Optional[SessionPool] = None,
+        posted_roi_id: Optional[int] = None,
+        on_import: Optional[Callable[[int], None]] = None,
+    ) -> int:
+        roi, lungs_roi = outputs
+        with self._io_session(sessions) as client:
+            posted_roi_id = _upload_roi(
+                roi,
+                lungs_roi,
+                image_name=f"{os.path.splitext(ctx.image_name)[0]}_roi.tif",  # type: ignore
+                image_id=ctx.image_id,  # type: ignore
+                dataset_id=ctx.dataset_id,  # type: ignore
+                project_id=self.id,
+                omero_client=client,
+                artifacts=self.artifacts,
+                ledger=self.ledger,
+                model=lungs_model,
+                posted_image_id=posted_roi_id,
+                on_import=on_import,
+            )
+        self._clear_outputs("roi", ctx.image_id)  # type: ignore
+        return posted_roi_id
+
+    def _upload_pred_task(
+        self,
+        ctx: ImageContext,
+        tumor_model: str,
+        outputs: tuple,
+        roi_id: Optional[int] = None,
+        sessions: Optional[SessionPool] = None,
+    ) -> int:
+        """Uploads a tumor mask, either of a ROI that was already on OMERO (`ctx`), or of the ROI just computed from `ctx` (`roi_id`)."""
+        (image_pred,) = outputs
+
+        if roi_id is None:
+            image_id = ctx.image_id
+            image_name = ctx.image_name
+        else:
+            image_id = roi_id
+            image_name = f"{os.path.splitext(ctx.image_name)[0]}_roi.tif"  # type: ignore
+
+        with self._io_session(sessions) as client:
+            posted_image_id = _upload_nnunet(
+                image_pred,
+                image_name=f"{os.path.splitext(image_name)[0]}_pred_nnunet_{tumor_model}.tif",  # type: ignore
+                image_id=image_id,  # type: ignore
+                dataset_id=ctx.dataset_id,  # type: ignore
+                project_id=self.id,
+                omero_client=client,
+                ledger=self.ledger,
+                model=tumor_model,
+            )
+
+        if roi_id is None:
+            self._clear_outputs("pred", ctx.image_id)  # type: ignore
+
+        return posted_image_id
+
+    def _tracking_inputs_task(
+        self,
+        specimen: str,
+        dataset_ids: Set[int],
+        incremental: bool,
+        *uploads,
+        sessions: Optional[SessionPool] = None,
+    ):
+        with self._io_session(sessions) as client:
+            # Pick up the images that were just uploaded
+            for dataset_id in dataset_ids:
+                self.scanner.update_dataset(dataset_id, client)
+
+            job = next(self._tracking_jobs([specimen], incremental, client))
+            if job is None:
+                return
+
+            return _prepare_tracking(job, client, self.artifacts, self.registrations)
+
+    def _tracking_task(self, pool: Optional[ComputePool], prepared):
+        if prepared is None:
+            return
+
+        return prepared, _run_tracking(pool, prepared)
+
+    def _attach_task(self, tracked, sessions: Optional[SessionPool] = None):
+        if tracked is None:
+            return
+
+        (_, _, finish), result = tracked
+        with self._io_session(sessions) as client:
+            finish(result, client)
+
+    @property
+    def queue_path(self) -> Path:
+        """Default location of the work queue of the project (pass another path to share it between hosts)."""
+        return self.artifacts.root / f"project_{self.id}_queue.sqlite"
+
+    def enqueue_jobs(
+        self,
+        queue: WorkQueue,
+        lungs_model: str,
+        tumor_model: str,
+        incremental: bool = False,
+    ) -> int:
+        """Add the missing ROIs, tumor masks and the tracking of each case to a work queue, for `run_worker` processes to pick up.
+
+        Each ROI item also computes the tumor mask of its ROI. The tracking item of a case is only
+        handed out once the other items of that case are done. Returns the number of items added.
+        """
+        if not lungs_model in self.lungs_models:
+            raise ValueError(
+                f"⚠️ {lungs_model} is not an available model (available: {self.lungs_models})."
+            )
+
+        if not tumor_model in self.tumor_models:
+            raise ValueError(
+                f"⚠️ {tumor_model} is not an available model (available: {self.tumor_models})."
+            )
+
+        roi_missing_ctx: List[ImageContext] = self.scanner.view.roi_missing
+        pred_missing_ctx: List[ImageContext] = self.scanner.view.pred_missing
+
+        for ctx in roi_missing_ctx:
+            _check_context(ctx)
+            queue.put(
+                f"roi:{ctx.image_id}",
+                "roi",
+                {"ctx": _ctx_to_payload(ctx), "lungs_model": lungs_model, "tumor_model": tumor_model},
+                group=ctx.specimen_tag,
+            )
+
+        for ctx in pred_missing_ctx:
+            _check_context(ctx)
+            queue.put(
+                f"pred:{ctx.image_id}",
+                "pred",
+                {"ctx": _ctx_to_payload(ctx), "tumor_model": tumor_model},
+                group=ctx.specimen_tag,
+            )
+
+        cases: List[str] = self.scanner.view.cases
+        for specimen in cases:
+            dataset_ids = sorted(
+                {int(ctx.dataset_id) for ctx in self.scanner.image_contexts if ctx.specimen_tag == specimen}
+            )
+            queue.put(
+                f"track:{specimen}",
+                "track",
+                {"specimen": specimen, "dataset_ids": dataset_ids, "incremental": incremental},
+                group=specimen,
+                rank=1,
+            )
+
+        return len(roi_missing_ctx) + len(pred_missing_ctx) + len(cases)
+
+    def run_worker(
+        self,
+        queue: WorkQueue,
+        n_workers: int = 0,
+        lease_seconds: float = 120,
+        poll_seconds: float = 5,
+        wait: bool = False,
+    ) -> int:
+        """Process the items of a work queue until it is empty (or forever, with `wait=True`).
+
+        Several workers, on this machine or on others sharing the queue file, can run at the same time.
+        The project doesn't need to be scanned. Returns the number of items processed by this worker.
+        """
+        owner = worker_name()
+        n_done = 0
+
+        pool_ctx = self._compute_pool(n_workers)
+        with pool_ctx as pool:
+            while wait or queue.n_remaining() > 0:
+                item = queue.claim(owner, lease_seconds)
+                if item is None:
+                    # Other workers are busy with the items this one is waiting for
+                    time.sleep(poll_seconds)
                     continue
-                
-                # Skip if the tumor series IDs have NaN values
-                if pd.isna(ctx.tumor_series).sum() > 0:
-                    print(f"⚠️ Tumor series IDs has NaN values; tumors weren't computed in all scans? Skipping tracking for this case: {specimen}...")
+
+                print(f"Processing {item.key} (attempt {item.attempts}).")
+                try:
+                    with Lease(queue, item, owner, lease_seconds) as lease:
+                        self._process_item(item, lease, pool)
+                except Exception as e:
+                    print(f"⚠️ {item.key} failed: {e}")
+                    queue.fail(item.key, owner, str(e))
                     continue
 
-                _compute_tracking(
-                    image_id=ctx.roi_series[0],  # Destination image is the first ROI
-                    roi_timeseries_ids=ctx.roi_series,
-                    tumor_timeseries_ids=ctx.tumor_series,
-                    omero_client=self.client,
+                if queue.complete(item.key, owner):
+                    n_done += 1
+                else:
+                    print(f"⚠️ Lost the lease of {item.key} before it was done.")
+
+        return n_done
+
+    def _process_item(
+        self, item: WorkItem, lease: Lease, pool: Optional[ComputePool]
+    ) -> None:
+        if item.kind == "track":
+            inputs = self._tracking_inputs_task(
+                item.payload["specimen"],
+                set(item.payload["dataset_ids"]),
+                item.payload["incremental"],
+            )
+            tracked = self._tracking_task(pool, inputs)
+            lease.check()
+            self._attach_task(tracked)
+            return
+
+        ctx = ImageContext(**item.payload["ctx"])
+
+        # ROI imported by an earlier attempt; it is complete once its provenance is recorded (the last upload step)
+        roi_id = item.payload.get("roi_id")
+        roi_complete = (roi_id is not None) and (read_provenance(self.client, roi_id) is not None)
+
+        if (item.kind == "roi") and (not roi_complete):
+            lungs_model = item.payload["lungs_model"]
+            tumor_model = item.payload["tumor_model"]
+            self.ledger.add("roi", lungs_model, [ctx])
+            outputs = self._item_outputs("roi", compute_rois, lungs_model, ctx, pool)
+            lease.check()
+            # Recorded as soon as the ROI is imported, so that the next attempt doesn't import it again
+            posted_roi_id = self._upload_roi_task(
+                ctx,
+                lungs_model,
+                outputs,
+                posted_roi_id=roi_id,
+                on_import=lambda image_id: lease.update_payload(roi_id=image_id),
+            )
+            pred = self._predict_roi_task(pool, tumor_model, outputs)
+            lease.check()
+            self._upload_pred_task(ctx, tumor_model, pred, posted_roi_id)
+        elif item.kind in ["roi", "pred"]:
+            if item.kind == "roi":
+                ctx = ImageContext(
+                    image_class="roi",
+                    project_id=ctx.project_id,
+                    dataset_id=ctx.dataset_id,
+                    image_id=item.payload["roi_id"],
+                    image_name=_roi_image_name(ctx),
                 )
-        
-    def handle_corrected_roi_uploaded(self, posted_image_id: int, image_id: int):
+            tumor_model = item.payload["tumor_model"]
+            self.ledger.add("pred", tumor_model, [ctx])
+            outputs = self._item_outputs("pred", predict_tumors, tumor_model, ctx, pool)
+            lease.check()
+            self._upload_pred_task(ctx, tumor_model, outputs)
+        else:
+            raise ValueError(f"Unknown work item kind: {item.kind}.")
+
+    def _item_outputs(
+        self,
+        stage: str,
+        func: Callable,
+        model: str,
+        ctx: ImageContext,
+        pool: Optional[ComputePool],
+    ) -> tuple:
+        """Computes the outputs of an image, or loads those kept by an interrupted run."""
+        if self._has_outputs(stage, model, ctx.image_id):  # type: ignore
+            return self._load_outputs(stage, ctx.image_id)  # type: ignore
+
+        image = self._download_task(stage, ctx)
+        return self._compute_task(pool, stage, func, model, ctx, image)
+
+    def handle_corrected_roi_uploaded(
+        self, posted_image_id: int, image_id: int, image: Optional[np.ndarray] = None
+    ):
         img_tags = self.client.get_image_tags(image_id)
         
         exclude_tags = TagsProcessor.get_image_tags(img_tags)
@@ -242,12 +1348,107 @@ class OmeroProjectManager:
 
         self.client.tag_image_with_tag(posted_image_id, tag_id=self.corrected_tag_id)
 
-    def upload_from_parent_directory(self, parent_dir: Union[str, Path]):
-        """Upload selecting the parent directory containing image directories to upload"""
-        subfolders = [f.path for f in os.scandir(parent_dir) if f.is_dir()]
-        for k, image_dir in enumerate(subfolders):
-            self.upload_from_directory(image_dir)
-            yield k
+        # Per-tumor statistics of the corrected mask (`image` is the uploaded array)
+        if image is not None:
+            attach_tumor_statistics(self.client, posted_image_id, image)
+
+    def upload_from_parent_directory(self, parent_dir: Union[str, Path], n_workers: int = 2):
+        """Upload selecting the parent directory containing image directories to upload.
+
+        The next folders are read from disk while the previous scans upload (`n_workers` at a time, each over
+        its own OMERO session). A folder that fails is reported and the others go on. Yields the number of
+        folders processed so far.
+        """
+        subfolders = sorted(f.path for f in os.scandir(parent_dir) if f.is_dir())
+        failed = []
+        k = 0
+
+        # Check the names of all the folders first, to create the datasets and tags at once
+        to_upload: List[Tuple[str, List[Path], ImageContext]] = []
+        for image_dir in subfolders:
+            try:
+                tiff_files, image_ctx = utils.scan_ct_folder(image_dir)
+            except ValueError as e:
+                print(f"⚠️ Could not upload this folder: {image_dir} ({e}).")
+                failed.append(image_dir)
+                yield k
+                k += 1
+                continue
+            image_ctx.image_name = f"{image_ctx.specimen_tag}_{image_ctx.time_tag}"
+            image_ctx.project_id = self.id
+            to_upload.append((image_dir, tiff_files, image_ctx))
+
+        specimens = {image_ctx.specimen_tag for _, _, image_ctx in to_upload}
+        dataset_ids = {
+            specimen: (
+                self.scanner.view.get_dataset_id(specimen)
+                if specimen in self.scanner.view.cases
+                else self.client.post_dataset(self.id, specimen)
+            )
+            for specimen in specimens
+        }
+        tag_names = {self.name} | specimens | {image_ctx.time_tag for _, _, image_ctx in to_upload}
+        tag_ids = {tag: self.client.create_tag(self.id, tag) for tag in tag_names}
+
+        def _upload(image_ctx: ImageContext) -> None:
+            with sessions.session() as client:
+                # Scans that are already in their dataset are not uploaded (nor tagged) again
+                image_ctx.image_id, imported = self.scanner.import_image(image_ctx, client)
+                if imported:
+                    for tag_id in [
+                        self.image_tag_id,
+                        tag_ids[image_ctx.time_tag],
+                        tag_ids[image_ctx.specimen_tag],
+                        tag_ids[self.name],
+                    ]:
+                        client.tag_image_with_tag(image_ctx.image_id, tag_id=tag_id)
+            image_ctx.image = None  # Free the volume
+
+        with SessionPool(self.client) as sessions, ThreadPoolExecutor(
+            max_workers=max(1, n_workers)
+        ) as executor:
+            pending: Dict[Future, str] = {}
+
+            def _finished(futures) -> Iterator[int]:
+                nonlocal k
+                for future in futures:
+                    image_dir = pending.pop(future)
+                    try:
+                        future.result()
+                        print(f"✅ Uploaded {image_dir}")
+                    except Exception as e:
+                        print(f"⚠️ Could not upload this folder: {image_dir} ({e}).")
+                        failed.append(image_dir)
+                    yield k
+                    k += 1
+
+            for image_dir, tiff_files, image_ctx in to_upload:
+                try:
+                    image_ctx.image = utils.read_tiff_stack(tiff_files)
+                except Exception as e:
+                    print(f"⚠️ Could not read this folder: {image_dir} ({e}).")
+                    failed.append(image_dir)
+                    yield k
+                    k += 1
+                    continue
+                image_ctx.dataset_id = dataset_ids[image_ctx.specimen_tag]
+                image_ctx.dataset_name = image_ctx.specimen_tag
+                pending[executor.submit(_upload, image_ctx)] = image_dir
+
+                # Read at most one folder ahead of the uploads
+                while len(pending) >= max(1, n_workers):
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    yield from _finished(done)
+
+            yield from _finished(as_completed(list(pending)))
+
+        # A single rescan of the datasets that changed
+        for dataset_id in set(dataset_ids.values()):
+            self.scanner.update_dataset(dataset_id)
+        self.scanner.view.print_summary()
+
+        if len(failed) > 0:
+            print(f"⚠️ {len(failed)} folders could not be uploaded: {failed}")
 
     def upload_from_directory(self, image_dir: Union[str, Path]):
         # Read the 3D tiff (time and name are inferred from the file names)
@@ -257,81 +1458,210 @@ class OmeroProjectManager:
 
         self.scanner.upload_image(image_ctx, self.image_tag_id)
 
-    def download_case(self, specimen: str, out_dir: Union[str, Path]):
+    def download_case(
+        self,
+        specimen: str,
+        out_dir: Union[str, Path],
+        omero_client: Optional[OmeroClient] = None,
+        zarr: bool = False,
+    ):
+        """Download the ROIs, lungs, tumor masks and tracking results of a case. Files that were completely downloaded before are skipped.
+
+        Pass `omero_client` to download from another session (e.g. in a worker thread). With `zarr=True`,
+        the timeseries are saved as chunked and compressed OME-Zarr images instead of TIFF files.
+        """
+        client = omero_client if omero_client is not None else self.client
+
         out_dir = Path(out_dir) / specimen
         if not out_dir.exists():
-            os.makedirs(out_dir)
+            os.makedirs(out_dir, exist_ok=True)
             print("Created the output folder: ", out_dir)
 
-        ctx = self.get_specimen_context(specimen)
+        manifest = ExportManifest(out_dir)
+
+        ext = ".ome.zarr" if zarr else ".tif"
+
+        def write(file: Path, shapes, images, compressed: bool = False) -> None:
+            if len(shapes) == 0:
+                print(f"⚠️ No images to download for {file.name}. Skipping it for this case: {specimen}.")
+                return
+            if zarr:
+                write_func = partial(write_ome_zarr_timeseries, shapes=shapes, images=images)
+            elif compressed:
+                write_func = partial(write_compressed_timeseries, shapes=shapes, images=images)
+            else:
+                write_func = partial(write_timeseries, shapes=shapes, images=images)
+            manifest.write(file, write_func)
+
+        ctx = self.get_specimen_context(specimen, client)
 
         # Download the image ROIs
-        roi_out_file = out_dir / "rois_timeseries.tif"
-        if not roi_out_file.exists():
-            roi_images = []
-            for roi_id in ctx.roi_series:
-                print(f"Downloading roi (ID={roi_id})")
-                image = self.client.download_image(roi_id)
-                roi_images.append(image)
-            rois_timeseries = combine_images(roi_images)
-            skimage.io.imsave(str(roi_out_file), rois_timeseries)
+        roi_out_file = out_dir / f"rois_timeseries{ext}"
+        if not manifest.is_complete(roi_out_file):
+            roi_shapes = [client.get_image_shape(roi_id) for roi_id in ctx.roi_series]
+            write(roi_out_file, roi_shapes, _download_images(client, ctx.roi_series, "roi"))
         else:
             print(f"Already exists: {roi_out_file}")
 
         # Download the lungs
-        # lungs_timeseries_list = []
-        # for roi_id in roi_series:
-        # print("Downloading the lungs annotation")
-        # lungs = self.omero_client.download_binary_mask_from_image_rois(roi_id)
-        # lungs_timeseries_list.append(lungs)
-        # lungs_timeseries = combine_images(lungs_timeseries_list)
-        # skimage.io.imsave(
-        #     str(out_folder / "lungs_timeseries.tif"),
-        #     lungs_timeseries,
-        # )
+        lungs_out_file = out_dir / f"lungs_timeseries{ext}"
+        if not manifest.is_complete(lungs_out_file):
+            lungs_shapes = [client.get_image_shape(roi_id) for roi_id in ctx.roi_series]
+            lungs_images = _download_lungs(client, ctx.roi_series, lungs_shapes)
+            write(lungs_out_file, lungs_shapes, lungs_images, compressed=True)
+        else:
+            print(f"Already exists: {lungs_out_file}")
 
         # Download the tumors
-        tumor_out_file = out_dir / "tumors_untracked.tif"
-        if not tumor_out_file.exists():
-            tumor_images = []
+        tumor_out_file = out_dir / f"tumors_untracked{ext}"
+        if not manifest.is_complete(tumor_out_file):
             # Tumor series can have pandas NaNs in it... here, we ignore them
             valid_tumor_series_ids = [v for v in ctx.tumor_series if pd.notna(v)]
             if pd.isna(ctx.tumor_series).sum() > 0:
-                print(f"⚠️ Tumor series IDs has NaN values; ignoring them (tumors weren't computed in all scans?).")
-            for tumor_id in valid_tumor_series_ids:
-                print(f"Downloading tumor mask (ID={tumor_id})")
-                tumor = self.client.download_image(tumor_id)
-                tumor_images.append(tumor)
-            tumor_timeseries = combine_images(tumor_images)
-            skimage.io.imsave(str(tumor_out_file), tumor_timeseries)
+                print("⚠️ Tumor series IDs has NaN values; ignoring them (tumors weren't computed in all scans?).")
+            tumor_shapes = [client.get_image_shape(tumor_id) for tumor_id in valid_tumor_series_ids]
+            tumor_images = _download_images(client, valid_tumor_series_ids, "tumor mask")
+            write(tumor_out_file, tumor_shapes, tumor_images)
         else:
             print(f"Already exists: {tumor_out_file}")
 
-        # Download the tracked tumors
-        if ctx.tracking_table_id is not None:
-            ts_out_file = out_dir / "tumors_tracked.tif"
-            if not ts_out_file.exists():
-                formatted_df = self.client.get_table(ctx.tracking_table_id)
+        # Download the tracked tumors (relabeled from the untracked tumors)
+        if (ctx.tracking_table_id is not None) and (not manifest.is_complete(tumor_out_file)):
+            print(f"⚠️ No untracked tumors to relabel. Skipping the tracked tumors for this case: {specimen}.")
+        elif ctx.tracking_table_id is not None:
+            ts_out_file = out_dir / f"tumors_tracked{ext}"
+            csv_out_file = out_dir / f"{specimen}_results.csv"
+            if not (manifest.is_complete(ts_out_file) and manifest.is_complete(csv_out_file)):
+                formatted_df = client.get_table(ctx.tracking_table_id)
                 linkage_df = to_linkage_df(formatted_df)
-                tumor_series_tracked = generate_tracked_tumors(tumor_timeseries, linkage_df)
 
-                # Save the tracked tumors and CSV file
-                skimage.io.imsave(str(ts_out_file), tumor_series_tracked)
-                formatted_df.to_csv(str(out_dir / f"{specimen}_results.csv"))
+                if zarr:
+                    # Relabels one timepoint at a time, read from the untracked tumors
+                    tumor_timeseries = read_ome_zarr_timeseries(tumor_out_file)
+                    luts = tracking_luts(linkage_df)
+                    shapes = [tumor_timeseries.shape[1:]] * len(tumor_timeseries)
+                    tracked_images = (
+                        relabel_timepoint(tumor_timeseries[t], luts, t)
+                        for t in range(len(tumor_timeseries))
+                    )
+                    write(ts_out_file, shapes, tracked_images)
+                else:
+                    tumor_timeseries = read_timeseries(tumor_out_file)
+
+                    def write_tracked(path):
+                        # Relabels one timepoint at a time, straight into the output file
+                        shapes = [tumor_timeseries.shape[1:]] * len(tumor_timeseries)
+                        with TimeseriesWriter(path, shapes, np.uint16) as writer:
+                            relabel_timeseries(tumor_timeseries, linkage_df, out=writer.data)
+
+                    manifest.write(ts_out_file, write_tracked)
+
+                # Save the CSV file
+                manifest.write(csv_out_file, formatted_df.to_csv)
             else:
                 print(f"Already exists: {ts_out_file}")
 
-    def download_all_cases(self, out_dir: Path):
+    def download_all_cases(self, out_dir: Path, n_workers: int = 1, zarr: bool = False):
+        """Download every case of the project, `n_workers` cases at a time (each over its own OMERO session).
+
+        A case that fails is reported and the others go on. Yields the number of cases processed so far.
+        With `zarr=True`, the timeseries are saved as OME-Zarr images (see `download_case`).
+        """
         project_dir = out_dir / self.name
         if not project_dir.exists():
             os.makedirs(project_dir)
             print("Created the output folder: ", project_dir)
 
-        for k, case in enumerate(self.scanner.view.cases):
-            self.download_case(case, project_dir)
-            yield k
+        cases: List[str] = self.scanner.view.cases
+        failed = []
+
+        # A single worker downloads with the project's client
+        sessions_ctx = SessionPool(self.client) if n_workers > 1 else nullcontext()
+
+        with sessions_ctx as sessions, ThreadPoolExecutor(max_workers=max(1, n_workers)) as executor:
 
-    def get_specimen_context(self, specimen: str) -> SpecimenContext:
+            def _download(case: str) -> None:
+                with self._io_session(sessions) as client:
+                    self.download_case(case, project_dir, client, zarr=zarr)
+
+            futures = {executor.submit(_download, case): case for case in cases}
+            for k, future in enumerate(as_completed(futures)):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"⚠️ Could not download this case: {futures[future]} ({e}).")
+                    failed.append(futures[future])
+                yield k
+
+        if len(failed) > 0:
+            print(f"⚠️ {len(failed)} cases could not be downloaded (run again to retry): {failed}")
+
+    def get_tracking_results(
+        self, n_workers: int = 4, column_prefixes: Optional[List[str]] = None
+    ) -> pd.DataFrame:
+        """Fetch the tracking table of every case (`n_workers` at a time, each over its own OMERO session) and merge them.
+
+        Only the tables are downloaded, not the images. With `column_prefixes` (e.g. `["Tumor ID", "volume"]`),
+        only the columns starting with one of them are read.
+        """
+        cases: List[str] = self.scanner.view.cases
+
+        def _fetch(case: str) -> Optional[pd.DataFrame]:
+            roi_series, _ = self.scanner.view.tumor_timeseries_ids(case)
+            if len(roi_series) == 0:
+                return
+            with sessions.session() as client:
+                tracking_table_ids = [
+                    table_id
+                    for table_id, title in client.get_image_tables(roi_series[0]).items()
+                    if title != REGISTRATION_TABLE_TITLE
+                ]
+                if len(tracking_table_ids) > 1:
+                    print(f"⚠️ Multiple tables are associated with this image: {roi_series[0]}. Skipping case: {case}.")
+                    return
+                if len(tracking_table_ids) == 1:
+                    table_id = tracking_table_ids[0]
+                    columns = None
+                    if column_prefixes is not None:
+                        # The columns differ between cases (one per scan)
+                        columns = [
+                            col for col in client.get_table_columns(table_id)
+                            if col.startswith(tuple(column_prefixes))
+                        ]
+                    return client.get_table(table_id, columns=columns)
+
+        results: Dict[str, pd.DataFrame] = {}
+        with SessionPool(self.client) as sessions, ThreadPoolExecutor(
+            max_workers=max(1, n_workers)
+        ) as executor:
+            futures = {executor.submit(_fetch, case): case for case in cases}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Tracking tables"):
+                df = future.result()
+                if df is not None:
+                    results[futures[future]] = df
+
+        # Keep the order of the cases, whatever the order the tables came in
+        return utils.merge_results({case: results[case] for case in cases if case in results})
+
+    def export_results(
+        self,
+        out_file: Union[str, Path],
+        n_workers: int = 4,
+        column_prefixes: Optional[List[str]] = None,
+    ) -> None:
+        """Save the merged tracking results of all cases as CSV (or Parquet, if `out_file` ends with `.parquet`)."""
+        out_file = Path(out_file)
+        out_file.parent.mkdir(parents=True, exist_ok=True)
+        utils.save_results(self.get_tracking_results(n_workers, column_prefixes), out_file)
+
+    def get_specimen_context(
+        self,
+        specimen: str,
+        omero_client: Optional[OmeroClient] = None,
+        tracking_provenance: Optional[Dict[int, List[int]]] = None,
+    ) -> SpecimenContext:
+        """Pass the `tracking_provenance` of the project (see `read_project_tracking_provenance`) to avoid reading it for each case."""
+        client = omero_client if omero_client is not None else self.client
         roi_series, tumor_series = self.scanner.view.tumor_timeseries_ids(specimen)
         n_rois = len(roi_series)
         n_nan_labels = pd.isna(tumor_series).sum()
@@ -339,7 +1669,7 @@ class OmeroProjectManager:
 
         n_lungs = 0
         for roi_id in roi_series:  # Refers to the omero rois (it's confusing..)
-            ome_roi_ids = self.client.get_image_rois(roi_id)
+            ome_roi_ids = client.get_image_rois(roi_id)
             if len(ome_roi_ids) == 1:
                 n_lungs += 1  # TODO: correct logic?
 
@@ -347,12 +1677,28 @@ class OmeroProjectManager:
 
         n_tracked = 0
         tracking_table_id = None
+        tracking_outdated = False
+        tracked_ids = None
         if n_rois > 0:
             dst_image_id = roi_series[0]
-            tracking_table_ids = self.client.get_image_table_ids(dst_image_id)
+            tracking_table_ids = [
+                table_id
+                for table_id, title in client.get_image_tables(dst_image_id).items()
+                if title != REGISTRATION_TABLE_TITLE
+            ]
             if len(tracking_table_ids) == 1:
                 n_tracked = n_labels
                 tracking_table_id = tracking_table_ids[0]
+
+                # The table is outdated if any of the tumor masks it was computed from was replaced, or if a
+                # new scan comes before a tracked one (new scans after the tracked ones are fine)
+                if tracking_provenance is not None:
+                    tracked_ids = tracking_provenance.get(dst_image_id)
+                else:
+                    tracked_ids = read_tracking_provenance(client, dst_image_id)
+                if tracked_ids is not None:
+                    current_ids = [int(v) if pd.notna(v) else None for v in tumor_series]
+                    tracking_outdated = tracked_ids != current_ids[: len(tracked_ids)]
             elif len(tracking_table_ids) > 1:
                 print(f"Warning: Multiple tables are associated with this image: {roi_series[0]}. Which one is the tracking table? Skipping for now.")
     
@@ -366,9 +1712,72 @@ class OmeroProjectManager:
             roi_series=roi_series,
             tumor_series=tumor_series,
             tracking_table_id=tracking_table_id,
+            tracking_outdated=tracking_outdated,
+            tracked_tumor_ids=tracked_ids,
         )
 
 
+def _roi_image_name(ctx: ImageContext) -> str:
+    return f"{os.path.splitext(ctx.image_name)[0]}_roi.tif"  # type: ignore
+
+
+def _pred_image_name(ctx: ImageContext, model: str) -> str:
+    return f"{os.path.splitext(ctx.image_name)[0]}_pred_nnunet_{model}.tif"  # type: ignore
+
+
+def _download_images(
+    omero_client: OmeroClient, image_ids: List[int], description: str
+) -> Iterator[np.ndarray]:
+    """Downloads images one at a time, so that only one of them is in memory."""
+    for image_id in image_ids:
+        print(f"Downloading {description} (ID={image_id})")
+        yield omero_client.download_image(image_id)
+
+
+def _download_lungs(
+    omero_client: OmeroClient,
+    image_ids: List[int],
+    shapes: List[Tuple[int, int, int]],
+    n_threads: int = 4,
+) -> Iterator[np.ndarray]:
+    """Downloads the lungs ROIs of images as masks, in order.
+
+    The polygons of each image are fetched in one call and filled by a pool of threads,
+    while the polygons of the next images are fetched.
+    """
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        pending = deque()
+        for image_id, shape in zip(image_ids, shapes):
+            print(f"Downloading lungs (ID={image_id})")
+            polygons = omero_client.get_image_polygons(image_id)
+            pending.append(executor.submit(rasterize_polygons, polygons, shape))
+            if len(pending) >= n_threads:
+                yield pending.popleft().result()
+
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+
+def _check_context(ctx: ImageContext) -> None:
+    if ctx.image_name is None:
+        raise RuntimeError("Context should have an image name!")
+
+    if ctx.image_id is None:
+        raise RuntimeError("Context should have an image ID!")
+
+    if ctx.dataset_id is None:
+        raise RuntimeError("Context should have a dataset ID!")
+
+
+def _ctx_to_payload(ctx: ImageContext) -> Dict[str, Any]:
+    payload = {}
+    for field in _QUEUE_CTX_FIELDS:
+        value = getattr(ctx, field)
+        # The IDs found by the scanner can be numpy integers, which are not JSON serializable
+        payload[field] = value.item() if isinstance(value, np.generic) else value
+    return payload
+
+
 class OmeroController(OmeroClient):
     def __init__(
         self,
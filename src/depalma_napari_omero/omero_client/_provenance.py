@@ -0,0 +1,97 @@
+import hashlib
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from depalma_napari_omero.omero_client._client import OmeroClient
+
+# Namespaces of the map annotations recording how derived images and tracking tables were computed
+PROVENANCE_NS = "depalma-napari-omero/provenance"
+TRACKING_PROVENANCE_NS = "depalma-napari-omero/tracking-provenance"
+
+# Namespace of the map annotation holding the content hash of uploaded images
+CONTENT_HASH_NS = "depalma-napari-omero/content-hash"
+
+
+def content_hash(image: np.ndarray) -> str:
+    """Hash of the pixels, shape and dtype of an image (BLAKE2, on every installation, so that recorded hashes always compare).
+
+    The name of the algorithm prefixes the hash, in case it ever changes.
+    """
+    h = hashlib.blake2b(digest_size=8)
+    h.update(f"{image.shape}{image.dtype.str}".encode())
+    h.update(np.ascontiguousarray(image).reshape(-1).view(np.uint8))
+    return f"blake2b:{h.hexdigest()}"
+
+
+def record_content_hash(omero_client: OmeroClient, image_id: int, image_hash: str) -> None:
+    """Records the content hash of an uploaded image (see `OmeroClient.get_content_hashes`)."""
+    omero_client.set_image_map_annotation(image_id, CONTENT_HASH_NS, {"hash": image_hash})
+
+
+def record_provenance(
+    omero_client: OmeroClient,
+    image_id: int,
+    source_id: int,
+    image: np.ndarray,
+    model: Optional[str] = None,
+) -> None:
+    """Records the source (ID and content hash), the content hash and the model of a derived image (ROI or tumor mask).
+
+    The scanner compares them with the current source images and the selected models to find outdated images.
+    """
+    omero_client.set_image_map_annotation(
+        image_id,
+        PROVENANCE_NS,
+        {
+            "source_id": str(int(source_id)),
+            "source_hash": read_content_hash(omero_client, source_id) or "",
+            "checksum": content_hash(image),
+            "model": model if model is not None else "",
+        },
+    )
+
+
+def read_provenance(omero_client: OmeroClient, image_id: int) -> Optional[Dict[str, str]]:
+    """Returns the provenance of a derived image, or `None` if it wasn't recorded."""
+    return omero_client.get_image_map_annotation(image_id, PROVENANCE_NS)
+
+
+def read_content_hash(omero_client: OmeroClient, image_id: int) -> Optional[str]:
+    """Returns the content hash of an image: recorded when it was imported (scans), or in its provenance (ROIs)."""
+    recorded = omero_client.get_image_map_annotation(image_id, CONTENT_HASH_NS)
+    if recorded is not None:
+        return recorded["hash"]
+
+    provenance = read_provenance(omero_client, image_id)
+    if provenance is not None:
+        return provenance.get("checksum") or None
+
+
+def record_tracking_provenance(
+    omero_client: OmeroClient, image_id: int, tumor_timeseries_ids: List[int]
+) -> None:
+    """Records the IDs of the tumor masks that the tracking table of an image was computed from."""
+    omero_client.set_image_map_annotation(
+        image_id,
+        TRACKING_PROVENANCE_NS,
+        {"tumor_ids": ",".join(str(int(tumor_id)) for tumor_id in tumor_timeseries_ids)},
+    )
+
+
+def _tumor_ids(provenance: Dict[str, str]) -> List[int]:
+    return [int(tumor_id) for tumor_id in provenance["tumor_ids"].split(",") if tumor_id]
+
+
+def read_tracking_provenance(omero_client: OmeroClient, image_id: int) -> Optional[List[int]]:
+    """Returns the IDs of the tumor masks that the tracking table of an image was computed from, if they were recorded."""
+    provenance = omero_client.get_image_map_annotation(image_id, TRACKING_PROVENANCE_NS)
+    if provenance is None:
+        return
+    return _tumor_ids(provenance)
+
+
+def read_project_tracking_provenance(omero_client: OmeroClient, project_id: int) -> Dict[int, List[int]]:
+    """Maps the images of a project that have a tracking table to the IDs of the tumor masks it was computed from, in a single query."""
+    annotations = omero_client.get_map_annotations(project_id, TRACKING_PROVENANCE_NS)
+    return {image_id: _tumor_ids(provenance) for image_id, provenance in annotations.items()}
@@ -0,0 +1,260 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+# An item goes through these states; leased items go back to "queued" when their lease expires (or to "failed", after too many attempts)
+ITEM_STATES = ["queued", "leased", "done", "failed"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    grp TEXT,
+    rank INTEGER NOT NULL DEFAULT 0,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL,
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated REAL
+)
+"""
+
+
+def worker_name() -> str:
+    """Unique name of a queue worker (host, process, and a random suffix)."""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+@dataclass
+class WorkItem:
+    key: str
+    kind: str
+    payload: Dict[str, Any]
+    attempts: int
+
+
+class WorkQueue:
+    """Work queue shared by several `dno worker` processes, backed by a SQLite file.
+
+    Workers claim items with a lease, which they renew (heartbeat) while they work on them.
+    Items whose lease expired (e.g. their worker was killed) can be claimed again by other workers.
+    Within a group (e.g. a case), items can only be claimed once all the items of lower rank are done.
+
+    To run workers on several hosts, the file must be on a shared filesystem that supports file locks.
+    """
+
+    def __init__(self, path: Union[str, Path], max_attempts: int = 3):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_attempts = max_attempts
+        self._execute(_SCHEMA)
+
+    def _execute(self, query: str, params=()) -> List[tuple]:
+        with closing(sqlite3.connect(self.path, timeout=60)) as conn:
+            with conn:
+                return conn.execute(query, params).fetchall()
+
+    def _update(self, query: str, params=()) -> int:
+        """Runs an update and returns the number of changed rows."""
+        with closing(sqlite3.connect(self.path, timeout=60)) as conn:
+            with conn:
+                return conn.execute(query, params).rowcount
+
+    def put(
+        self,
+        key: str,
+        kind: str,
+        payload: Dict[str, Any],
+        group: Optional[str] = None,
+        rank: int = 0,
+    ) -> None:
+        """Adds an item. Items that are already queued or leased are left as they are; done or failed items are queued again."""
+        self._execute(
+            """
+            INSERT INTO items (key, kind, grp, rank, payload, state, updated)
+            VALUES (?, ?, ?, ?, ?, 'queued', ?)
+            ON CONFLICT (key) DO UPDATE SET
+                payload = excluded.payload,
+                state = 'queued',
+                owner = NULL,
+                lease_expires = NULL,
+                attempts = 0,
+                error = NULL,
+                updated = excluded.updated
+            WHERE items.state IN ('done', 'failed')
+            """,
+            (key, kind, group, rank, json.dumps(payload), time.time()),
+        )
+
+    def claim(self, owner: str, lease_seconds: float) -> Optional[WorkItem]:
+        """Leases the next available item to `owner`, or returns `None` if there is nothing to do right now."""
+        now = time.time()
+        with closing(sqlite3.connect(self.path, timeout=60, isolation_level=None)) as conn:
+            # Takes the write lock before reading, so that two workers can't claim the same item
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Expired leases count as failed attempts (e.g. the item keeps killing its workers)
+                conn.execute(
+                    """
+                    UPDATE items SET
+                        state = 'failed', owner = NULL, lease_expires = NULL,
+                        error = COALESCE(error, 'The lease expired.'), updated = ?
+                    WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?
+                    """,
+                    (now, now, self.max_attempts),
+                )
+
+                row = conn.execute(
+                    """
+                    SELECT key, kind, payload, attempts FROM items AS item
+                    WHERE (state = 'queued' OR (state = 'leased' AND lease_expires < ?))
+                    AND NOT EXISTS (
+                        SELECT 1 FROM items AS other
+                        WHERE other.grp = item.grp AND other.rank < item.rank
+                        AND other.state IN ('queued', 'leased')
+                    )
+                    ORDER BY rank, updated
+                    LIMIT 1
+                    """,
+                    (now,),
+                ).fetchone()
+
+                if row is None:
+                    conn.execute("COMMIT")
+                    return
+
+                key, kind, payload, attempts = row
+                conn.execute(
+                    """
+                    UPDATE items SET state = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1, updated = ?
+                    WHERE key = ?
+                    """,
+                    (owner, now + lease_seconds, now, key),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        return WorkItem(key=key, kind=kind, payload=json.loads(payload), attempts=attempts + 1)
+
+    def heartbeat(self, key: str, owner: str, lease_seconds: float) -> bool:
+        """Extends a lease. Returns `False` if `owner` doesn't hold it anymore."""
+        now = time.time()
+        n_updated = self._update(
+            """
+            UPDATE items SET lease_expires = ?
+            WHERE key = ? AND owner = ? AND state = 'leased' AND lease_expires >= ?
+            """,
+            (now + lease_seconds, key, owner, now),
+        )
+        return n_updated > 0
+
+    def update_payload(self, key: str, owner: str, payload: Dict[str, Any]) -> bool:
+        """Replaces the payload of a leased item. Returns `False` if `owner` doesn't hold its lease anymore."""
+        n_updated = self._update(
+            """
+            UPDATE items SET payload = ?, updated = ?
+            WHERE key = ? AND owner = ? AND state = 'leased'
+            """,
+            (json.dumps(payload), time.time(), key, owner),
+        )
+        return n_updated > 0
+
+    def complete(self, key: str, owner: str) -> bool:
+        """Marks a leased item as done. Returns `False` if `owner` doesn't hold its lease anymore."""
+        n_updated = self._update(
+            """
+            UPDATE items SET state = 'done', owner = NULL, lease_expires = NULL, updated = ?
+            WHERE key = ? AND owner = ? AND state = 'leased'
+            """,
+            (time.time(), key, owner),
+        )
+        return n_updated > 0
+
+    def fail(self, key: str, owner: str, error: str) -> None:
+        """Releases a leased item after an error. It is queued again, unless it failed too many times."""
+        self._execute(
+            """
+            UPDATE items SET
+                state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,
+                owner = NULL, lease_expires = NULL, error = ?, updated = ?
+            WHERE key = ? AND owner = ? AND state = 'leased'
+            """,
+            (self.max_attempts, error, time.time(), key, owner),
+        )
+
+    def counts(self) -> Dict[str, int]:
+        """Number of items in each state."""
+        rows = self._execute("SELECT state, COUNT(*) FROM items GROUP BY state")
+        counts = {state: 0 for state in ITEM_STATES}
+        counts.update(dict(rows))
+        return counts
+
+    def n_remaining(self) -> int:
+        """Number of items that are queued or being worked on."""
+        counts = self.counts()
+        return counts["queued"] + counts["leased"]
+
+
+class Lease:
+    """Keeps the lease of an item alive from a background thread while the item is processed.
+
+    Call `check()` before side effects (e.g. uploads), to make sure that no other worker took the item over.
+    """
+
+    def __init__(self, queue: WorkQueue, item: WorkItem, owner: str, lease_seconds: float):
+        self.queue = queue
+        self.item = item
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+
+        self.is_held = True
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                self.is_held = self.queue.heartbeat(self.item.key, self.owner, self.lease_seconds)
+            except Exception as e:
+                print(f"⚠️ Could not renew the lease of {self.item.key}: {e}")
+                self.is_held = False
+
+            if not self.is_held:
+                return
+
+    def check(self) -> None:
+        """Renews the lease, and raises if it was lost (even if the heartbeat didn't notice it yet)."""
+        if self.is_held:
+            self.is_held = self.queue.heartbeat(self.item.key, self.owner, self.lease_seconds)
+
+        if not self.is_held:
+            raise RuntimeError(f"Lost the lease of {self.item.key}.")
+
+    def update_payload(self, **values) -> None:
+        """Records progress in the payload of the item, so that a retry (possibly by another worker) can skip the steps already done."""
+        payload = {**self.item.payload, **values}
+        if not self.queue.update_payload(self.item.key, self.owner, payload):
+            self.is_held = False
+            raise RuntimeError(f"Lost the lease of {self.item.key}.")
+
+        self.item.payload = payload
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
@@ -0,0 +1,116 @@
+import hashlib
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from depalma_napari_omero.omero_client._artifacts import ArtifactStore
+from depalma_napari_omero.omero_client._client import OmeroClient
+
+REGISTRATION_TABLE_TITLE = "Lungs registration"
+
+_MATRIX_COLUMNS = [f"m{i}{j}" for i in range(4) for j in range(4)]
+
+
+def lungs_checksum(lungs0: np.ndarray, lungs1: np.ndarray) -> str:
+    """Checksum of a pair of (padded) lungs masks, which identifies their registration transform."""
+    h = hashlib.blake2b(digest_size=8)
+    for lungs in (lungs0, lungs1):
+        h.update(str(lungs.shape).encode())
+        h.update(np.ascontiguousarray(lungs).tobytes())
+    return h.hexdigest()
+
+
+class RegistrationCache:
+    """Lungs registration transforms, keyed by (reference ROI ID, ROI ID, lungs masks checksum).
+
+    Transforms are kept in the local artifact store. With `share=True`, they are also attached
+    to the reference ROI on OMERO as a table, so that other machines can reuse them.
+    """
+
+    def __init__(
+        self,
+        omero_client: OmeroClient,
+        artifacts: ArtifactStore,
+        share: bool = False,
+    ):
+        self.client = omero_client
+        self.artifacts = artifacts
+        self.share = share
+
+    def load(
+        self, roi_ids: List[int], lungs_timeseries: np.ndarray
+    ) -> Tuple[List[str], List[Optional[np.ndarray]]]:
+        """Returns the checksums and known transforms (or `None`) that register each frame onto the first one."""
+        reference_id = int(roi_ids[0])
+
+        checksums = [""]
+        transforms: List[Optional[np.ndarray]] = [np.eye(4)]
+        for roi_id, lungs in zip(roi_ids[1:], lungs_timeseries[1:]):
+            checksum = lungs_checksum(lungs_timeseries[0], lungs)
+            checksums.append(checksum)
+            transforms.append(self.artifacts.get(roi_id, self._name(reference_id, checksum)))
+
+        if self.share and any(transform is None for transform in transforms):
+            shared_df = self._get_shared_df(reference_id)
+            if shared_df is not None:
+                for k, (roi_id, checksum) in enumerate(zip(roi_ids, checksums)):
+                    if transforms[k] is not None:
+                        continue
+                    filt = (shared_df["ROI ID"] == int(roi_id)) & (shared_df["Checksum"] == checksum)
+                    if filt.sum() > 0:
+                        transforms[k] = shared_df.loc[filt, _MATRIX_COLUMNS].values[0].reshape((4, 4))
+                        self.artifacts.put(roi_id, self._name(reference_id, checksum), transforms[k])
+
+        return checksums, transforms
+
+    def save(
+        self,
+        roi_ids: List[int],
+        checksums: List[str],
+        transforms: List[np.ndarray],
+    ) -> None:
+        reference_id = int(roi_ids[0])
+
+        new_rows = []
+        for roi_id, checksum, transform in zip(roi_ids[1:], checksums[1:], transforms[1:]):
+            name = self._name(reference_id, checksum)
+            if not self.artifacts.has(roi_id, name):
+                self.artifacts.put(roi_id, name, transform)
+                new_rows.append([int(roi_id), checksum, *np.asarray(transform).ravel()])
+
+        if self.share and len(new_rows) > 0:
+            self._update_shared_df(reference_id, new_rows)
+
+    def _name(self, reference_id: int, checksum: str) -> str:
+        return f"registration_{reference_id}_{checksum}"
+
+    def _get_shared_table_id(self, reference_id: int) -> Optional[int]:
+        for table_id, title in self.client.get_image_tables(reference_id).items():
+            if title == REGISTRATION_TABLE_TITLE:
+                return table_id
+
+    def _get_shared_df(self, reference_id: int) -> Optional[pd.DataFrame]:
+        table_id = self._get_shared_table_id(reference_id)
+        if table_id is None:
+            return
+        return self.client.get_table(table_id)
+
+    def _update_shared_df(self, reference_id: int, new_rows: List[list]) -> None:
+        new_df = pd.DataFrame(new_rows, columns=["ROI ID", "Checksum", *_MATRIX_COLUMNS])
+
+        table_id = self._get_shared_table_id(reference_id)
+        if table_id is not None:
+            shared_df = pd.concat([self.client.get_table(table_id), new_df], ignore_index=True)
+            shared_df = shared_df.drop_duplicates(subset=["ROI ID", "Checksum"], keep="last")
+        else:
+            shared_df = new_df
+
+        self.client.attach_table_to_image(
+            table=shared_df,
+            image_id=reference_id,
+            table_title=REGISTRATION_TABLE_TITLE,
+        )
+
+        if table_id is not None:
+            self.client.delete_table(table_id)
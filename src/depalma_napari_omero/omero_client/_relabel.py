@@ -0,0 +1,71 @@
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+# Number of voxels relabeled at once; bounds the temporary index array that numpy makes for the lookup
+_CHUNK_VOXELS = 2**24
+
+
+def tracking_luts(linkage_df: pd.DataFrame, dtype=np.uint16) -> Dict[int, np.ndarray]:
+    """One lookup table per scan mapping its labels to tracked tumor IDs, from a linkage table (`scan`, `tumor`, `label`).
+
+    The last entry of each table is zero: with `mode="clip"`, labels that are not in the table (untracked) go to zero.
+    """
+    df = linkage_df[["scan", "tumor", "label"]].dropna()
+    df = df.astype(np.int64)
+    df = df[(df["label"] > 0) & (df["tumor"] > 0)]
+
+    if len(df) and df["tumor"].max() > np.iinfo(dtype).max:
+        raise ValueError(f"Tumor IDs up to {df['tumor'].max()} don't fit in {np.dtype(dtype)}.")
+
+    luts = {}
+    for scan, dft in df.groupby("scan"):
+        labels = dft["label"].to_numpy()
+        lut = np.zeros(labels.max() + 2, dtype=dtype)
+        lut[labels] = dft["tumor"].to_numpy()
+        luts[int(scan)] = lut
+
+    return luts
+
+
+def relabel(labels: np.ndarray, lut: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Maps the `labels` volume through `lut` (`out` may be `labels` itself, to relabel in place)."""
+    if out is None:
+        out = np.empty(labels.shape, dtype=lut.dtype)
+
+    # Relabel a few planes at a time, so that the intermediate index array stays small
+    step = max(1, _CHUNK_VOXELS // max(1, int(np.prod(labels.shape[1:]))))
+    for z in range(0, len(labels), step):
+        np.take(lut, labels[z : z + step], out=out[z : z + step], mode="clip")
+
+    return out
+
+
+def relabel_timepoint(
+    labels: np.ndarray,
+    luts: Dict[int, np.ndarray],
+    t: int,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Relabels the volume of scan `t`; scans without a lookup table (nothing tracked) become empty."""
+    lut = luts.get(t)
+    if lut is None:
+        lut = np.zeros(1, dtype=out.dtype if out is not None else np.uint16)
+    return relabel(labels, lut, out)
+
+
+def relabel_timeseries(
+    labels_timeseries: np.ndarray,
+    linkage_df: pd.DataFrame,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Same as `generate_tracked_tumors`, one timepoint at a time into `out` (e.g. a memory-mapped file, or `labels_timeseries` itself)."""
+    if out is None:
+        out = np.empty(labels_timeseries.shape, dtype=np.uint16)
+
+    luts = tracking_luts(linkage_df, out.dtype)
+    for t in range(len(labels_timeseries)):
+        relabel_timepoint(labels_timeseries[t], luts, t, out[t])
+
+    return out
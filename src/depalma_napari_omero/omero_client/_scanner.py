@@ -1,9 +1,18 @@
+import threading
+from typing import Dict, Optional, Tuple
+
 from tqdm import tqdm
 
 from depalma_napari_omero.omero_client._client import OmeroClient
 from depalma_napari_omero.omero_client._view import ProjectDataView
 from depalma_napari_omero.omero_client._tags_processor import TagsProcessor
 from depalma_napari_omero.omero_client._context import ImageContext
+from depalma_napari_omero.omero_client._provenance import (
+    CONTENT_HASH_NS,
+    PROVENANCE_NS,
+    content_hash,
+    record_content_hash,
+)
 
 
 class ProjectScanner:
@@ -19,6 +28,11 @@ class ProjectScanner:
         self.name = project_name
 
         self.image_contexts = []
+        # (dataset ID, content hash) => image ID of the uploaded images
+        self.content_hashes: Dict[Tuple[int, str], int] = {}
+        # Image ID => provenance of the computed images (see `record_provenance`)
+        self.provenance: Dict[int, Dict[str, str]] = {}
+        self._lock = threading.Lock()
 
         if launch_scan:
             self.update()
@@ -39,6 +53,8 @@ class ProjectScanner:
 
     def launch_scan(self):
         self.image_contexts = []
+        self.content_hashes = self.omero_client.get_content_hashes(self.id, CONTENT_HASH_NS)
+        self.provenance = self.omero_client.get_map_annotations(self.id, PROVENANCE_NS)
         previous_dataset_id = None
         k = 0
         with tqdm(total=self.n_datasets, desc="Scanning project") as pbar:
@@ -55,21 +71,85 @@ class ProjectScanner:
         
         self.view.print_summary()
 
+    def update_dataset(self, dataset_id: int, omero_client: Optional[OmeroClient] = None):
+        """Rescan a single dataset of the project (e.g. after uploading images to it).
+
+        Pass `omero_client` to scan over another session (e.g. in a worker thread).
+        """
+        client = omero_client if omero_client is not None else self.omero_client
+        provenance = client.get_map_annotations(self.id, PROVENANCE_NS, dataset_id)
+        with self._lock:
+            self.provenance.update(provenance)
+
+        dataset = client.get_dataset(dataset_id)
+        dataset_contexts = list(self._dataset_image_contexts(dataset, client))
+        with self._lock:
+            self.image_contexts = [
+                ctx for ctx in self.image_contexts if ctx.dataset_id != dataset_id
+            ] + dataset_contexts
+
+    def remove_dataset(self, dataset_id: int):
+        """Forget the images of a dataset (e.g. after it was deleted from OMERO)."""
+        with self._lock:
+            self.image_contexts = [
+                ctx for ctx in self.image_contexts if ctx.dataset_id != dataset_id
+            ]
+
+    def import_image(
+        self, image_ctx: ImageContext, omero_client: Optional[OmeroClient] = None
+    ) -> Tuple[int, bool]:
+        """Imports the image of a context into its dataset, unless the dataset already has an image with the same content.
+
+        Returns the image ID and whether the image was imported (`False` if it resolved to the existing image).
+        Pass `omero_client` to import over another session (e.g. in a worker thread).
+        """
+        client = omero_client if omero_client is not None else self.omero_client
+
+        if image_ctx.image is None:
+            raise RuntimeError("Image upload needs an image array!")
+
+        if image_ctx.project_id is None or image_ctx.dataset_id is None or image_ctx.image_name is None:
+            raise RuntimeError("Image upload needs a project ID, a dataset ID and an image name!")
+
+        image_hash = content_hash(image_ctx.image)
+        existing_image_id = self.content_hashes.get((image_ctx.dataset_id, image_hash))
+        if existing_image_id is not None:
+            # The index is from the last scan; the image may have been deleted since
+            try:
+                client.get_image(existing_image_id)
+                print(f"✅ {image_ctx.image_name} is already uploaded (image ID = {existing_image_id}).")
+                return existing_image_id, False
+            except LookupError:
+                pass
+
+        posted_image_id = client.import_image_to_ds(
+            image_ctx.image,
+            image_ctx.project_id,
+            image_ctx.dataset_id,
+            image_ctx.image_name,
+        )
+        record_content_hash(client, posted_image_id, image_hash)
+
+        with self._lock:
+            self.content_hashes[(image_ctx.dataset_id, image_hash)] = posted_image_id
+
+        return posted_image_id, True
+
     def upload_image(self, image_ctx: ImageContext, image_tag_id: int):
         if image_ctx.project_id is None:
-            raise RuntimeError(f"Image upload needs a project ID!")
+            raise RuntimeError("Image upload needs a project ID!")
         
         if image_ctx.image is None:
-            raise RuntimeError(f"Image upload needs an image array!")
+            raise RuntimeError("Image upload needs an image array!")
         
         if image_ctx.image_name is None:
-            raise RuntimeError(f"Image upload needs an image name!")
+            raise RuntimeError("Image upload needs an image name!")
         
         if image_ctx.time_tag is None:
-            raise RuntimeError(f"Image upload needs a time tag!")
+            raise RuntimeError("Image upload needs a time tag!")
             
         if image_ctx.specimen_tag is None:
-            raise RuntimeError(f"Image upload needs a specimen tag!")
+            raise RuntimeError("Image upload needs a specimen tag!")
         
         dataset_name = image_ctx.specimen_tag
         if dataset_name is None:
@@ -83,25 +163,27 @@ class ProjectScanner:
         image_ctx.dataset_id = dataset_id
         image_ctx.dataset_name = dataset_name
 
-        # Post the image in the dataset
-        posted_image_id = self.omero_client.import_image_to_ds(
-            image_ctx.image,
-            image_ctx.project_id,
-            image_ctx.dataset_id,
-            image_ctx.image_name,
-        )
+        # Post the image in the dataset (unless the same scan is already there)
+        posted_image_id, imported = self.import_image(image_ctx)
         
         image_ctx.image_id = posted_image_id
 
-        # Tag the image appropriately
+        # Tag the image appropriately (an existing image may be missing some of the tags, e.g. if its upload was interrupted)
         scan_time_tag_id = self.omero_client.create_tag(image_ctx.project_id, image_ctx.time_tag)
         specimen_tag_id = self.omero_client.create_tag(image_ctx.project_id, image_ctx.specimen_tag)
         project_tag_id = self.omero_client.create_tag(image_ctx.project_id, self.name)
 
-        self.omero_client.tag_image_with_tag(posted_image_id, tag_id=image_tag_id)
-        self.omero_client.tag_image_with_tag(posted_image_id, tag_id=scan_time_tag_id)
-        self.omero_client.tag_image_with_tag(posted_image_id, tag_id=specimen_tag_id)
-        self.omero_client.tag_image_with_tag(posted_image_id, tag_id=project_tag_id)
+        posted_image_tag_ids = [] if imported else self.omero_client.get_image_tag_ids(posted_image_id)
+        missing_tag_ids = [
+            tag_id
+            for tag_id in [image_tag_id, scan_time_tag_id, specimen_tag_id, project_tag_id]
+            if tag_id not in posted_image_tag_ids
+        ]
+        if len(missing_tag_ids) == 0:
+            return
+
+        for tag_id in missing_tag_ids:
+            self.omero_client.tag_image_with_tag(posted_image_id, tag_id=tag_id)
 
         self.update()
 
@@ -109,53 +191,80 @@ class ProjectScanner:
         """Iterate over all datasets and images of an OMERO project, and yield an ImageContext."""
         omero_project = self.omero_client.get_project(self.id)
         for dataset in omero_project.listChildren():
-            dataset_id = dataset.getId()
-            dataset_name = dataset.getName()
-            for image in dataset.listChildren():
-                image_id = image.getId()
-                image_name = image.getName()
-                image_tags = self.omero_client.get_image_tags(image_id)
-
-                # Process specimen tags
-                specimen_tags = TagsProcessor.get_specimen_tags(image_tags)
-                if len(specimen_tags) == 0:
-                    specimen_tag = None
-                elif len(specimen_tags) >= 1:
-                    if len(specimen_tags) > 1:
-                        print(f"Multiple specimen name tags found: {specimen_tags} among {image_tags} ({image_id=}). Will use: {specimen_tags[0]}")
-                    specimen_tag = specimen_tags[0]
-
-                # Process time tags
-                time_tags = TagsProcessor.get_scan_time_tags(image_tags)
-                if len(time_tags) == 0:
-                    time_idx = None
-                    time_tag = None
-                elif len(time_tags) >= 1:
-                    if len(time_tags) > 1:
-                        print(f"Incoherent scan times: {time_tags} ({image_id=}). Will use: {time_tags[0]}.")
-                    time_tag = time_tags[0]
-                    time_idx = TagsProcessor.get_scan_time_idx(time_tag)
-
-                # Process image class
-                image_class = "other"
-                if len(TagsProcessor.get_image_tags(image_tags)) >= 1:
-                    image_class = "image"
-                elif "roi" in image_tags:
-                    image_class = "roi"
-                elif ("corrected" in image_tags) | ("corrected_pred" in image_tags):
-                    image_class = "corrected_pred"
-                elif len(TagsProcessor.get_raw_pred_tags(image_tags)) >= 1:
-                    image_class = "raw_pred"
-                elif "overview" in image_tags:
-                    image_class = "overview"
-
-                yield ImageContext(
-                    dataset_id=dataset_id,
-                    dataset_name=dataset_name,
-                    image_id=image_id,
-                    image_name=image_name,
-                    specimen_tag=specimen_tag,
-                    time_idx=time_idx,
-                    time_tag=time_tag,
-                    image_class=image_class,
-                )
+            yield from self._dataset_image_contexts(dataset, self.omero_client)
+
+    def _image_hashes(self) -> Dict[int, str]:
+        """Image ID => content hash of the images imported through `import_image`."""
+        with self._lock:
+            return {image_id: image_hash for (_, image_hash), image_id in self.content_hashes.items()}
+
+    def _dataset_image_contexts(self, dataset, omero_client: OmeroClient):
+        """Iterate over the images of an OMERO dataset, and yield an ImageContext."""
+        dataset_id = dataset.getId()
+        dataset_name = dataset.getName()
+        image_hashes = self._image_hashes()
+        for image in dataset.listChildren():
+            image_id = image.getId()
+            image_name = image.getName()
+            image_tags = omero_client.get_image_tags(image_id)
+
+            # Process specimen tags
+            specimen_tags = TagsProcessor.get_specimen_tags(image_tags)
+            if len(specimen_tags) == 0:
+                specimen_tag = None
+            elif len(specimen_tags) >= 1:
+                if len(specimen_tags) > 1:
+                    print(f"Multiple specimen name tags found: {specimen_tags} among {image_tags} ({image_id=}). Will use: {specimen_tags[0]}")
+                specimen_tag = specimen_tags[0]
+
+            # Process time tags
+            time_tags = TagsProcessor.get_scan_time_tags(image_tags)
+            if len(time_tags) == 0:
+                time_idx = None
+                time_tag = None
+            elif len(time_tags) >= 1:
+                if len(time_tags) > 1:
+                    print(f"Incoherent scan times: {time_tags} ({image_id=}). Will use: {time_tags[0]}.")
+                time_tag = time_tags[0]
+                time_idx = TagsProcessor.get_scan_time_idx(time_tag)
+
+            # Process image class
+            image_class = "other"
+            if len(TagsProcessor.get_image_tags(image_tags)) >= 1:
+                image_class = "image"
+            elif "roi" in image_tags:
+                image_class = "roi"
+            elif ("corrected" in image_tags) | ("corrected_pred" in image_tags):
+                image_class = "corrected_pred"
+            elif len(TagsProcessor.get_raw_pred_tags(image_tags)) >= 1:
+                image_class = "raw_pred"
+            elif "overview" in image_tags:
+                image_class = "overview"
+
+            # Content, source and model of the computed images, to find those that are outdated
+            image_hash = image_hashes.get(image_id)
+            source_id = None
+            source_hash = None
+            model = None
+            if image_class in ["roi", "raw_pred"]:
+                provenance = self.provenance.get(image_id)
+                if provenance is not None:
+                    source_id = int(provenance["source_id"])
+                    source_hash = provenance.get("source_hash") or None
+                    image_hash = provenance.get("checksum") or image_hash
+                    model = provenance.get("model") or None
+
+            yield ImageContext(
+                dataset_id=dataset_id,
+                dataset_name=dataset_name,
+                image_id=image_id,
+                image_name=image_name,
+                specimen_tag=specimen_tag,
+                time_idx=time_idx,
+                time_tag=time_tag,
+                image_class=image_class,
+                source_id=source_id,
+                model=model,
+                content_hash=image_hash,
+                source_hash=source_hash,
+            )
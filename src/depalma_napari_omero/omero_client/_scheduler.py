@@ -0,0 +1,170 @@
+import heapq
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+RESOURCES = ["io", "compute"]
+
+
+@dataclass
+class Task:
+    key: str
+    func: Callable
+    deps: List[str] = field(default_factory=list)
+    resource: str = "io"
+    depth: int = 0
+
+
+class DagScheduler:
+    """Runs tasks as soon as the tasks they depend on are done.
+
+    I/O and compute tasks run in separate thread pools, each with its own concurrency limit.
+    Each task is called with the results of its dependencies (in order). When a task fails,
+    the tasks that depend on it are skipped and the others go on.
+    """
+
+    def __init__(
+        self, n_io: int = 2, n_compute: int = 1, max_buffered: Optional[int] = None
+    ):
+        if n_io < 1 or n_compute < 1:
+            raise ValueError(f"The scheduler needs at least one thread per resource ({n_io=}, {n_compute=}).")
+
+        self.limits = {"io": n_io, "compute": n_compute}
+
+        # Limits the number of results held in memory (e.g. downloaded images waiting to be processed)
+        if max_buffered is None:
+            max_buffered = 2 * (n_io + n_compute)
+        self.max_buffered = max_buffered
+
+        self.tasks: Dict[str, Task] = {}
+
+    def __len__(self) -> int:
+        return len(self.tasks)
+
+    def add(
+        self,
+        key: str,
+        func: Callable,
+        deps: Optional[List[str]] = None,
+        resource: str = "io",
+    ) -> str:
+        """Adds a task. Its dependencies must have been added before."""
+        if key in self.tasks:
+            raise ValueError(f"Duplicate task: {key}.")
+
+        if resource not in RESOURCES:
+            raise ValueError(f"Unknown resource: {resource} (available: {RESOURCES}).")
+
+        deps = list(deps) if deps is not None else []
+        for dep in deps:
+            if dep not in self.tasks:
+                raise ValueError(f"Task {key} depends on an unknown task: {dep}.")
+
+        depth = 1 + max(self.tasks[dep].depth for dep in deps) if len(deps) else 0
+
+        self.tasks[key] = Task(key=key, func=func, deps=deps, resource=resource, depth=depth)
+
+        return key
+
+    def run(self) -> Iterator[Tuple[str, str]]:
+        """Runs the tasks and yields `(key, status)` as each of them is done, failed, or skipped."""
+        dependents: Dict[str, List[str]] = {key: [] for key in self.tasks}
+        for task in self.tasks.values():
+            for dep in task.deps:
+                dependents[dep].append(task.key)
+
+        n_missing = {key: len(task.deps) for key, task in self.tasks.items()}
+        n_consumers = {key: len(dependents[key]) for key in self.tasks}
+        results: Dict[str, Any] = {}
+        skipped: Set[str] = set()
+
+        # Deepest tasks first, so that results are consumed before new inputs are loaded
+        order = {key: k for k, key in enumerate(self.tasks)}
+        ready = [
+            (-task.depth, order[key], key)
+            for key, task in self.tasks.items()
+            if n_missing[key] == 0
+        ]
+        heapq.heapify(ready)
+
+        def _release(deps: List[str]):
+            for dep in deps:
+                n_consumers[dep] -= 1
+                if n_consumers[dep] == 0:
+                    results.pop(dep, None)
+
+        def _skip(key: str) -> List[str]:
+            newly_skipped = []
+            stack = list(dependents[key])
+            while stack:
+                dependent = stack.pop()
+                if dependent in skipped:
+                    continue
+                skipped.add(dependent)
+                newly_skipped.append(dependent)
+                _release(self.tasks[dependent].deps)
+                stack.extend(dependents[dependent])
+            return newly_skipped
+
+        running: Dict[Future, str] = {}
+        n_running = {resource: 0 for resource in RESOURCES}
+        executors = {
+            resource: ThreadPoolExecutor(max_workers=limit, thread_name_prefix=f"dag-{resource}")
+            for resource, limit in self.limits.items()
+        }
+
+        try:
+            while ready or running:
+                # Start the ready tasks within the concurrency limits
+                deferred = []
+                while ready:
+                    item = heapq.heappop(ready)
+                    task = self.tasks[item[2]]
+
+                    is_full = n_running[task.resource] >= self.limits[task.resource]
+                    is_buffer_full = (len(task.deps) == 0) and (len(results) >= self.max_buffered)
+                    if is_full or (is_buffer_full and len(running) > 0):
+                        deferred.append(item)
+                        continue
+
+                    args = [results[dep] for dep in task.deps]
+                    _release(task.deps)
+
+                    future = executors[task.resource].submit(task.func, *args)
+                    running[future] = task.key
+                    n_running[task.resource] += 1
+
+                for item in deferred:
+                    heapq.heappush(ready, item)
+
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = running.pop(future)
+                    n_running[self.tasks[key].resource] -= 1
+
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"⚠️ Task {key} failed: {e}")
+                        yield key, "failed"
+                        for skipped_key in _skip(key):
+                            yield skipped_key, "skipped"
+                        continue
+
+                    if n_consumers[key] > 0:
+                        results[key] = result
+
+                    yield key, "done"
+
+                    for dependent in dependents[key]:
+                        n_missing[dependent] -= 1
+                        if (n_missing[dependent] == 0) and (dependent not in skipped):
+                            heapq.heappush(
+                                ready,
+                                (-self.tasks[dependent].depth, order[dependent], dependent),
+                            )
+        finally:
+            for future in running:
+                future.cancel()
+            for executor in executors.values():
+                executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,51 @@
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List
+
+from depalma_napari_omero.omero_client._client import OmeroClient
+
+
+class SessionPool:
+    """OMERO sessions for worker threads, since a connection can't be shared between threads.
+
+    Sessions are opened with the credentials of `omero_client` when they are first needed, and reused.
+    """
+
+    def __init__(self, omero_client: OmeroClient):
+        self.omero_client = omero_client
+        self._idle: "queue.Queue[OmeroClient]" = queue.Queue()
+        self._sessions: List[OmeroClient] = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @contextmanager
+    def session(self) -> Iterator[OmeroClient]:
+        try:
+            client = self._idle.get_nowait()
+        except queue.Empty:
+            client = OmeroClient(
+                user=self.omero_client.user,
+                password=self.omero_client.password,
+                omero_cfg=self.omero_client.omero_cfg,
+            )
+            if not client.connect():
+                raise RuntimeError("Could not open a new OMERO session.")
+            with self._lock:
+                self._sessions.append(client)
+
+        try:
+            yield client
+        finally:
+            self._idle.put(client)
+
+    def close(self) -> None:
+        with self._lock:
+            for client in self._sessions:
+                client.quit()
+            self._sessions.clear()
@@ -0,0 +1,77 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from depalma_napari_omero.omero_client._client import OmeroClient
+
+# Title of the table of per-tumor statistics attached to the tumor masks
+TUMOR_STATS_TABLE_TITLE = "Tumor statistics"
+
+
+def label_statistics(labels: np.ndarray) -> pd.DataFrame:
+    """Volume (in voxels) and centroid (Z, Y, X) of each label of a (Z, Y, X) labels volume.
+
+    Computed in a single pass over the planes, with one `bincount` per plane and axis.
+    """
+    n_labels = int(labels.max()) + 1 if labels.size else 1
+    counts = np.zeros(n_labels, dtype=np.int64)
+    sums = np.zeros((3, n_labels), dtype=np.float64)
+
+    yy, xx = np.indices(labels.shape[1:], dtype=np.float64)
+    yy, xx = yy.ravel(), xx.ravel()
+    for z, plane in enumerate(labels):
+        plane = plane.ravel().astype(np.intp, copy=False)
+        plane_counts = np.bincount(plane, minlength=n_labels)
+        counts += plane_counts
+        sums[0] += z * plane_counts
+        sums[1] += np.bincount(plane, weights=yy, minlength=n_labels)
+        sums[2] += np.bincount(plane, weights=xx, minlength=n_labels)
+
+    # Ignore the background and the labels that aren't in the volume
+    label_ids = np.flatnonzero(counts)
+    label_ids = label_ids[label_ids != 0]
+    centroids = sums[:, label_ids] / counts[label_ids]
+
+    return pd.DataFrame(
+        {
+            "label": label_ids,
+            "volume": counts[label_ids],
+            "centroid_z": centroids[0],
+            "centroid_y": centroids[1],
+            "centroid_x": centroids[2],
+        }
+    )
+
+
+def attach_tumor_statistics(
+    omero_client: OmeroClient, image_id: int, labels: np.ndarray
+) -> Optional[int]:
+    """Computes the statistics of a tumor mask and attaches them to its image, replacing a previous table.
+
+    Nothing is attached if there are no tumors.
+    """
+    old_table_ids = [
+        table_id
+        for table_id, title in omero_client.get_image_tables(image_id).items()
+        if title == TUMOR_STATS_TABLE_TITLE
+    ]
+
+    df = label_statistics(labels)
+    table_id = None
+    if len(df) > 0:
+        table_id = omero_client.attach_table_to_image(
+            table=df, image_id=image_id, table_title=TUMOR_STATS_TABLE_TITLE
+        )
+
+    for old_table_id in old_table_ids:
+        omero_client.delete_table(old_table_id)
+
+    return table_id
+
+
+def read_tumor_statistics(omero_client: OmeroClient, image_id: int) -> Optional[pd.DataFrame]:
+    """Reads the per-tumor statistics attached to a tumor mask (`None` if there are none)."""
+    for table_id, title in omero_client.get_image_tables(image_id).items():
+        if title == TUMOR_STATS_TABLE_TITLE:
+            return omero_client.get_table(table_id)
@@ -0,0 +1,147 @@
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import tifffile
+
+from depalma_napari_omero.omero_client._client import OmeroClient
+
+
+def padded_shape(shapes: Sequence[Tuple[int, ...]]) -> Tuple[int, ...]:
+    """TZYX shape of a timeseries of (Z, Y, X) volumes, padded to the largest size in each dimension."""
+    return (len(shapes),) + tuple(int(s) for s in np.max(np.asarray(shapes), axis=0))
+
+
+def centered_slices(shape: Tuple[int, ...], full_shape: Tuple[int, ...]) -> Tuple[slice, ...]:
+    """Slices of a volume of `shape` centered in a volume of `full_shape` (same as `combine_images`)."""
+    if any(s > f for s, f in zip(shape, full_shape)):
+        raise ValueError(f"A volume of shape {shape} does not fit in the timeseries (shape: {full_shape}).")
+    deltas = [(f - s) // 2 for s, f in zip(shape, full_shape)]
+    return tuple(slice(d, d + s) for d, s in zip(deltas, shape))
+
+
+class TimeseriesStacker:
+    """Stacks (Z, Y, X) volumes into a TZYX timeseries allocated once, replacing a list of volumes + `combine_images`.
+
+    The shapes of the volumes must be known up front (e.g. from the OMERO metadata). Each volume is
+    centered in its time slot and the padding is zero. Without `dtype`, the buffer is allocated with
+    the dtype of the first volume written.
+    """
+
+    def __init__(
+        self, shapes: Sequence[Tuple[int, int, int]], dtype: Optional[np.dtype] = None
+    ):
+        self.shape = padded_shape(shapes)
+        self.data: Optional[np.ndarray] = None
+        if dtype is not None:
+            self.data = self._allocate(dtype)
+
+    @classmethod
+    def from_omero(
+        cls,
+        omero_client: OmeroClient,
+        image_ids: List[int],
+        dtype: Optional[np.dtype] = None,
+    ) -> "TimeseriesStacker":
+        """Stacker for the images of `image_ids`, with their shapes read from the OMERO metadata."""
+        return cls([omero_client.get_image_shape(image_id) for image_id in image_ids], dtype)
+
+    def _allocate(self, dtype: np.dtype) -> np.ndarray:
+        return np.zeros(self.shape, dtype=dtype)
+
+    def write(self, t: int, image: np.ndarray) -> None:
+        if self.data is None:
+            self.data = self._allocate(image.dtype)
+        self.data[t][centered_slices(image.shape, self.shape[1:])] = image
+
+
+class TimeseriesWriter(TimeseriesStacker):
+    """Writes a TZYX timeseries to a TIFF file one volume at a time, through a memory map.
+
+    The file is created once with its final (padded) shape; only one volume at a time needs to be in memory.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        shapes: Sequence[Tuple[int, int, int]],
+        dtype: Optional[np.dtype] = None,
+    ):
+        self.path = Path(path)
+        super().__init__(shapes, dtype)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _allocate(self, dtype: np.dtype) -> np.ndarray:
+        return tifffile.memmap(
+            str(self.path), shape=self.shape, dtype=dtype, metadata={"axes": "TZYX"}
+        )
+
+    def close(self) -> None:
+        if self.data is not None:
+            self.data.flush()  # type: ignore
+            self.data = None
+
+
+def stack_timeseries(
+    shapes: Sequence[Tuple[int, int, int]], images: Iterable[np.ndarray]
+) -> np.ndarray:
+    """Stacks the volumes yielded by `images` (in time order) into a preallocated timeseries."""
+    stacker = TimeseriesStacker(shapes)
+    for t, image in enumerate(images):
+        stacker.write(t, image)
+    if stacker.data is None:
+        raise ValueError("No volumes to stack.")
+    return stacker.data
+
+
+def read_timeseries(path: Union[str, Path]) -> np.ndarray:
+    """Reads a timeseries TIFF, memory-mapped when the file layout allows it."""
+    try:
+        return tifffile.memmap(str(path), mode="r")
+    except ValueError:
+        return tifffile.imread(str(path))
+
+
+def write_timeseries(
+    path: Union[str, Path],
+    shapes: Sequence[Tuple[int, int, int]],
+    images: Iterable[np.ndarray],
+) -> None:
+    """Streams the volumes yielded by `images` (in time order) into a TIFF file."""
+    with TimeseriesWriter(path, shapes) as writer:
+        for t, image in enumerate(images):
+            writer.write(t, image)
+
+
+def write_compressed_timeseries(
+    path: Union[str, Path],
+    shapes: Sequence[Tuple[int, int, int]],
+    images: Iterable[np.ndarray],
+    dtype: np.dtype = np.uint16,
+) -> None:
+    """Streams the volumes yielded by `images` (in time order) into a zlib-compressed TIFF file, e.g. for masks.
+
+    Unlike `write_timeseries`, the file can't be memory-mapped, but masks take a fraction of the space.
+    """
+    full_shape = padded_shape(shapes)
+
+    def planes():
+        for image in images:
+            volume = np.zeros(full_shape[1:], dtype=dtype)
+            volume[centered_slices(image.shape, full_shape[1:])] = image
+            yield from volume
+
+    tifffile.imwrite(
+        str(path),
+        planes(),
+        shape=full_shape,
+        dtype=dtype,
+        photometric="minisblack",
+        compression="zlib",
+        metadata={"axes": "TZYX"},
+    )
@@ -1,36 +1,91 @@
+import importlib.util
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Union
+from typing import Dict, List, Optional, Tuple, Union
 import numpy as np
 import pandas as pd
-import skimage.io
+import tifffile
 from depalma_napari_omero.omero_client._context import ImageContext
 from depalma_napari_omero.omero_client._tags_processor import TagsProcessor
 
 
-def save_merged_csv(out_dir: Path, out_csv_path: Path) -> None:
+def merge_results(results: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """Merges the tracking results of several cases (by specimen name) into one table with a `Mouse_ID` column."""
     all_dfs = []
-    for csv_file in list(out_dir.rglob("*.csv")):
-        specimen = csv_file.stem.split("_")[0]
-
+    for specimen, df_specimen in results.items():
         if TagsProcessor.get_specimen_tags([specimen]) is None:
             raise ValueError(f"Specimen name {specimen} does not comply with naming convention (C*****).")
 
-        df_specimen = pd.read_csv(csv_file, index_col=0)
+        df_specimen = df_specimen.copy()
         df_specimen["Mouse_ID"] = specimen
         all_dfs.append(df_specimen)
 
     if len(all_dfs) == 0:
-        return
-    
+        return pd.DataFrame(columns=["Mouse_ID"])
+
     merged_df = pd.concat(all_dfs, ignore_index=True)
 
     columns = ["Mouse_ID"] + [col for col in merged_df.columns if col != "Mouse_ID"]
-    merged_df = merged_df[columns]
-    merged_df.to_csv(out_csv_path)
+    return merged_df[columns]
+
+
+def save_results(df: pd.DataFrame, out_path: Path) -> None:
+    """Saves a results table as CSV, or as Parquet if `out_path` ends with `.parquet` (requires `pyarrow`)."""
+    if Path(out_path).suffix == ".parquet":
+        if importlib.util.find_spec("pyarrow") is None:
+            raise RuntimeError("Saving to Parquet requires pyarrow: pip install depalma-napari-omero[parquet]")
+        df.to_parquet(out_path)
+    else:
+        df.to_csv(out_path)
+
+
+def save_merged_csv(out_dir: Path, out_csv_path: Path) -> None:
+    results = {}
+    # Only the results of each case (not the merged CSV of a previous export)
+    for csv_file in list(out_dir.glob("*/*_results.csv")):
+        specimen = csv_file.stem.split("_")[0]
+        results[specimen] = pd.read_csv(csv_file, index_col=0)
+
+    if len(results) == 0:
+        return
+
+    save_results(merge_results(results), out_csv_path)
+
 
+def read_tiff_stack(
+    files: List[Path],
+    memmap_path: Optional[Union[str, Path]] = None,
+    n_threads: Optional[int] = None,
+) -> np.ndarray:
+    """Reads 2D TIFF files into a ZYX volume, allocated once (in a memory-mapped `.npy` file, with `memmap_path`).
 
-def load_ct_from_folder(image_dir: Union[str, Path]) -> ImageContext:
-    """Creates a 3D TIFF from a series of 2D tiffs in a folder, according to lab conventions."""
+    The slices are decoded by a pool of threads, directly into the volume.
+    """
+    with tifffile.TiffFile(files[0]) as tif:
+        slice_shape, dtype = tif.pages[0].shape, tif.pages[0].dtype
+
+    shape = (len(files),) + tuple(slice_shape)
+    if memmap_path is not None:
+        volume = np.lib.format.open_memmap(str(memmap_path), mode="w+", dtype=dtype, shape=shape)
+    else:
+        volume = np.empty(shape, dtype=dtype)
+
+    def _read(z: int) -> None:
+        tifffile.imread(files[z], out=volume[z], maxworkers=1)
+
+    n_threads = n_threads if n_threads is not None else min(8, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        list(executor.map(_read, range(len(files))))
+
+    return volume
+
+
+def scan_ct_folder(image_dir: Union[str, Path]) -> Tuple[List[Path], ImageContext]:
+    """Finds the 2D tiffs of a scan folder and reads the specimen and scan time from their names, according to lab conventions.
+
+    Returns the files (in Z order) and an image context without the image.
+    """
     tiff_files = Path(image_dir).glob("*.tif")
     # Remove the file with "rec_spr" in the name which is an overview of the mouse
     tiff_image_files = sorted(
@@ -40,6 +95,8 @@ def load_ct_from_folder(image_dir: Union[str, Path]) -> ImageContext:
             if "rec_spr" not in Path(file).stem.split("~")[-1]
         ]
     )
+    if len(tiff_image_files) == 0:
+        raise ValueError(f"No TIFF files found in {image_dir}.")
 
     # Assuming that all files follow the naming convention, simply check the pattern in the first file
     exp_name, scan_time, specimen = (
@@ -59,15 +116,26 @@ def load_ct_from_folder(image_dir: Union[str, Path]) -> ImageContext:
         
     time_idx = TagsProcessor.get_scan_time_idx(scan_time)
 
-    # Read files into a 3D tiff
-    image = np.array([skimage.io.imread(file) for file in tiff_image_files])
-    
     image_ctx = ImageContext(
         image_class="image",
-        image=image,
         time_tag=scan_time,
         time_idx=time_idx,
         specimen_tag=specimen,
     )
+
+    return tiff_image_files, image_ctx
+
+
+def load_ct_from_folder(
+    image_dir: Union[str, Path], memmap_path: Optional[Union[str, Path]] = None
+) -> ImageContext:
+    """Creates a 3D TIFF from a series of 2D tiffs in a folder, according to lab conventions.
+
+    With `memmap_path`, the volume is kept in a memory-mapped file instead of in memory.
+    """
+    tiff_image_files, image_ctx = scan_ct_folder(image_dir)
+
+    # Read files into a 3D tiff
+    image_ctx.image = read_tiff_stack(tiff_image_files, memmap_path=memmap_path)
     
-    return image_ctx
\ No newline at end of file
+    return image_ctx
@@ -1,4 +1,4 @@
-from typing import Any, List, Tuple
+from typing import Any, List, Optional, Tuple
 from dataclasses import dataclass
 
 import numpy as np
@@ -101,6 +101,64 @@ def _find_corr_missing(df: pd.DataFrame, df_summary: pd.DataFrame):
     return corr_ctx
 
 
+def _find_outdated(
+    df: pd.DataFrame,
+    image_class: str,
+    source_class: str,
+    outdated_source_ids: List[int],
+    model: Optional[str] = None,
+) -> List[ImageContext]:
+    """Finds the images whose (specimen, time) has none of its source images that is up to date and matches
+    their recorded source, by image ID or by content hash (e.g. the same scan uploaded again).
+
+    Images whose (specimen, time) has no source image at all are left out (see `_find_source_missing`).
+    With `model`, images recorded as computed with another model are outdated too.
+    """
+    derived = df[(df["class"] == image_class) & df["source_id"].notna()]
+    sources = {
+        key: group for key, group in df[df["class"] == source_class].groupby(["specimen", "time"])
+    }
+
+    outdated_ctx = []
+    for _, row in derived.sort_values(["specimen", "time"]).iterrows():
+        candidates = sources.get((row["specimen"], row["time"]))
+        if candidates is None:
+            continue
+
+        candidates = candidates[~candidates["image_id"].isin(outdated_source_ids)]
+        matches = candidates["image_id"] == row["source_id"]
+        if pd.notna(row["source_hash"]):
+            matches |= candidates["content_hash"] == row["source_hash"]
+
+        is_outdated = not matches.any()
+        if (model is not None) and pd.notna(row["model"]) and (row["model"] != model):
+            is_outdated = True
+
+        if is_outdated:
+            outdated_ctx.append(
+                ImageContext(
+                    image_class=image_class,
+                    dataset_id=row["dataset_id"],
+                    image_id=row["image_id"],
+                    image_name=row["image_name"],
+                    specimen_tag=row["specimen"],
+                    time_tag=row["time"],
+                    source_id=int(row["source_id"]),
+                    model=row["model"] if pd.notna(row["model"]) else None,
+                )
+            )
+
+    return outdated_ctx
+
+
+def _find_source_missing(df: pd.DataFrame, image_class: str, source_class: str) -> List[int]:
+    """IDs of the computed images whose (specimen, time) has no source image anymore; they are reported, not deleted."""
+    derived = df[(df["class"] == image_class) & df["source_id"].notna()]
+    sources = df[df["class"] == source_class][["specimen", "time"]].drop_duplicates()
+    df_merged = pd.merge(derived, sources, on=["specimen", "time"], how="left", indicator=True)
+    return df_merged[df_merged["_merge"] == "left_only"]["image_id"].tolist()
+
+
 class ProjectDataView:
     def __init__(self, image_contexts: List[ImageContext]):
         self.all_categories = ["image", "roi", "raw_pred", "corrected_pred", "overview"]
@@ -114,6 +172,10 @@ class ProjectDataView:
             "time",
             "time_tag",
             "class",
+            "source_id",
+            "model",
+            "content_hash",
+            "source_hash",
         ]
 
         self.df_all = pd.DataFrame(
@@ -127,6 +189,10 @@ class ProjectDataView:
                     "time": ctx.time_idx,
                     "time_tag": ctx.time_tag,
                     "class": ctx.image_class,
+                    "source_id": ctx.source_id,
+                    "model": ctx.model,
+                    "content_hash": ctx.content_hash,
+                    "source_hash": ctx.source_hash,
                 }
                 for ctx in image_contexts
             ],
@@ -167,6 +233,16 @@ class ProjectDataView:
         # Preds but no corrections
         self.corr_missing: List[ImageContext] = _find_corr_missing(df, df_summary)
 
+        # Rois computed from a scan that was replaced, and preds computed from a roi that was replaced (or is outdated)
+        self.roi_outdated: List[ImageContext]
+        self.pred_outdated: List[ImageContext]
+        self.roi_outdated, self.pred_outdated = self.outdated()
+
+        # Rois and preds whose source image was removed
+        self.source_missing: List[int] = _find_source_missing(
+            df, "roi", "image"
+        ) + _find_source_missing(df, "raw_pred", "roi")
+
         self.report_data = ReportData(
             n_specimens=self.df["specimen"].nunique(),
             n_times=self.df["time"].nunique(),
@@ -186,6 +262,16 @@ class ProjectDataView:
         else:
             return []
 
+    def outdated(
+        self, lungs_model: Optional[str] = None, tumor_model: Optional[str] = None
+    ) -> Tuple[List[ImageContext], List[ImageContext]]:
+        """Outdated ROIs and tumor masks; with models, also those computed with other models (and the tumor masks of those ROIs)."""
+        roi_outdated = _find_outdated(self.df, "roi", "image", [], lungs_model)
+        pred_outdated = _find_outdated(
+            self.df, "raw_pred", "roi", [ctx.image_id for ctx in roi_outdated], tumor_model
+        )
+        return roi_outdated, pred_outdated
+
     def _construct_df_summary(self, df: pd.DataFrame) -> pd.DataFrame:
         df_summary = df.pivot_table(
             index=["specimen", "time"],
@@ -254,6 +340,17 @@ class ProjectDataView:
                 f"  - {len(self.report_data.corr_missing_ids)} corrected masks are missing for these image IDs: {msg}"
             )
 
+        n_outdated = len(self.roi_outdated) + len(self.pred_outdated)
+        if n_outdated > 0:
+            print(
+                f"  - {len(self.roi_outdated)} ROIs and {len(self.pred_outdated)} tumor masks are outdated (their source image was replaced) and can be recomputed."
+            )
+
+        if len(self.source_missing) > 0:
+            print(
+                f"  - {len(self.source_missing)} ROIs or tumor masks have no source image anymore and were left as they are: {self.source_missing}"
+            )
+
         if len(self.report_data.anomalous_multi_image) > 0:
             print(
                 f"  - {len(self.report_data.anomalous_multi_image)} specimen-time combinations have multiple matching `image` files and will be ignored."
@@ -272,6 +369,8 @@ class ProjectDataView:
                 n_images_other == 0,
                 len(self.report_data.anomalous_image_missing) == 0,
                 len(self.report_data.anomalous_multi_image) == 0,
+                n_outdated == 0,
+                len(self.source_missing) == 0,
             ]
         ):
             print("  - No issues found 🎉")
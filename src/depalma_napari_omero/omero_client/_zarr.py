@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Iterable, Sequence, Tuple, Union
+
+import numpy as np
+
+from depalma_napari_omero.omero_client._timeseries import centered_slices, padded_shape
+
+try:
+    import zarr
+    from numcodecs import Blosc
+except ImportError:
+    zarr = None
+
+# Each chunk holds part of a single timepoint, so that one timepoint can be read without the others
+_CHUNKS_ZYX = (32, 256, 256)
+
+
+def _require_zarr() -> None:
+    if zarr is None:
+        raise RuntimeError("The OME-Zarr export requires zarr: pip install depalma-napari-omero[zarr]")
+
+
+def _create_image(path: Union[str, Path], shape: Tuple[int, ...], dtype: np.dtype):
+    """Creates an OME-Zarr (NGFF 0.4) image with a single TZYX resolution level, and returns its array."""
+    root = zarr.open_group(str(path), mode="w")
+    root.attrs["multiscales"] = [
+        {
+            "version": "0.4",
+            "axes": [
+                {"name": "t", "type": "time"},
+                {"name": "z", "type": "space"},
+                {"name": "y", "type": "space"},
+                {"name": "x", "type": "space"},
+            ],
+            "datasets": [
+                {
+                    "path": "0",
+                    "coordinateTransformations": [{"type": "scale", "scale": [1.0, 1.0, 1.0, 1.0]}],
+                }
+            ],
+        }
+    ]
+    return root.create_dataset(
+        "0",
+        shape=shape,
+        chunks=(1,) + tuple(min(c, s) for c, s in zip(_CHUNKS_ZYX, shape[1:])),
+        dtype=dtype,
+        compressor=Blosc(cname="zstd", clevel=5, shuffle=Blosc.SHUFFLE),
+        dimension_separator="/",
+        fill_value=0,
+    )
+
+
+def write_ome_zarr_timeseries(
+    path: Union[str, Path],
+    shapes: Sequence[Tuple[int, int, int]],
+    images: Iterable[np.ndarray],
+    n_threads: int = 4,
+) -> None:
+    """Streams the volumes yielded by `images` (in time order) into an OME-Zarr image, compressed with Blosc/Zstd.
+
+    The chunks of a volume are compressed and written by `n_threads` threads, while the next volume is downloaded.
+    """
+    _require_zarr()
+
+    full_shape = padded_shape(shapes)
+    array = None
+    pending = []
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        for t, image in enumerate(images):
+            if array is None:
+                array = _create_image(path, full_shape, image.dtype)
+
+            volume = np.zeros(full_shape[1:], dtype=array.dtype)
+            volume[centered_slices(image.shape, full_shape[1:])] = image
+
+            # Threads write whole chunks (slabs of planes), so they never write to the same chunk
+            for future in wait(pending).done:
+                future.result()
+            step = array.chunks[1]
+            pending = [
+                executor.submit(array.__setitem__, (t, slice(z, z + step)), volume[z : z + step])
+                for z in range(0, full_shape[1], step)
+            ]
+
+        for future in wait(pending).done:
+            future.result()
+
+
+def read_ome_zarr_timeseries(path: Union[str, Path]):
+    """Opens the TZYX array of an OME-Zarr image (read lazily, e.g. `array[t]` only reads timepoint `t`)."""
+    _require_zarr()
+    return zarr.open_group(str(path), mode="r")["0"]
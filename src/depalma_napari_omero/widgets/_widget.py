@@ -6,8 +6,6 @@ import pandas as pd
 from mousetumorpy import (
     NNUNET_MODELS,
     YOLO_MODELS,
-    combine_images,
-    generate_tracked_tumors,
     to_linkage_df,
 )
 import napari
@@ -17,6 +15,7 @@ from napari.utils.notifications import show_info, show_warning
 from napari_toolkit.containers.collapsible_groupbox import QCollapsibleGroupBox
 from PyQt5.QtCore import Qt
 from qtpy.QtWidgets import (
+    QCheckBox,
     QComboBox,
     QFileDialog,
     QGridLayout,
@@ -37,6 +36,8 @@ from depalma_napari_omero.omero_client._project import (
 from depalma_napari_omero.omero_client.omero_config import OmeroConfig
 from depalma_napari_omero.widgets._worker import WorkerManager
 from depalma_napari_omero.omero_client._scanner import ProjectScanner
+from depalma_napari_omero.omero_client._relabel import relabel_timepoint, tracking_luts
+from depalma_napari_omero.omero_client._timeseries import TimeseriesStacker
 from depalma_napari_omero.omero_client._view import ProjectDataView
 import depalma_napari_omero.omero_client._utils as utils
 
@@ -137,20 +138,37 @@ class OMEROWidget(QWidget):
         experiment_layout.addWidget(QLabel("Tumor model", self), 2, 0)
         experiment_layout.addWidget(self.cb_tumor_models, 2, 1, 1, 2)
 
+        # Fused ROI + tumor pass
+        self.cb_fused = QCheckBox("Compute ROIs and tumors in a single pass", self)
+        experiment_layout.addWidget(self.cb_fused, 3, 0, 1, 3)
+
+        # Incremental tracking
+        self.cb_incremental = QCheckBox("Update tracking tables with new scans", self)
+        experiment_layout.addWidget(self.cb_incremental, 4, 0, 1, 3)
+
+        # Per-image and per-case scheduling
+        self.cb_dag = QCheckBox("Start each step as soon as its inputs are ready", self)
+        experiment_layout.addWidget(self.cb_dag, 5, 0, 1, 3)
+
         # Run workflows
         self.btn_run_workflows = QPushButton("🔁 Run all workflows", self)
         self.btn_run_workflows.clicked.connect(self._run_all_workflows) # type: ignore
-        experiment_layout.addWidget(self.btn_run_workflows, 3, 0, 1, 3)
+        experiment_layout.addWidget(self.btn_run_workflows, 6, 0, 1, 3)
 
         # Upload new scans
         self.btn_upload_scans = QPushButton("⬆️ Upload new scans", self)
         self.btn_upload_scans.clicked.connect(self._upload_new_scans) # type: ignore
-        experiment_layout.addWidget(self.btn_upload_scans, 4, 0, 1, 3)
+        experiment_layout.addWidget(self.btn_upload_scans, 7, 0, 1, 3)
 
         # Download experiment
         self.btn_download_experiments = QPushButton("⬇️ Download project", self)
         self.btn_download_experiments.clicked.connect(self._download_experiment) # type: ignore
-        experiment_layout.addWidget(self.btn_download_experiments, 5, 0, 1, 3)
+        experiment_layout.addWidget(self.btn_download_experiments, 8, 0, 1, 3)
+
+        # Download tracking results only
+        self.btn_download_results = QPushButton("📊 Download tracking results", self)
+        self.btn_download_results.clicked.connect(self._download_results) # type: ignore
+        experiment_layout.addWidget(self.btn_download_results, 9, 0, 1, 3)
 
         # Scan data group
         scan_data_group = QCollapsibleGroupBox("Scan data")  # type: ignore
@@ -524,16 +542,12 @@ class OMEROWidget(QWidget):
         if image_ctx.image_name is None:
             raise RuntimeError("Context needs an image name.")
 
-        posted_image_id = self.project.client.import_image_to_ds(
-            image_ctx.image,
-            image_ctx.project_id,
-            image_ctx.dataset_id,
-            image_ctx.image_name,
-        )
+        # Resolves to the existing image if the same content was already uploaded to the dataset
+        posted_image_id, imported = self.scanner.import_image(image_ctx)
 
         image_ctx.image_id = posted_image_id
 
-        return image_ctx
+        return image_ctx, imported
 
     def _upload_corrections(self, *args, **kwargs):
         """Handles uploading images to the OMERO server."""
@@ -585,9 +599,14 @@ class OMEROWidget(QWidget):
         worker.returned.connect(self._upload_correction_returned)
         self.worker_manager.add_active(worker)
 
-    def _upload_correction_returned(self, image_ctx: ImageContext):
+    def _upload_correction_returned(self, payload: Tuple[ImageContext, bool]):
         if self.project is None:
             return
+
+        image_ctx, imported = payload
+        if not imported:
+            self._upload_worker_returned(payload)
+            return
         
         if image_ctx.image_id is None:
             raise RuntimeError("Uploaded corrected image has no ID.")
@@ -595,14 +614,19 @@ class OMEROWidget(QWidget):
         if image_ctx.original_image_id is None:
             raise RuntimeError("Context needs an original image ID.")
 
-        self.project.handle_corrected_roi_uploaded(image_ctx.image_id, image_ctx.original_image_id)
+        self.project.handle_corrected_roi_uploaded(
+            image_ctx.image_id, image_ctx.original_image_id, image_ctx.image
+        )
         
-        self._upload_worker_returned(image_ctx)
-        show_info(f"Uploaded image {image_ctx.image_id}.")
+        self._upload_worker_returned(payload)
 
-    def _upload_worker_returned(self, image_ctx: ImageContext):
+    def _upload_worker_returned(self, payload: Tuple[ImageContext, bool]):
+        image_ctx, imported = payload
         self._reset_ui_and_update_project()
-        show_info(f"Uploaded image {image_ctx.image_id}.")
+        if imported:
+            show_info(f"Uploaded image {image_ctx.image_id}.")
+        else:
+            show_info(f"Same content as image {image_ctx.image_id}; nothing was uploaded.")
 
     def _generic_upload(self, *args, **kwargs):
         if self.project is None:
@@ -653,39 +677,83 @@ class OMEROWidget(QWidget):
 
         lungs_model = self.cb_lungs_models.currentData()
         tumor_model = self.cb_tumor_models.currentData()
+        fused = self.cb_fused.isChecked()
+        incremental = self.cb_incremental.isChecked()
+
+        if self.cb_dag.isChecked():
+            worker = self._workflow_dag_worker(lungs_model, tumor_model, incremental) # type: ignore
+            worker.returned.connect(self._reset_ui_and_update_project)
+            self.worker_manager.add_active(worker, max_iter=1)  # The number of tasks is yielded by the worker
+            return
 
-        worker = self._workflow_worker(lungs_model, roi_missing_ctx, tumor_model) # type: ignore
+        worker = self._workflow_worker(lungs_model, roi_missing_ctx, tumor_model, fused, incremental) # type: ignore
 
         worker.returned.connect(self._reset_ui_and_update_project)
 
         self.worker_manager.add_active(worker)
 
+    @thread_worker
+    def _workflow_dag_worker(
+        self,
+        lungs_model: Optional[str],
+        tumor_model: Optional[str],
+        incremental: bool = False,
+    ):
+        if self.project is None:
+            return
+
+        if lungs_model is None:
+            raise RuntimeError("Lungs model seletion required.")
+        if tumor_model is None:
+            raise RuntimeError("Tumor model selection required.")
+
+        for step in self.project._run_batch_workflow(
+            lungs_model, tumor_model, incremental=incremental
+        ):
+            yield step
+
     @thread_worker
     def _workflow_worker(
         self,
         lungs_model: Optional[str],
         roi_missing_ctx: List[ImageContext],
         tumor_model: Optional[str],
+        fused: bool = False,
+        incremental: bool = False,
     ):
         if self.project is None:
             return
-        
-        if len(roi_missing_ctx) > 0:
-            if lungs_model is None:
-                raise RuntimeError("Lungs model seletion required.")
-            for _ in self.project._run_batch_roi(lungs_model, roi_missing_ctx):
-                continue
 
-        pred_missing_ctx: List[ImageContext] = self.view.pred_missing
+        if fused:
+            pred_missing_ctx: List[ImageContext] = self.view.pred_missing
+            if len(roi_missing_ctx) + len(pred_missing_ctx) > 0:
+                if lungs_model is None:
+                    raise RuntimeError("Lungs model seletion required.")
+                if tumor_model is None:
+                    raise RuntimeError("Tumor model selection required.")
+                for _ in self.project._run_batch_fused(
+                    lungs_model, tumor_model, roi_missing_ctx, pred_missing_ctx
+                ):
+                    continue
+        else:
+            if len(roi_missing_ctx) > 0:
+                if lungs_model is None:
+                    raise RuntimeError("Lungs model seletion required.")
+                for _ in self.project._run_batch_roi(lungs_model, roi_missing_ctx):
+                    continue
 
-        if len(pred_missing_ctx) > 0:
-            if tumor_model is None:
-                raise RuntimeError("Tumor model selection required.")
-            for _ in self.project._run_batch_nnunet(tumor_model, pred_missing_ctx):
-                continue
+            pred_missing_ctx: List[ImageContext] = self.view.pred_missing
+
+            if len(pred_missing_ctx) > 0:
+                if tumor_model is None:
+                    raise RuntimeError("Tumor model selection required.")
+                for _ in self.project._run_batch_nnunet(tumor_model, pred_missing_ctx):
+                    continue
 
         if len(self.view.cases) > 0:
-            for _ in self.project._run_batch_tracking(self.view.cases):
+            for _ in self.project._run_batch_tracking(
+                self.view.cases, incremental=incremental
+            ):
                 continue
 
     def _reset_ui_and_update_project(self, *args, **kwargs):
@@ -724,28 +792,28 @@ class OMEROWidget(QWidget):
         if self.project is None:
             return
         
-        images = []
+        stacker = TimeseriesStacker.from_omero(self.project.client, to_download_ids)
         for k, img_id in enumerate(to_download_ids):
             print(f"Downloading image ID = {img_id}")
-            images.append(self.project.client.download_image(img_id))
+            stacker.write(k, self.project.client.download_image(img_id))
             yield k + 1
 
-        return (combine_images(images), specimen)
+        return (stacker.data, specimen)
 
     @thread_worker
     def _download_ts_lungs_worker(self, to_download_ids: List[int], specimen: str):
         if self.project is None:
             return
         
-        images = []
+        stacker = TimeseriesStacker.from_omero(self.project.client, to_download_ids)
         for k, img_id in enumerate(to_download_ids):
             print(f"Downloading ROI from image ID = {img_id}")
-            images.append(
-                self.project.client.download_binary_mask_from_image_rois(img_id)
+            stacker.write(
+                k, self.project.client.download_binary_mask_from_image_rois(img_id)
             )
             yield k + 1
 
-        return (combine_images(images), specimen)
+        return (stacker.data, specimen)
 
     @thread_worker
     def _download_tracked_tumors_worker(
@@ -754,21 +822,21 @@ class OMEROWidget(QWidget):
         if self.project is None:
             return
         
-        tumor_timeseries = []
-        for k, img_id in enumerate(to_download_ids):
-            print(f"Downloading image ID = {img_id}")
-            tumor_timeseries.append(self.project.client.download_image(img_id))
-            yield k + 1
-
-        tumor_timeseries = combine_images(tumor_timeseries)
-
         # Move this outside of the thread?
         formatted_df = self.project.client.get_table(table_id)
-        linkage_df = to_linkage_df(formatted_df)
+        luts = tracking_luts(to_linkage_df(formatted_df), np.uint16)
 
-        tracked_tumors = generate_tracked_tumors(tumor_timeseries, linkage_df)
+        # Each scan is relabeled in place as soon as it is downloaded
+        stacker = TimeseriesStacker.from_omero(
+            self.project.client, to_download_ids, np.uint16
+        )
+        for k, img_id in enumerate(to_download_ids):
+            print(f"Downloading image ID = {img_id}")
+            stacker.write(k, self.project.client.download_image(img_id))
+            relabel_timepoint(stacker.data[k], luts, k, out=stacker.data[k])
+            yield k + 1
 
-        return tracked_tumors, specimen
+        return stacker.data, specimen
     
     def _download_ts_rois(self, *args, **kwargs):
         if self.project is None:
@@ -836,7 +904,7 @@ class OMEROWidget(QWidget):
 
     def _download_untracked_tumors_returned(self, payload: Tuple[np.ndarray, str]):
         data, specimen = payload
-        self.viewer.add_labels(data.astype(np.uint16), name=f"{specimen}_tumors")
+        self.viewer.add_labels(data.astype(np.uint16, copy=False), name=f"{specimen}_tumors")
 
     def _download_tracked_tumors(self, *args, **kwargs):
         if self.project is None:
@@ -862,7 +930,7 @@ class OMEROWidget(QWidget):
 
     def _download_tracked_tumors_returned(self, payload: Tuple[np.ndarray, str]):
         data, specimen = payload
-        self.viewer.add_labels(data.astype(np.uint16), name=f"{specimen}_tracked_tumors")
+        self.viewer.add_labels(data, name=f"{specimen}_tracked_tumors")
 
     @thread_worker
     def _upload_new_scans_worker(self, parent_dir: Union[Path, str]):
@@ -909,3 +977,25 @@ class OMEROWidget(QWidget):
                 print(f"{save_dir=}")
                 worker = self._download_experiment_worker(save_dir) # type: ignore
                 self.worker_manager.add_active(worker, max_iter=len(self.view.cases))
+
+    @thread_worker
+    def _download_results_worker(self, out_file: str):
+        if self.project is None:
+            return
+
+        self.project.export_results(out_file)
+        show_info(f"Saved {out_file}")
+
+    def _download_results(self, *args, **kwargs):
+        if self.project is None:
+            return
+
+        out_file, _ = QFileDialog.getSaveFileName(
+            self,
+            caption="Save tracking results",
+            directory=f"Project_{self.project.id}_tracking_results.csv",
+            filter="CSV (*.csv);;Parquet (*.parquet)",
+        )
+        if out_file != "":
+            worker = self._download_results_worker(out_file) # type: ignore
+            self.worker_manager.add_active(worker)
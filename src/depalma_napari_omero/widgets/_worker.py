@@ -33,7 +33,12 @@ class WorkerManager:
         self._grayout_ui()
         worker.start()
 
-    def update_pbar(self, value: int):
+    def update_pbar(self, value):
+        # Workers can also yield `(value, maximum, message)` to describe each step
+        if isinstance(value, tuple):
+            value, maximum, message = value
+            self.pbar.setMaximum(maximum)
+            self.pbar.setFormat(f"{message} (%p%)")
         self.pbar.setValue(value)
 
     def _grayout_ui(self):
@@ -48,6 +53,7 @@ class WorkerManager:
         if self.n_active <= 1:
             self._ungrayout_ui()
             self.pbar.setMaximum(1)
+            self.pbar.setFormat("%p%")
             self.clear()
         else:
             self.active_workers.pop(0)
@@ -0,0 +1,108 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from depalma_napari_omero.omero_client._queue import Lease, WorkQueue, worker_name
+
+
+def _claim_all(path: str, lease_seconds: float):
+    """Claims and completes items until the queue is empty; returns the keys claimed by this process."""
+    queue = WorkQueue(path)
+    owner = worker_name()
+    keys = []
+    while True:
+        item = queue.claim(owner, lease_seconds)
+        if item is None:
+            return keys
+        keys.append(item.key)
+        assert queue.complete(item.key, owner)
+
+
+def _claim_and_exit(path: str, lease_seconds: float):
+    """Claims an item and exits without completing it, like a worker that was killed."""
+    item = WorkQueue(path).claim(worker_name(), lease_seconds)
+    return None if item is None else item.key
+
+
+def _executor(n_workers: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(n_workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def test_items_are_claimed_once_by_concurrent_workers(tmp_path):
+    path = str(tmp_path / "queue.db")
+    queue = WorkQueue(path)
+    for k in range(40):
+        queue.put(f"item:{k}", "roi", {"k": k})
+
+    with _executor(4) as executor:
+        futures = [executor.submit(_claim_all, path, 60) for _ in range(4)]
+        claimed = [key for future in futures for key in future.result()]
+
+    assert sorted(claimed) == sorted(f"item:{k}" for k in range(40))
+    assert queue.counts()["done"] == 40
+
+
+def test_expired_lease_is_claimed_again_until_max_attempts(tmp_path):
+    path = str(tmp_path / "queue.db")
+    queue = WorkQueue(path, max_attempts=2)
+    queue.put("item", "roi", {})
+
+    for _ in range(2):
+        with _executor(1) as executor:
+            assert executor.submit(_claim_and_exit, path, 0.2).result() == "item"
+        time.sleep(0.3)
+
+    # The second expired lease was the last attempt
+    assert queue.claim(worker_name(), 60) is None
+    assert queue.counts()["failed"] == 1
+
+
+def test_lease_check_detects_a_takeover(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.db")
+    queue.put("item", "roi", {})
+
+    owner = worker_name()
+    item = queue.claim(owner, 0.2)
+    with Lease(queue, item, owner, 60) as lease:
+        # The lease expires before the heartbeat renews it, and another worker takes the item over
+        time.sleep(0.3)
+        assert queue.claim(worker_name(), 60) is not None
+        with pytest.raises(RuntimeError):
+            lease.check()
+
+    assert not queue.complete(item.key, owner)
+
+
+def test_lease_is_lost_when_the_heartbeat_fails(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.db")
+    queue.put("item", "roi", {})
+
+    owner = worker_name()
+    item = queue.claim(owner, 0.3)
+
+    def _fail(*args):
+        raise OSError("The queue file is unreachable.")
+
+    queue.heartbeat = _fail
+    with Lease(queue, item, owner, 0.3) as lease:
+        time.sleep(0.3)
+        assert not lease.is_held
+        with pytest.raises(RuntimeError):
+            lease.check()
+
+
+def test_payload_updates_are_kept_for_the_next_attempt(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.db")
+    queue.put("item", "roi", {"k": 0})
+
+    owner = worker_name()
+    item = queue.claim(owner, 0.2)
+    with Lease(queue, item, owner, 60) as lease:
+        lease.update_payload(roi_id=12)
+
+    time.sleep(0.3)
+    item = queue.claim(worker_name(), 60)
+    assert item.payload == {"k": 0, "roi_id": 12}
+    assert item.attempts == 2
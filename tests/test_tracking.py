@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+mousetumorpy = pytest.importorskip("mousetumorpy")
+
+import mousetumorpy.register
+from depalma_napari_omero.omero_client import _inference
+
+
+def _fake_fit(lungs0: np.ndarray, lungs1: np.ndarray) -> np.ndarray:
+    """Deterministic stand-in for the lungs registration: a slight scaling plus the shift of the lungs centroids."""
+    phi = np.diag([0.9, 0.95, 1.05, 1.0])
+    c0 = np.argwhere(lungs0).mean(axis=0)
+    c1 = np.argwhere(lungs1).mean(axis=0)
+    phi[:3, 3] = c1 - phi[:3, :3] @ c0
+    return phi
+
+
+@pytest.fixture
+def fake_registration(monkeypatch):
+    monkeypatch.setattr(mousetumorpy.register, "_fit_affine_from_lungs_masks", _fake_fit)
+    monkeypatch.setattr(_inference, "_fit_affine_from_lungs_masks", _fake_fit)
+
+
+def _timeseries(n_scans: int = 3, seed: int = 0):
+    """Tumors (cubes) that grow and move with the lungs from one scan to the next."""
+    rng = np.random.default_rng(seed)
+    shape = (40, 64, 64)
+    centers = rng.integers(10, 30, size=(6, 3)) * np.array([1, 1.5, 1.5])
+    sizes = rng.integers(3, 7, size=6)
+
+    tumor_timeseries = np.zeros((n_scans, *shape), dtype=np.uint16)
+    lungs_timeseries = np.zeros((n_scans, *shape), dtype=np.uint8)
+    for t in range(n_scans):
+        shift = np.array([t, 2 * t, -t])
+        lungs_timeseries[t, 5 + t : 35 + t, 10 + 2 * t : 50 + 2 * t, 12 - t : 52 - t] = 1
+        for label, (center, size) in enumerate(zip(centers, sizes), start=1):
+            z, y, x = (center + shift).astype(int)
+            s = size + t
+            tumor_timeseries[t, z - s : z + s, y - s : y + s, x - s : x + s] = label
+
+    return tumor_timeseries, lungs_timeseries
+
+
+def _sorted(linkage_df: pd.DataFrame) -> pd.DataFrame:
+    columns = ["scan", "label", "tumor", "volume"]
+    return linkage_df[columns].astype(float).sort_values(["scan", "label"]).reset_index(drop=True)
+
+
+def test_track_linkage_matches_run_tracking(fake_registration):
+    tumor_timeseries, lungs_timeseries = _timeseries()
+
+    expected = mousetumorpy.run_tracking(
+        tumor_timeseries,
+        lungs_timeseries=lungs_timeseries,
+        with_lungs_registration=True,
+        method="laptrack",
+        remove_partially_tracked=False,
+        **_inference._TRACKING_PARAMS,
+    )
+
+    # Without cached transforms
+    linkage_df, transforms = _inference.track_linkage(tumor_timeseries, lungs_timeseries)
+    pd.testing.assert_frame_equal(_sorted(linkage_df), _sorted(expected))
+
+    # With the transforms of the previous run
+    cached_df, _ = _inference.track_linkage(tumor_timeseries, lungs_timeseries, transforms)
+    pd.testing.assert_frame_equal(_sorted(cached_df), _sorted(expected))
+
+
+def test_cached_transforms_are_not_fitted_again(fake_registration, monkeypatch):
+    tumor_timeseries, lungs_timeseries = _timeseries()
+    _, transforms = _inference.track_linkage(tumor_timeseries, lungs_timeseries)
+
+    def _fail(*args):
+        raise AssertionError("The registration should not be fitted again.")
+
+    monkeypatch.setattr(_inference, "_fit_affine_from_lungs_masks", _fail)
+    _inference.track_linkage(tumor_timeseries, lungs_timeseries, transforms)
+
+
+def test_partially_tracked_tumors_are_kept_as_in_run_tracking(fake_registration):
+    tumor_timeseries, lungs_timeseries = _timeseries()
+
+    # One tumor vanishes after the first scan, and another one in the last scan
+    tumor_timeseries[1:][tumor_timeseries[1:] == 1] = 0
+    tumor_timeseries[2][tumor_timeseries[2] == 2] = 0
+
+    expected = mousetumorpy.run_tracking(
+        tumor_timeseries,
+        lungs_timeseries=lungs_timeseries,
+        with_lungs_registration=True,
+        method="laptrack",
+        remove_partially_tracked=False,
+        **_inference._TRACKING_PARAMS,
+    )
+
+    formatted_df, _ = _inference.track_timeseries(tumor_timeseries, lungs_timeseries)
+    pd.testing.assert_frame_equal(
+        formatted_df.sort_index(axis=1).reset_index(drop=True),
+        mousetumorpy.to_formatted_df(expected).sort_index(axis=1).reset_index(drop=True),
+    )